@@ -24,11 +24,23 @@ except ImportError:
     def has_visualization_data(df): return False
 
 try:
-    from print_report import generate_printable_report
-    from print_performance_report import generate_performance_report_html
+    from report_cache import printable_report_html as generate_printable_report
+    from report_cache import performance_report_html as generate_performance_report_html
+    from report_cache import fragment_cache
 except ImportError:
-    def generate_printable_report(*args): return ""
-    def generate_performance_report_html(*args): return ""
+    fragment_cache = None
+    def generate_printable_report(*args, **kwargs): return ""
+    def generate_performance_report_html(*args, **kwargs): return ""
+
+try:
+    from line_register import line_identity_cache, get_registration_outbox
+    from gas_client import all_client_status
+    from auth import login_throttle
+except ImportError:
+    login_throttle = None
+    line_identity_cache = None
+    get_registration_outbox = None
+    def all_client_status(): return []
 
 try:
     from batch_print import display_print_center_page
@@ -51,6 +63,23 @@ except Exception as e:
     def display_main_report(p, a): st.error("Main Report Function Missing")
     def display_performance_report(p, r, a=None): st.error("Performance Report Function Missing")
 
+def render_data_status_indicator(status):
+    """แสดงสถานะชุดข้อมูล (เวอร์ชัน / เวลาที่โหลด / refresh ล่าสุดล้มเหลวหรือไม่)"""
+    if not status: return
+    version = (status.get('version') or '-')[:8]
+    loaded_at = status.get('loaded_at')
+    loaded_text = loaded_at.strftime('%d/%m/%Y %H:%M') if loaded_at else '-'
+    if status.get('state') == 'stale':
+        st.warning(f"⚠️ ใช้ข้อมูลเวอร์ชันเดิม ({version}) เนื่องจากอัปเดตไม่สำเร็จ: {status.get('last_error')}")
+    else:
+        st.caption(f"🟢 ข้อมูลเวอร์ชัน {version} | โหลดเมื่อ {loaded_text}")
+    memory = status.get('memory')
+    if memory:
+        st.caption(f"💾 หน่วยความจำ {memory['before'] / 1024**2:.1f} MB → {memory['after'] / 1024**2:.1f} MB "
+                   f"(category {memory['category']} / sparse {memory['sparse']} คอลัมน์)")
+    if status.get('refreshing'):
+        st.caption("🔄 กำลังตรวจสอบข้อมูลใหม่...")
+
 # Note: We duplicate the custom header function here to avoid circular imports with app.py
 def render_admin_header_with_actions(person_data, available_years):
     name = person_data.get('ชื่อ-สกุล', '-')
@@ -172,9 +201,8 @@ def render_admin_header_with_actions(person_data, available_years):
         if st.button("🖨️ พิมพ์สมรรถภาพ", key="adm_print_p", use_container_width=True):
             st.session_state.admin_print_performance_trigger = True
 
-def display_admin_panel(df):
+def display_admin_panel(dataset):
     """แสดงหน้าจอหลักสำหรับ Admin (Search Panel)"""
-    
     st.set_page_config(page_title="Admin Panel", layout="wide")
     inject_custom_css()
 
@@ -184,17 +212,33 @@ def display_admin_panel(df):
     if 'admin_selected_year' not in st.session_state: st.session_state.admin_selected_year = None
     if 'admin_print_trigger' not in st.session_state: st.session_state.admin_print_trigger = False
     if 'admin_print_performance_trigger' not in st.session_state: st.session_state.admin_print_performance_trigger = False
-    if "admin_person_row" not in st.session_state: st.session_state.admin_person_row = None
 
     with st.sidebar:
         st.title("Admin Panel")
+        render_data_status_indicator(st.session_state.get('data_status'))
+        if line_identity_cache is not None:
+            cache_stats = line_identity_cache.stats()
+            st.caption(f"🔑 LINE ID cache: hit {cache_stats['hits']} / miss {cache_stats['misses']} ({cache_stats['hit_rate']:.0%})")
+        if fragment_cache is not None:
+            frag_stats = fragment_cache.stats()
+            st.caption(f"🧩 Report cache: {frag_stats['size']}/{frag_stats['maxsize']} (hit {frag_stats['hit_rate']:.0%})")
+        if get_registration_outbox is not None:
+            outbox_stats = get_registration_outbox().stats()
+            if outbox_stats['pending'] or outbox_stats['unconfirmed'] or outbox_stats['failed']:
+                st.caption(f"📨 คิวลงทะเบียน LINE: รอส่ง {outbox_stats['pending']} / รอตรวจผล {outbox_stats['unconfirmed']} "
+                           f"/ ส่งไม่สำเร็จ {outbox_stats['failed']}")
+        if login_throttle is not None and login_throttle.alerts():
+            st.warning(f"⚠️ มีเลขบัตร {login_throttle.alerts()} รายการที่ถูกลองชื่อผิดซ้ำหลายครั้ง (ช่วง 15 นาทีล่าสุด)")
+        for client_status in all_client_status():
+            if client_status['breaker'] != 'closed':
+                st.warning(f"⚠️ Apps Script ขัดข้อง (circuit {client_status['breaker']}) ลองใหม่ใน {client_status['retry_after']:.0f} วินาที")
         if st.button("ออกจากระบบ (Logout)", use_container_width=True):
             keys_to_clear = [
                 'authenticated', 'pdpa_accepted', 'user_hn', 'user_name', 'is_admin',
-                'search_result', 'selected_year', 'person_row', 'selected_row_found',
+                'selected_year', 'selected_row_found',
                 'admin_search_term', 'admin_search_results', 'admin_selected_hn',
-                'admin_selected_year', 'admin_person_row', 'batch_print_ready', 'batch_print_html',
-                'bp_dept_filter', 'bp_date_filter', 'bp_report_type'
+                'admin_selected_year', 'batch_print_volume', 'batch_print_job_id',
+                'bp_dept_filter', 'bp_date_filter', 'bp_report_type', 'data_status'
             ]
             for key in keys_to_clear:
                 if key in st.session_state: del st.session_state[key]
@@ -215,27 +259,22 @@ def display_admin_panel(df):
         if submitted:
             st.session_state.admin_search_term = search_term
             if search_term:
-                nm_search = normalize_name(search_term)
-                mask = (df['ชื่อ-สกุล'].apply(normalize_name).str.contains(nm_search, case=False, na=False) |
-                        (df['HN'].astype(str) == search_term) |
-                        (df['เลขบัตรประชาชน'].astype(str) == search_term))
-                results = df[mask]
-                st.session_state.admin_search_results = results if not results.empty else pd.DataFrame()
-                st.session_state.admin_selected_hn = results['HN'].iloc[0] if len(results['HN'].unique()) == 1 else None
+                # ค้นหาผ่าน NameSearchIndex (HN / เลขบัตรตรงตัว + ชื่อแบบ trigram ทนคำสะกดผิด)
+                # เก็บเฉพาะรายการ HN ใน session_state (ไม่เก็บ DataFrame)
+                result_hns = [hit.hn for hit in dataset.search_index.search(search_term)]
+                st.session_state.admin_search_results = result_hns
+                st.session_state.admin_selected_hn = result_hns[0] if len(result_hns) == 1 else None
             else:
                 st.session_state.admin_search_results = None
             st.session_state.admin_selected_year = None
-            st.session_state.admin_person_row = None
             st.rerun()
 
         if st.session_state.admin_search_results is not None:
-            results = st.session_state.admin_search_results
-            if results.empty:
+            hn_list = list(st.session_state.admin_search_results)
+            if not hn_list:
                 st.warning("ไม่พบข้อมูล")
             else:
-                unique_results = results.drop_duplicates(subset=['HN']).set_index('HN')
-                options = {hn: f"{row['ชื่อ-สกุล']} (HN: {hn})" for hn, row in unique_results.iterrows()}
-                hn_list = list(options.keys())
+                options = {hn: f"{dataset.search_index.display_name(hn)} (HN: {hn})" for hn in hn_list}
                 
                 if len(hn_list) > 1 or st.session_state.admin_selected_hn is None:
                     curr = st.session_state.admin_selected_hn if st.session_state.admin_selected_hn in hn_list else hn_list[0]
@@ -243,12 +282,12 @@ def display_admin_panel(df):
                     if sel_hn != st.session_state.admin_selected_hn:
                         st.session_state.admin_selected_hn = sel_hn
                         st.session_state.admin_selected_year = None
-                        st.session_state.admin_person_row = None
                         st.rerun()
                 
                 if st.session_state.admin_selected_hn:
                     hn = st.session_state.admin_selected_hn
-                    history = df[df['HN'] == hn].copy()
+                    history = dataset.patient_history(hn)
+                    p_row = None
                     years = sorted(history["Year"].dropna().unique().astype(int), reverse=True)
                     
                     if years:
@@ -257,17 +296,11 @@ def display_admin_panel(df):
                         
                         if sel_year != st.session_state.admin_selected_year:
                             st.session_state.admin_selected_year = sel_year
-                            st.session_state.admin_person_row = None
                             st.rerun()
 
-                        if st.session_state.admin_person_row is None:
-                            yr_df = history[history["Year"] == sel_year]
-                            if not yr_df.empty:
-                                st.session_state.admin_person_row = yr_df.bfill().ffill().iloc[0].to_dict()
+                        p_row = dataset.patient_year_row(hn, sel_year)
                     
-                    if st.session_state.admin_person_row:
-                        p_row = st.session_state.admin_person_row
-                        
+                    if p_row:
                         # Use Custom Header with Print Actions
                         render_admin_header_with_actions(p_row, years)
                         
@@ -292,17 +325,17 @@ def display_admin_panel(df):
 
                     # Handle Print Triggers in Admin Panel
                     if st.session_state.admin_print_trigger:
-                        h = generate_printable_report(st.session_state.admin_person_row, history)
+                        h = generate_printable_report(p_row, history, dataset=dataset)
                         b64_html = base64.b64encode(h.encode('utf-8')).decode('utf-8')
                         st.components.v1.html(f"<script>var w=window.open('','_blank');w.document.write(decodeURIComponent(escape(window.atob('{b64_html}'))));w.document.close();</script>", height=0)
                         st.session_state.admin_print_trigger = False
                     
                     if st.session_state.admin_print_performance_trigger:
-                        h = generate_performance_report_html(st.session_state.admin_person_row, history)
+                        h = generate_performance_report_html(p_row, history, dataset=dataset)
                         b64_html = base64.b64encode(h.encode('utf-8')).decode('utf-8')
                         st.components.v1.html(f"<script>var w=window.open('','_blank');w.document.write(decodeURIComponent(escape(window.atob('{b64_html}'))));w.document.close();</script>", height=0)
                         st.session_state.admin_print_performance_trigger = False
 
     # --- TAB 2: Print Center ---
     with tab_print:
-        display_print_center_page(df)
+        display_print_center_page(dataset)
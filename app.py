@@ -5,21 +5,18 @@ import streamlit as st
 # -----------------------------------------------------------------------------
 st.set_page_config(page_title="Health Report System", layout="wide")
 
-import sqlite3
-import requests
 import pandas as pd
-import tempfile
 import os
 import json
+import importlib
+from concurrent.futures import ThreadPoolExecutor
 from collections import OrderedDict
 from datetime import datetime
 
-# --- Import Library สำหรับเช็คหน้าจอ ---
-try:
-    from streamlit_js_eval import streamlit_js_eval
-except ImportError:
-    # Fallback ถ้าไม่มี library
-    def streamlit_js_eval(**kwargs): return 1200 # สมมติว่าเป็น Desktop ไว้ก่อน
+# --- Import Data Loader ---
+from data_loader import DatasetRefresher
+from gas_client import get_client, GasError, CircuitOpenError, POOL_SIZE as GAS_POOL_SIZE
+from health_dataset import HealthDataset, SqlitePatientStore, read_health_table_columnar, columnar_snapshot_path, normalize_cid
 
 # --- Import Authentication & Consent ---
 from auth import authentication_flow, pdpa_consent_page
@@ -30,20 +27,12 @@ from line_register import (
     check_if_user_registered, 
     normalize_db_name_field,
     render_registration_page,
-    render_admin_line_manager
+    render_admin_line_manager,
+    line_identity_cache,
+    LINE_IDENTITY_TTL_SECONDS,
+    LINE_IDENTITY_NEGATIVE_TTL_SECONDS
 )
 
-# --- Import Print Functions ---
-try:
-    from print_report import generate_printable_report
-except Exception:
-    def generate_printable_report(*args): return ""
-
-try:
-    from print_performance_report import generate_performance_report_html
-except Exception:
-    def generate_performance_report_html(*args): return ""
-
 # --- Import Utils ---
 try:
     from utils import (
@@ -58,62 +47,70 @@ except Exception:
     def has_lung_data(r): return False
     def has_visualization_data(d): return False
 
-# --- Import Visualization ---
-try:
-    from visualization import display_visualization_tab
-except Exception:
-    def display_visualization_tab(d, a): st.info("No visualization module")
-
-# --- Import Shared UI ---
-try:
-    from shared_ui import (
-        inject_custom_css, 
-        inject_keep_awake,  # เพิ่ม import นี้
-        display_main_report, 
-        display_performance_report,
-        # เราจะไม่ใช้ display_common_header ตัวเดิมแล้ว เพราะจะสร้างใหม่ในนี้เพื่อแทรกปุ่ม
-        get_float 
-    )
-except Exception:
-    def inject_custom_css(): pass
-    def inject_keep_awake(): pass # Fallback
-    def display_main_report(p, a): st.error("Main Report Module Missing")
-    def display_performance_report(p, t, a=None): pass
-    def get_float(c, p): return None
-
-# --- Import Admin Panel ---
-try:
-    from admin_panel import display_admin_panel
-except Exception:
-    def display_admin_panel(df): st.error("Admin Panel Error")
+# --- Lazy Imports ---
+# โมดูลหน้าแสดงผล/พิมพ์/Admin (plotly ฯลฯ) โหลดเมื่อถูกเรียกครั้งแรก
+# หน้า Login / PDPA จึงไม่ต้องรอ import โมดูลเหล่านี้ (ดูเวลา import ได้ด้วย profile_imports.py)
+def lazy_function(module_name, attr, fallback):
+    """คืนฟังก์ชันที่ import module_name.attr ตอนถูกเรียก (import ไม่ได้ -> ใช้ fallback)"""
+    def wrapper(*args, **kwargs):
+        try:
+            impl = getattr(importlib.import_module(module_name), attr)
+        except Exception:
+            impl = fallback
+        return impl(*args, **kwargs)
+    wrapper.__name__ = attr
+    return wrapper
+
+def _missing_visualization(d, a): st.info("No visualization module")
+def _missing_main_report(p, a): st.error("Main Report Module Missing")
+def _missing_admin_panel(dataset): st.error("Admin Panel Error")
+
+# --- Print Functions ---
+# ใช้ body จาก fragment cache (report_cache.py) ร่วมกับ Admin / Print Center
+generate_printable_report = lazy_function("report_cache", "printable_report_html", lambda *args, **kwargs: "")
+generate_performance_report_html = lazy_function("report_cache", "performance_report_html", lambda *args, **kwargs: "")
+
+# --- Visualization ---
+display_visualization_tab = lazy_function("visualization", "display_visualization_tab", _missing_visualization)
+
+# --- Shared UI ---
+inject_custom_css = lazy_function("shared_ui", "inject_custom_css", lambda: None)
+inject_keep_awake = lazy_function("shared_ui", "inject_keep_awake", lambda: None)
+display_main_report = lazy_function("shared_ui", "display_main_report", _missing_main_report)
+display_performance_report = lazy_function("shared_ui", "display_performance_report", lambda p, t, all_person_history_df=None: None)
+get_float = lazy_function("shared_ui", "get_float", lambda c, p: None)
+
+# --- Admin Panel ---
+display_admin_panel = lazy_function("admin_panel", "display_admin_panel", _missing_admin_panel)
 
 # -----------------------------------------------------------------------------
 # Configuration & Helper Functions
 # -----------------------------------------------------------------------------
 
-GAS_URL = "https://script.google.com/macros/s/AKfycbzmtd5H-YZr8EeeTUab3M2L2nEtUofDBtYCP9-CN6MVfIff94P6lDWS-cUHCi9asLlR/exec"
+# ตั้งค่าผ่าน environment ได้ (เช่น ชี้ไปที่ fake_services.py ตอนทดสอบ offline)
+GAS_URL = os.environ.get("HEALTH_GAS_URL", "https://script.google.com/macros/s/AKfycbzmtd5H-YZr8EeeTUab3M2L2nEtUofDBtYCP9-CN6MVfIff94P6lDWS-cUHCi9asLlR/exec")
 SQLITE_CITIZEN_ID_COL = "เลขบัตรประชาชน"  
 SQLITE_NAME_COL = "ชื่อ-สกุล"           
-
-def normalize_cid(val):
-    """ฟังก์ชันทำความสะอาดเลขบัตรประชาชนให้เป็นตัวเลข 13 หลักล้วน"""
-    if pd.isna(val): return ""
-    s = str(val).strip().replace("-", "").replace(" ", "").replace("'", "").replace('"', "")
-    if "E" in s or "e" in s:
-        try: s = str(int(float(s)))
-        except: pass
-    if s.endswith(".0"): s = s[:-2]
-    return s
+# "full" = โหลดทั้งตารางเข้า RAM, "lazy" = query เฉพาะแถวของผู้ป่วยจาก SQLite
+HEALTH_DATA_MODE = os.environ.get("HEALTH_DATA_MODE", "full").strip().lower()
 
 def get_user_info_from_gas(line_user_id):
-    """ถาม Google Sheet ว่า UserID นี้คือใคร"""
+    """ถาม Google Sheet ว่า UserID นี้คือใคร (ผลพบ/ไม่พบถูก cache ไว้ ส่วน error ไม่ cache)"""
+    key = str(line_user_id).strip()
+    cached = line_identity_cache.get(key)
+    if cached is not None: return dict(cached)
     try:
-        url = f"{GAS_URL}?action=get_user&line_id={line_user_id}"
-        response = requests.get(url, timeout=15)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
+        result = get_client(GAS_URL).call("get_user", {"line_id": line_user_id})
+    except CircuitOpenError as e:
+        # Degraded mode: ไม่รอ Apps Script ที่ล่มอยู่ ให้ผู้ใช้เข้าด้วยชื่อ-นามสกุลแทน
+        return {"found": False, "error": str(e), "degraded": True}
+    except GasError as e:
         return {"found": False, "error": str(e)}
+    if not isinstance(result, dict): return {"found": False, "error": f"Unexpected response: {str(result)[:50]}"}
+    if not result.get("error"):
+        ttl = LINE_IDENTITY_TTL_SECONDS if result.get("found") else LINE_IDENTITY_NEGATIVE_TTL_SECONDS
+        line_identity_cache.set(key, dict(result), ttl=ttl)
+    return result
 
 # --- Custom Header Function (เพื่อการจัดวางตามต้องการ) ---
 def render_custom_header_with_actions(person_data, available_years):
@@ -299,50 +296,51 @@ def render_custom_header_with_actions(person_data, available_years):
 # -----------------------------------------------------------------------------
 # Data Loading
 # -----------------------------------------------------------------------------
-@st.cache_data(ttl=600)
+def build_health_dataset(snapshot):
+    """สร้าง dataset จาก snapshot 1 เวอร์ชัน (เรียกจาก background refresher)"""
+    if HEALTH_DATA_MODE == "lazy":
+        # Query รายผู้ป่วยจากไฟล์ SQLite โดยตรง (ทั้งตารางจะโหลดเมื่อเข้าหน้า Admin เท่านั้น)
+        return SqlitePatientStore(snapshot.path, version=snapshot.sha256)
+    # อ่านจาก columnar snapshot (memory-map) ที่ผูกกับ content hash แทนการ parse SQLite ทุกครั้ง
+    df_loaded, table_names = read_health_table_columnar(snapshot.path, snapshot.sha256)
+    snapshot_path = columnar_snapshot_path(snapshot.path, snapshot.sha256)
+    return HealthDataset(df_loaded, version=snapshot.sha256, table_names=table_names,
+                         snapshot_path=snapshot_path if os.path.exists(snapshot_path) else None)
+
+@st.cache_resource(show_spinner=False)
+def get_dataset_refresher():
+    # Singleton ต่อ process: โหลดครั้งแรกแบบรอผล จากนั้น refresh ใน background thread
+    return DatasetRefresher(build_health_dataset)
+
+@st.cache_resource(show_spinner=False)
+def get_startup_executor():
+    # Thread pool ร่วมทั้ง process สำหรับงาน I/O ตอนเปิดแอป (งานใน pool ห้ามเรียก st.*)
+    # ขนาดเท่า connection pool ของ Apps Script: ช่วงคนเปิดพร้อมกันตอนเช้า session ไม่ต้องต่อคิวรอกันเกินกว่าที่ HTTP รับได้จริง
+    return ThreadPoolExecutor(max_workers=GAS_POOL_SIZE, thread_name_prefix="startup")
+
 def load_sqlite_data():
-    tmp_path = None
+    """คืน HealthDataset ตัวเดียวกันให้ทุก session (ไม่ copy DataFrame ต่อ session/rerun)"""
+    refresher = get_dataset_refresher()
     try:
-        file_id = "1HruO9AMrUfniC8hBWtumVdxLJayEc1Xr"
-        download_url = f"https://drive.google.com/uc?export=download&id={file_id}"
-        response = requests.get(download_url)
-        response.raise_for_status()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".db") as tmp:
-            tmp.write(response.content)
-            tmp_path = tmp.name
-        conn = sqlite3.connect(tmp_path)
-        tables = pd.read_sql("SELECT name FROM sqlite_master WHERE type='table';", conn)
-        st.session_state['debug_tables'] = tables['name'].tolist()
-        table_name = "health_data" 
-        if table_name not in st.session_state['debug_tables']:
-             if len(st.session_state['debug_tables']) > 0: table_name = st.session_state['debug_tables'][0]
-        df_loaded = pd.read_sql(f"SELECT * FROM {table_name}", conn)
-        conn.close()
-        df_loaded.columns = df_loaded.columns.str.strip()
-        df_loaded['HN'] = df_loaded['HN'].astype(str).str.strip().apply(lambda x: x[:-2] if x.endswith('.0') else x)
-        if SQLITE_NAME_COL in df_loaded.columns:
-            df_loaded[SQLITE_NAME_COL] = df_loaded[SQLITE_NAME_COL].astype(str).str.strip().str.replace(r'\s+', ' ', regex=True)
-        if SQLITE_CITIZEN_ID_COL in df_loaded.columns:
-            df_loaded[SQLITE_CITIZEN_ID_COL] = df_loaded[SQLITE_CITIZEN_ID_COL].apply(normalize_cid)
-        df_loaded['Year'] = df_loaded['Year'].astype(int)
-        return df_loaded
+        dataset = refresher.get()
     except Exception as e:
         st.error(f"❌ โหลดฐานข้อมูลไม่สำเร็จ: {e}")
         return None
-    finally:
-        if tmp_path and os.path.exists(tmp_path): os.remove(tmp_path)
+    st.session_state['debug_tables'] = dataset.table_names
+    st.session_state['data_status'] = refresher.status()
+    return dataset
 
 # -----------------------------------------------------------------------------
 # Main App Logic
 # -----------------------------------------------------------------------------
-def main_app(df):
+def main_app(dataset):
     inject_custom_css()
     inject_keep_awake() # Call this to keep the screen awake
     
     if 'user_hn' not in st.session_state: st.stop()
     user_hn = st.session_state['user_hn']
-    results_df = df[df['HN'] == user_hn].copy()
-    st.session_state['search_result'] = results_df
+    # session_state เก็บแค่ HN / ปี ส่วนข้อมูลดึงจาก dataset กลางทุกครั้ง (slice ไม่ copy)
+    results_df = dataset.patient_history(user_hn)
 
     if results_df.empty:
         st.error(f"ไม่พบข้อมูลผลตรวจสำหรับ HN: {user_hn}")
@@ -354,9 +352,7 @@ def main_app(df):
         st.session_state.selected_year = available_years[0]
 
     # --- ส่วนแสดงผลรายงาน ---
-    yr_df = results_df[results_df["Year"] == st.session_state.selected_year]
-    person_row = yr_df.bfill().ffill().iloc[0].to_dict() if not yr_df.empty else None
-    st.session_state.person_row = person_row
+    person_row = dataset.patient_year_row(user_hn, st.session_state.selected_year)
 
     if person_row:
         # ใช้ Custom Header ที่เราสร้างขึ้นใหม่แทน display_common_header เดิม
@@ -380,11 +376,11 @@ def main_app(df):
 
         # Print Logic
         if st.session_state.get('print_trigger'):
-            h = generate_printable_report(person_row, results_df)
+            h = generate_printable_report(person_row, results_df, dataset=dataset)
             st.components.v1.html(f"<script>var w=window.open();w.document.write({json.dumps(h)});w.print();w.close();</script>", height=0)
             st.session_state.print_trigger = False
         if st.session_state.get('print_performance_trigger'):
-            h = generate_performance_report_html(person_row, results_df)
+            h = generate_performance_report_html(person_row, results_df, dataset=dataset)
             st.components.v1.html(f"<script>var w=window.open();w.document.write({json.dumps(h)});w.print();w.close();</script>", height=0)
             st.session_state.print_performance_trigger = False
 
@@ -395,18 +391,25 @@ def main_app(df):
 if 'authenticated' not in st.session_state: st.session_state['authenticated'] = False
 if 'pdpa_accepted' not in st.session_state: st.session_state['pdpa_accepted'] = False
 
-df = load_sqlite_data()
-if df is None: st.stop()
-
-# --- Auto-Login Logic ---
 query_params = st.query_params
 line_user_id = query_params.get("userid")
+line_login_pending = bool(line_user_id) and not st.session_state['authenticated']
+
+# ถามตัวตน LINE (Apps Script) ใน thread pool ระหว่างที่โหลด/ตรวจเวอร์ชันฐานข้อมูล แล้วค่อยรอผลทั้งสองอย่าง
+identity_future = get_startup_executor().submit(get_user_info_from_gas, line_user_id) if line_login_pending else None
+
+dataset = load_sqlite_data()
+if dataset is None: st.stop()
 
-if line_user_id and not st.session_state['authenticated']:
+# --- Auto-Login Logic ---
+if line_login_pending:
     st.session_state["line_user_id"] = line_user_id
     st.info("⏳ กำลังตรวจสอบสิทธิ์การใช้งาน LINE...")
     
-    u_info = get_user_info_from_gas(line_user_id)
+    try:
+        u_info = identity_future.result()
+    except Exception as e:
+        u_info = {"found": False, "error": str(e)}
     
     if u_info.get('found'):
         cid = normalize_cid(u_info.get('card_id'))
@@ -414,15 +417,12 @@ if line_user_id and not st.session_state['authenticated']:
         lname = u_info.get('lname', '').strip()
         
         # ค้นหาในฐานข้อมูล
-        match = df[df[SQLITE_CITIZEN_ID_COL] == cid]
+        match = dataset.rows_for_cid(cid)
         user_found = None
         if not match.empty:
             if fname and lname:
-                for _, row in match.iterrows():
-                    db_f, db_l = normalize_db_name_field(row[SQLITE_NAME_COL])
-                    if db_f == fname and db_l.replace(" ","") == lname.replace(" ",""):
-                        user_found = row; break
-            if user_found is None: user_found = match.iloc[0]
+                user_found = dataset.find_patient(cid, fname, lname)
+            if user_found is None: user_found = match.iloc[0].to_dict()
         
         if user_found is not None:
             st.session_state.update({
@@ -434,6 +434,8 @@ if line_user_id and not st.session_state['authenticated']:
             st.rerun()
         else:
             st.session_state['login_error'] = f"❌ ไม่พบประวัติสุขภาพของเลขบัตร '{cid}' ในระบบโรงพยาบาล"
+    elif u_info.get('error'):
+        st.session_state['login_error'] = "⚠️ ระบบตรวจสอบบัญชี LINE ขัดข้องชั่วคราว กรุณาเข้าสู่ระบบด้วยชื่อ-นามสกุล"
     else:
         st.session_state['login_error'] = "❌ ไม่พบข้อมูลการลงทะเบียนของคุณในระบบ LINE"
 
@@ -446,9 +448,9 @@ if not st.session_state['authenticated']:
             del st.session_state["login_error"]
             st.rerun()
     else:
-        authentication_flow(df)
+        authentication_flow(dataset)
 elif not st.session_state['pdpa_accepted']:
     pdpa_consent_page()
 else:
-    if st.session_state.get('is_admin'): display_admin_panel(df)
-    else: main_app(df)
+    if st.session_state.get('is_admin'): display_admin_panel(dataset)
+    else: main_app(dataset)
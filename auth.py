@@ -3,6 +3,65 @@ import pandas as pd
 import os
 import base64
 import textwrap
+import time
+import uuid
+import threading
+
+from cache_utils import TTLLRUCache
+
+# --- Login Throttling & Verification Cache ---
+# ความพยายามที่ผิดติดกันเกิน LOGIN_FREE_ATTEMPTS ครั้งต่อ session (หรือ LOGIN_IP_FREE_ATTEMPTS ต่อ IP ซึ่งอาจมีหลายคนใช้ร่วมกัน)
+# จะถูกพักแบบ exponential backoff
+# เลขบัตรไม่ใช้พักการเข้าระบบ (คนที่รู้เลขบัตรของผู้อื่นจะล็อกเจ้าของบัตรได้) ใช้เป็นสัญญาณเตือนผู้ดูแลเท่านั้น
+LOGIN_FREE_ATTEMPTS = int(os.environ.get("LOGIN_FREE_ATTEMPTS", 3))
+LOGIN_IP_FREE_ATTEMPTS = int(os.environ.get("LOGIN_IP_FREE_ATTEMPTS", 20))
+LOGIN_CID_ALERT_ATTEMPTS = int(os.environ.get("LOGIN_CID_ALERT_ATTEMPTS", 10))
+LOGIN_BACKOFF_BASE_SECONDS = 2.0
+LOGIN_BACKOFF_MAX_SECONDS = 300.0
+LOGIN_FAILURE_WINDOW_SECONDS = 15 * 60
+# ผลยืนยันตัวตนที่ผ่านแล้ว (ต่อ session และเวอร์ชันข้อมูล) เก็บไว้สั้นๆ ให้การกดซ้ำ/rerun ไม่ต้องค้นใหม่
+VERIFIED_IDENTITY_TTL_SECONDS = 5 * 60
+
+class LoginThrottle:
+    """
+    นับความพยายามที่ผิดต่อ key (ชนิด, ค่า) เช่น ("session", id) / ("ip", address) / ("cid", เลขบัตร) ใน cache ขนาดจำกัด
+    - free_attempts: {ชนิด: จำนวนครั้งที่ผิดได้ก่อนเริ่มพัก} ชนิดที่ไม่อยู่ใน dict นี้นับอย่างเดียว ไม่พัก
+    - retry_after(keys) -> วินาทีที่ต้องรอก่อนลองใหม่ (0 = ลองได้)
+    - key ชนิดที่ไม่พัก (เช่น "cid") ที่ผิดครบ alert_attempts ครั้ง นับไว้ใน alerts() ให้ผู้ดูแลเห็น
+    """
+
+    def __init__(self, free_attempts=None, alert_attempts=LOGIN_CID_ALERT_ATTEMPTS, maxsize=10000, clock=time.monotonic):
+        self.free_attempts = free_attempts if free_attempts is not None else {"session": LOGIN_FREE_ATTEMPTS, "ip": LOGIN_IP_FREE_ATTEMPTS}
+        self.alert_attempts = alert_attempts
+        self._clock = clock
+        self._failures = TTLLRUCache(maxsize=maxsize, default_ttl=LOGIN_FAILURE_WINDOW_SECONDS, clock=clock)
+        self._alerts = TTLLRUCache(maxsize=1000, default_ttl=LOGIN_FAILURE_WINDOW_SECONDS, clock=clock)
+        self._lock = threading.Lock()
+
+    def retry_after(self, keys):
+        now = self._clock()
+        waits = [state[1] - now for state in (self._failures.get(k) for k in keys) if state]
+        return max([0.0] + waits)
+
+    def record_failure(self, keys):
+        with self._lock:
+            for key in keys:
+                count = (self._failures.get(key) or (0, 0.0))[0] + 1
+                over = count - self.free_attempts.get(key[0], count)
+                delay = min(LOGIN_BACKOFF_MAX_SECONDS, LOGIN_BACKOFF_BASE_SECONDS * (2 ** (over - 1))) if over > 0 else 0.0
+                self._failures.set(key, (count, self._clock() + delay))
+                if key[0] not in self.free_attempts and count >= self.alert_attempts: self._alerts.set(key, count)
+
+    def record_success(self, keys):
+        for key in keys: self._failures.invalidate(key)
+
+    def alerts(self):
+        """จำนวน key ที่ถูกเตือนภายในช่วงเวลานับ (เช่น เลขบัตรที่ถูกเดาชื่อซ้ำๆ)"""
+        self._alerts.purge_expired()
+        return len(self._alerts)
+
+login_throttle = LoginThrottle()
+verified_identity_cache = TTLLRUCache(maxsize=4096, default_ttl=VERIFIED_IDENTITY_TTL_SECONDS)
 
 # --- Helper Functions ---
 def clean_string(val):
@@ -33,7 +92,20 @@ def get_image_base64(path):
             return base64.b64encode(image_file.read()).decode()
     except Exception: return None
 
-def check_user_credentials(df, fname, lname, cid):
+def get_login_session_key():
+    """key ของ session นี้สำหรับ LoginThrottle"""
+    if '_login_session_key' not in st.session_state:
+        st.session_state['_login_session_key'] = uuid.uuid4().hex
+    return st.session_state['_login_session_key']
+
+def get_login_client_ip():
+    """IP ของผู้ใช้ (None ถ้า Streamlit รุ่นนี้ไม่รองรับหรือไม่ทราบ)"""
+    try:
+        return st.context.ip_address
+    except AttributeError:
+        return None
+
+def check_user_credentials(dataset, fname, lname, cid, session_key=None, client_ip=None):
     i_fname = clean_string(fname)
     i_lname = clean_string(lname)
     i_id = normalize_cid(cid)
@@ -47,26 +119,39 @@ def check_user_credentials(df, fname, lname, cid):
     if len(i_id) != 13:
         return False, "เลขบัตรประชาชนต้องมี 13 หลัก", None
 
-    # ค้นหาในคอลัมน์เลขบัตรประชาชน
-    user_match = df[df['เลขบัตรประชาชน'].astype(str) == i_id]
+    # พักเฉพาะผู้พยายาม (session / IP) ส่วนเลขบัตรนับไว้เตือนผู้ดูแล
+    # ตรวจก่อน cache เสมอ: ผู้ที่ถูกพักต้องไม่ผ่านด้วยผลยืนยันที่ค้างอยู่
+    throttle_keys = ([("session", session_key)] if session_key else []) + ([("ip", client_ip)] if client_ip else [])
+    cid_key = ("cid", i_id)
+    wait = login_throttle.retry_after(throttle_keys)
+    if wait > 0:
+        return False, f"พยายามเข้าสู่ระบบไม่สำเร็จหลายครั้ง กรุณารอ {wait:.0f} วินาทีแล้วลองใหม่", None
+
+    # ผลยืนยันที่ cache ไว้ใช้ได้เฉพาะ session เดิม (ไม่รู้ session = ไม่ใช้ cache)
+    cache_key = (session_key, getattr(dataset, "version", None), i_id, i_fname, i_lname) if session_key else None
+    cached = verified_identity_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        return True, "ยืนยันตัวตนสำเร็จ", dict(cached)
+
+    # ค้นหาในคอลัมน์เลขบัตรประชาชน (เทียบชื่อผ่านคอลัมน์คีย์ที่ normalize ไว้ตอนโหลด)
+    user_match = dataset.rows_for_cid(i_id)
 
     if user_match.empty:
+        login_throttle.record_failure(throttle_keys)
         return False, "ไม่พบเลขบัตรประชาชนนี้ในระบบ", None
 
-    found_user = None
-    for _, row in user_match.iterrows():
-        db_fname, db_lname = normalize_db_name_field(row['ชื่อ-สกุล'])
-        if (db_fname == i_fname) and (db_lname.replace(" ", "") == i_lname.replace(" ", "")):
-            found_user = row.to_dict()
-            break
+    found_user = dataset.find_patient(i_id, i_fname, i_lname)
     
     if found_user:
         found_user['role'] = 'user'
+        login_throttle.record_success(throttle_keys + [cid_key])
+        if cache_key: verified_identity_cache.set(cache_key, dict(found_user))
         return True, "ยืนยันตัวตนสำเร็จ", found_user
     else:
+        login_throttle.record_failure(throttle_keys + [cid_key])
         return False, "ชื่อหรือนามสกุลไม่ตรงกับฐานข้อมูล (แต่เลขบัตรถูกต้อง)", None
 
-def authentication_flow(df):
+def authentication_flow(dataset):
     # CSS ปรับแต่งปุ่มและฟอนต์ (ลบส่วนที่ครอบ div ออกเพื่อความเสถียร)
     login_style = """
     <style>
@@ -132,7 +217,8 @@ def authentication_flow(df):
                 submitted = st.form_submit_button("เข้าสู่ระบบ")
 
     if submitted:
-        success, msg, user_data = check_user_credentials(df, fname, lname, cid)
+        success, msg, user_data = check_user_credentials(dataset, fname, lname, cid, session_key=get_login_session_key(),
+                                                           client_ip=get_login_client_ip())
         if success:
             st.session_state['authenticated'] = True
             if user_data['role'] == 'admin':
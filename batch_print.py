@@ -1,32 +1,41 @@
 import streamlit as st
 import pandas as pd
 import html
+import os
 import json
-import re
+import uuid
+import atexit
+import threading
 from datetime import datetime
+from health_dataset import normalize_cid
+from cache_utils import TTLLRUCache
 
 # --- Import ฟังก์ชันสำหรับการสร้างรายงาน (Report Generation) ---
-from print_report import (
-    render_printable_report_body,
-    get_main_report_css
-)
-from print_performance_report import (
-    render_performance_report_body,
-    get_performance_report_css,
+from batch_renderer import (
+    has_basic_health_data,
     has_vision_data,
     has_hearing_data,
-    has_lung_data
+    has_lung_data,
+    write_batch_volumes,
+    remove_spool_job,
+    BATCH_SPOOL_TTL_SECONDS
 )
 
-# --- Helper Functions ---
-def is_empty(val):
-    return pd.isna(val) or str(val).strip().lower() in ["", "-", "none", "nan", "null"]
+# รายการไฟล์ของงานพิมพ์ชุด (ตัว HTML อยู่บนดิสก์ ดู batch_renderer) session_state เก็บแค่ job ID
+# งานที่หมดอายุ / ถูกดันออกจาก cache / ค้างอยู่ตอน process ปิด ถูกลบไฟล์ทันที ไม่รอ prune_spool ของงานถัดไป
+BATCH_JOB_CACHE_SIZE = 8
+BATCH_JOB_TTL_SECONDS = BATCH_SPOOL_TTL_SECONDS
+batch_job_cache = TTLLRUCache(maxsize=BATCH_JOB_CACHE_SIZE, default_ttl=BATCH_JOB_TTL_SECONDS,
+                              on_evict=lambda job_id, job: remove_spool_job(job_id))
+atexit.register(batch_job_cache.clear)
 
-def has_basic_health_data(person_data):
-    """ตรวจสอบว่ามีข้อมูลสุขภาพพื้นฐาน (Main Report) หรือไม่"""
-    key_indicators = ['FBS', 'CHOL', 'HCT', 'Cr', 'WBC (cumm)', 'SBP', 'Hb(%)']
-    return any(not is_empty(person_data.get(key)) for key in key_indicators)
+def _schedule_job_expiry():
+    """ลบงานที่หมดอายุแม้ไม่มีใครเปิด Print Center อีก (cache หมดอายุแบบ lazy)"""
+    timer = threading.Timer(BATCH_JOB_TTL_SECONDS + 1, batch_job_cache.purge_expired)
+    timer.daemon = True
+    timer.start()
 
+# --- Helper Functions ---
 def check_data_readiness(person_data, report_type):
     """
     ตรวจสอบสถานะความพร้อมของข้อมูลตามประเภทรายงาน
@@ -71,201 +80,39 @@ def check_data_readiness(person_data, report_type):
 
     return is_ready, status_text, status_color
 
-def generate_batch_html(df, selected_hns, report_type, year_logic="ใช้ข้อมูลปีล่าสุดของแต่ละคน"):
-    """สร้าง HTML สำหรับพิมพ์"""
-    report_bodies = []
-    
-    # ดึง CSS จากไฟล์ต้นฉบับ
-    css_main = get_main_report_css()
-    css_perf = get_performance_report_css()
-    
-    # สกัดเฉพาะเนื้อหาใน <style>...</style>
-    main_style_match = re.search(r'<style>(.*?)</style>', css_main, re.DOTALL)
-    perf_style_match = re.search(r'<style>(.*?)</style>', css_perf, re.DOTALL)
-    
-    main_css_content = main_style_match.group(1) if main_style_match else ""
-    perf_css_content = perf_style_match.group(1) if perf_style_match else ""
-
-    # สร้าง CSS รวม และเพิ่ม style สำหรับการแบ่งหน้า (Batch Print Specific)
-    # เราใช้ !important เพื่อทับค่าที่อาจจะติดมาจากไฟล์ต้นฉบับ
-    full_css = f"""
-    <style>
-        /* --- Base Styles from Files --- */
-        {main_css_content}
-        {perf_css_content}
-
-        /* --- BATCH PRINT OVERRIDES --- */
-        @media print {{
-            @page {{
-                size: A4;
-                margin: 0 !important; /* Reset page margins, let container padding handle it */
-            }}
-
-            html, body {{ 
-                margin: 0 !important; 
-                padding: 0 !important; 
-                width: 210mm !important;
-                height: auto !important; /* Allow growing height for multiple pages */
-                min-height: 100vh !important;
-                background-color: white !important;
-                -webkit-print-color-adjust: exact !important; 
-                print-color-adjust: exact !important;
-                overflow: visible !important; /* Ensure no clipping */
-            }}
-            
-            /* Wrapper ของคนไข้แต่ละคน */
-            .patient-wrapper {{
-                display: block;
-                width: 100%;
-                margin: 0;
-                padding: 0;
-                page-break-after: always !important; /* จบคนนึงขึ้นหน้าใหม่ */
-                break-after: page !important;
-            }}
-            
-            /* หน้าสุดท้ายของคนสุดท้ายไม่ต้อง break */
-            .patient-wrapper:last-child {{
-                page-break-after: auto !important;
-                break-after: auto !important;
-            }}
-
-            /* Container ของแต่ละรายงาน (สุขภาพ/สมรรถภาพ) */
-            .container {{
-                box-sizing: border-box !important;
-                margin: 0 !important;
-                padding: 0.5cm !important; /* ขอบ 0.5cm */
-                width: 210mm !important;
-                
-                /* ใช้ min-height A4 เพื่อดัน Footer ไปล่างสุดถ้าเนื้อหาน้อย */
-                min-height: 297mm !important; 
-                height: auto !important; 
-                
-                position: relative !important;
-                background-color: white !important;
-                overflow: visible !important; /* ห้ามซ่อนเนื้อหา */
-                
-                /* ห้าม break ในตัว container เองโดยไม่จำเป็น */
-                page-break-inside: avoid;
-            }}
-
-            /* ตัวคั่นระหว่างรายงานสุขภาพและสมรรถภาพ */
-            .report-separator {{
-                display: block;
-                height: 0;
-                margin: 0;
-                padding: 0;
-                page-break-before: always !important; /* ขึ้นหน้าใหม่เสมอ */
-                break-before: page !important;
-            }}
-            
-            /* Footer Fix */
-            .footer {{
-                position: absolute !important;
-                bottom: 0.5cm !important; /* ติดขอบล่าง 0.5cm */
-                left: 0 !important;
-                width: 100% !important;
-            }}
-        }}
-        
-        /* Screen view adjustments */
-        @media screen {{
-            .patient-wrapper {{
-                border-bottom: 5px solid #ccc;
-                margin-bottom: 20px;
-                padding-bottom: 20px;
-            }}
-            .report-separator {{
-                border-top: 2px dashed #999;
-                margin: 20px 0;
-                position: relative;
-            }}
-            .report-separator::after {{
-                content: "--- Page Break (Next Report) ---";
-                position: absolute;
-                top: -12px;
-                left: 50%;
-                transform: translateX(-50%);
-                background: white;
-                padding: 0 10px;
-                color: #666;
-                font-size: 12px;
-            }}
-        }}
-    </style>
+def generate_batch_job(dataset, selected_hns, report_type, workers=None):
+    """
+    สร้างรายงานลงไฟล์ (แบ่งเล่ม) แล้วเก็บรายการไฟล์ไว้ใน batch_job_cache
+    Returns: (job_id หรือ None ถ้าไม่มีรายงานให้พิมพ์, skipped_count)
     """
-
     progress_bar = st.progress(0)
-    total_patients = len(selected_hns)
-    skipped_count = 0
-    
-    for i, hn in enumerate(selected_hns):
-        try:
-            progress_bar.progress((i + 1) / total_patients, text=f"กำลังสร้างรายงานคนที่ {i+1}/{total_patients} (HN: {hn})")
-            
-            person_history_df = df[df['HN'] == hn].copy()
-            if person_history_df.empty:
-                skipped_count += 1
-                continue
-
-            latest_year_series = person_history_df.sort_values(by='Year', ascending=False).iloc[0]
-            person_data = latest_year_series.to_dict()
-
-            parts = []
-            
-            # 1. Health Report Part
-            need_main = report_type in ["รายงานสุขภาพ (Health Report)", "ทั้งรายงานสุขภาพและสมรรถภาพ"]
-            if need_main and has_basic_health_data(person_data):
-                parts.append(render_printable_report_body(person_data, person_history_df))
-            
-            # 2. Performance Report Part
-            need_perf = report_type in ["รายงานสมรรถภาพ (Performance Report)", "ทั้งรายงานสุขภาพและสมรรถภาพ"]
-            has_vis = has_vision_data(person_data)
-            has_hear = has_hearing_data(person_data)
-            has_lung = has_lung_data(person_data)
-            
-            if need_perf and (has_vis or has_hear or has_lung):
-                parts.append(render_performance_report_body(person_data, person_history_df))
-
-            if not parts:
-                skipped_count += 1
-                continue
-            
-            # Join parts with a dedicated separator div
-            patient_html_content = '<div class="report-separator"></div>'.join(parts)
-            
-            # Wrap in patient wrapper
-            report_bodies.append(f'<div class="patient-wrapper">{patient_html_content}</div>')
 
-        except Exception as e:
-            st.error(f"เกิดข้อผิดพลาด HN: {hn} - {e}")
-            continue 
+    def on_progress(done, total):
+        progress_bar.progress(done / total, text=f"กำลังสร้างรายงาน {done}/{total} คน")
 
+    job_id = uuid.uuid4().hex
+    volumes, skipped_count, errors = write_batch_volumes(dataset, selected_hns, report_type, job_id, on_progress, workers)
     progress_bar.empty()
+    for hn, message in errors:
+        st.error(f"เกิดข้อผิดพลาด HN: {hn} - {message}")
 
-    if not report_bodies:
+    if not volumes:
         return None, skipped_count
 
-    all_bodies = "".join(report_bodies)
-    
-    full_html = f"""
-    <!DOCTYPE html>
-    <html lang="th">
-    <head>
-        <meta charset="UTF-8">
-        <title>รายงานผลการตรวจสุขภาพ (Batch Print)</title>
-        {full_css}
-    </head>
-    <body>
-        {all_bodies}
-    </body>
-    </html>
-    """
-    return full_html, skipped_count
+    batch_job_cache.set(job_id, {"volumes": volumes, "report_type": report_type,
+                                 "created_at": datetime.now().strftime('%Y%m%d_%H%M')})
+    _schedule_job_expiry()
+    return job_id, skipped_count
+
+def read_volume(path):
+    with open(path, "rb") as f:
+        return f.read()
 
 # --- Callback Functions ---
 
-def add_patient_to_list_callback(df):
+def add_patient_to_list_callback(dataset):
     """Callback สำหรับปุ่มเพิ่มรายการ"""
+    df = dataset.df
     name = st.session_state.get("bp_name_search")
     hn = st.session_state.get("bp_hn_search")
     cid = st.session_state.get("bp_cid_search")
@@ -279,13 +126,13 @@ def add_patient_to_list_callback(df):
             target_hn = matched.iloc[0]['HN']
             found_msg = f"เพิ่มคุณ {name} เรียบร้อย"
     elif hn:
-        matched = df[df['HN'].astype(str) == hn.strip()]
+        matched = dataset.patient_history(hn.strip())
         if not matched.empty:
             target_hn = matched.iloc[0]['HN']
             name_found = matched.iloc[0]['ชื่อ-สกุล']
             found_msg = f"เพิ่ม HN {hn} ({name_found}) เรียบร้อย"
     elif cid:
-        matched = df[df['เลขบัตรประชาชน'].astype(str) == cid.strip()]
+        matched = dataset.rows_for_cid(normalize_cid(cid))
         if not matched.empty:
             target_hn = matched.iloc[0]['HN']
             name_found = matched.iloc[0]['ชื่อ-สกุล']
@@ -311,8 +158,9 @@ def remove_hn_callback(hn_to_remove):
     if 'bp_manual_hns' in st.session_state and hn_to_remove in st.session_state.bp_manual_hns:
         st.session_state.bp_manual_hns.remove(hn_to_remove)
 
-def display_print_center_page(df):
+def display_print_center_page(dataset):
     """แสดงหน้าจอ Print Center"""
+    df = dataset.df
     st.title("🖨️ ศูนย์จัดการพิมพ์รายงาน (Print Center)")
     st.markdown("---")
     
@@ -461,7 +309,7 @@ def display_print_center_page(df):
     # Button Row: ใช้สัดส่วน 2:3 เพื่อให้ปุ่มตรงกับช่อง "ชื่อ-สกุล" ด้านบน
     col_add, _ = st.columns([2, 3])
     with col_add:
-        st.button("➕ เพิ่มลงรายการ", use_container_width=True, on_click=add_patient_to_list_callback, args=(df,))
+        st.button("➕ เพิ่มลงรายการ", use_container_width=True, on_click=add_patient_to_list_callback, args=(dataset,))
     
     st.markdown("---")
     
@@ -472,7 +320,7 @@ def display_print_center_page(df):
         all_depts = sorted(df['หน่วยงาน'].dropna().astype(str).str.strip().unique())
         selected_depts = st.multiselect("กรองตามหน่วยงาน", options=all_depts, placeholder="เลือกหน่วยงาน...", key="bp_dept_filter")
     with c5:
-        temp_df = df.copy()
+        temp_df = df
         if selected_depts:
             temp_df = temp_df[temp_df['หน่วยงาน'].astype(str).str.strip().isin(selected_depts)]
         available_dates = sorted(temp_df['วันที่ตรวจ'].dropna().astype(str).unique(), reverse=True)
@@ -489,13 +337,13 @@ def display_print_center_page(df):
     filtered_df = pd.DataFrame(columns=df.columns)
     filter_active = False
     if selected_depts or (selected_date != "(ทั้งหมด)"):
-        filtered_df = df.copy()
+        filtered_df = df
         if selected_depts: filtered_df = filtered_df[filtered_df['หน่วยงาน'].astype(str).str.strip().isin(selected_depts)]
         if selected_date != "(ทั้งหมด)": filtered_df = filtered_df[filtered_df['วันที่ตรวจ'].astype(str) == selected_date]
         filter_active = True
 
     manual_hns = list(st.session_state.bp_manual_hns)
-    manual_df = df[df['HN'].isin(manual_hns)].copy()
+    manual_df = df[df['HN'].isin(manual_hns)]
     
     if filter_active:
         display_pool = pd.concat([manual_df, filtered_df]).drop_duplicates(subset=['HN'])
@@ -587,10 +435,12 @@ def display_print_center_page(df):
     with col_c:
         if st.button(f"สั่งพิมพ์รายงาน ({count_selected} ท่าน)", type="primary", use_container_width=True, disabled=(count_selected == 0)):
             if count_selected > 0:
-                html_content, skipped = generate_batch_html(df, selected_to_print_hns, report_type)
-                if html_content:
-                    st.session_state.batch_print_html = html_content
-                    st.session_state.batch_print_ready = True
+                job_id, skipped = generate_batch_job(dataset, selected_to_print_hns, report_type)
+                if job_id:
+                    st.session_state.batch_print_job_id = job_id
+                    # เล่มเดียว: สั่งพิมพ์ทันทีเหมือนเดิม / หลายเล่ม: ให้เลือกพิมพ์หรือดาวน์โหลดทีละเล่ม
+                    volumes = batch_job_cache.get(job_id)["volumes"]
+                    st.session_state.batch_print_volume = 0 if len(volumes) == 1 else None
                     if skipped > 0:
                         st.warning(f"สร้างรายงานสำเร็จ! (ข้าม {skipped} คน เนื่องจากไม่มีข้อมูล)")
                     else:
@@ -599,9 +449,39 @@ def display_print_center_page(df):
                 else:
                     st.error("ไม่สามารถสร้างรายงานได้")
 
+    # --- Batch Volumes (ไฟล์บนดิสก์ อ่านเมื่อกดดาวน์โหลด/พิมพ์เท่านั้น) ---
+    job_id = st.session_state.get("batch_print_job_id")
+    if not job_id:
+        return
+    job = batch_job_cache.get(job_id)
+    if job is None or not all(os.path.exists(v["path"]) for v in job["volumes"]):
+        st.session_state.batch_print_job_id = None
+        st.session_state.batch_print_volume = None
+        st.warning("งานพิมพ์หมดอายุแล้ว กรุณากดสั่งพิมพ์ใหม่อีกครั้ง")
+        return
+
+    volumes = job["volumes"]
+    st.markdown(f"##### 📦 งานพิมพ์ล่าสุด: {sum(v['patients'] for v in volumes)} ท่าน ({len(volumes)} ชุด)")
+    first = 1
+    for i, volume in enumerate(volumes):
+        last = first + volume["patients"] - 1
+        c_label, c_download, c_print = st.columns([3, 1, 1])
+        with c_label:
+            st.markdown(f"<div class='grid-cell-text'>ชุดที่ {i + 1}: คนที่ {first}–{last} ({volume['bytes'] / 1024 / 1024:.1f} MB)</div>", unsafe_allow_html=True)
+        with c_download:
+            st.download_button("⬇️ ดาวน์โหลด", data=lambda path=volume["path"]: read_volume(path),
+                               file_name=f"batch_print_{job['created_at']}_{i + 1:03d}.html", mime="text/html",
+                               key=f"bp_download_{job_id}_{i}", on_click="ignore", use_container_width=True)
+        with c_print:
+            if st.button("🖨️ พิมพ์", key=f"bp_print_{job_id}_{i}", use_container_width=True):
+                st.session_state.batch_print_volume = i
+        first = last + 1
+
     # --- Hidden Print Trigger ---
-    if st.session_state.get("batch_print_ready", False):
-        html_content = st.session_state.batch_print_html
+    volume_index = st.session_state.get("batch_print_volume")
+    if volume_index is not None:
+        st.session_state.batch_print_volume = None
+        html_content = read_volume(volumes[volume_index]["path"]).decode("utf-8")
         escaped_html = json.dumps(html_content)
         iframe_id = f"print-batch-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
         
@@ -629,4 +509,3 @@ def display_print_center_page(df):
         </script>
         """
         st.components.v1.html(print_script, height=0, width=0)
-        st.session_state.batch_print_ready = False
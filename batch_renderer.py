@@ -0,0 +1,589 @@
+import os
+import re
+import time
+import shutil
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+from data_loader import CACHE_DIR
+from cache_utils import make_private_dir, private_opener
+from health_dataset import SnapshotRowReader
+from report_cache import RENDERERS, content_digest, fragment_key, fragment_cache
+from print_report import get_main_report_css
+from print_performance_report import (
+    get_performance_report_css,
+    has_vision_data,
+    has_hearing_data,
+    has_lung_data
+)
+
+# ==============================================================================
+# Module: batch_renderer.py
+# Purpose: สร้าง HTML งานพิมพ์ชุด (Print Center) โดยไม่พึ่ง Streamlit
+# - ใช้ได้ทั้งใน process หลักและใน worker process (ProcessPoolExecutor)
+# - worker ได้รับ snapshot ของข้อมูลครั้งเดียวตอนเริ่ม แล้วรับงานเป็นชุดของ HN
+# ==============================================================================
+
+logger = logging.getLogger(__name__)
+
+# จำนวน worker (ค่าเริ่มต้น: จำนวน core - 1) ตั้ง 1 เพื่อปิดการทำงานแบบขนาน
+BATCH_RENDER_WORKERS = int(os.environ.get("BATCH_RENDER_WORKERS", max(1, (os.cpu_count() or 1) - 1)))
+BATCH_RENDER_CHUNK_SIZE = int(os.environ.get("BATCH_RENDER_CHUNK_SIZE", 25))
+# งานเล็กกว่านี้สร้างใน process หลักเลย (ไม่คุ้มค่าส่งงานข้าม process)
+BATCH_PARALLEL_MIN_PATIENTS = 100
+# ปิด worker process เมื่อไม่มีงานพิมพ์นานเท่านี้ (วินาที) เพื่อคืนหน่วยความจำ
+BATCH_POOL_IDLE_SECONDS = float(os.environ.get("BATCH_POOL_IDLE_SECONDS", 120))
+
+# งานพิมพ์ชุดเขียนลงไฟล์ (spool) แบ่งเป็นเล่มละ BATCH_VOLUME_SIZE คน แทนการเก็บ HTML ทั้งก้อนในหน่วยความจำ
+BATCH_SPOOL_DIR = os.environ.get("BATCH_SPOOL_DIR", os.path.join(CACHE_DIR, "batch_spool"))
+BATCH_VOLUME_SIZE = int(os.environ.get("BATCH_VOLUME_SIZE", 200))
+BATCH_SPOOL_TTL_SECONDS = 60 * 60
+
+# -----------------------------------------------------------------------------
+# Rendering
+# -----------------------------------------------------------------------------
+
+def is_empty(val):
+    return pd.isna(val) or str(val).strip().lower() in ["", "-", "none", "nan", "null"]
+
+def has_basic_health_data(person_data):
+    """ตรวจสอบว่ามีข้อมูลสุขภาพพื้นฐาน (Main Report) หรือไม่"""
+    key_indicators = ['FBS', 'CHOL', 'HCT', 'Cr', 'WBC (cumm)', 'SBP', 'Hb(%)']
+    return any(not is_empty(person_data.get(key)) for key in key_indicators)
+
+def build_batch_css():
+    """CSS รวมของรายงานสุขภาพ + สมรรถภาพ และ style สำหรับการแบ่งหน้า (สร้างครั้งเดียวต่องานพิมพ์)"""
+    # ดึง CSS จากไฟล์ต้นฉบับ
+    css_main = get_main_report_css()
+    css_perf = get_performance_report_css()
+    
+    # สกัดเฉพาะเนื้อหาใน <style>...</style>
+    main_style_match = re.search(r'<style>(.*?)</style>', css_main, re.DOTALL)
+    perf_style_match = re.search(r'<style>(.*?)</style>', css_perf, re.DOTALL)
+    
+    main_css_content = main_style_match.group(1) if main_style_match else ""
+    perf_css_content = perf_style_match.group(1) if perf_style_match else ""
+
+    # สร้าง CSS รวม และเพิ่ม style สำหรับการแบ่งหน้า (Batch Print Specific)
+    # เราใช้ !important เพื่อทับค่าที่อาจจะติดมาจากไฟล์ต้นฉบับ
+    return f"""
+    <style>
+        /* --- Base Styles from Files --- */
+        {main_css_content}
+        {perf_css_content}
+
+        /* --- BATCH PRINT OVERRIDES --- */
+        @media print {{
+            @page {{
+                size: A4;
+                margin: 0 !important; /* Reset page margins, let container padding handle it */
+            }}
+
+            html, body {{ 
+                margin: 0 !important; 
+                padding: 0 !important; 
+                width: 210mm !important;
+                height: auto !important; /* Allow growing height for multiple pages */
+                min-height: 100vh !important;
+                background-color: white !important;
+                -webkit-print-color-adjust: exact !important; 
+                print-color-adjust: exact !important;
+                overflow: visible !important; /* Ensure no clipping */
+            }}
+            
+            /* Wrapper ของคนไข้แต่ละคน */
+            .patient-wrapper {{
+                display: block;
+                width: 100%;
+                margin: 0;
+                padding: 0;
+                page-break-after: always !important; /* จบคนนึงขึ้นหน้าใหม่ */
+                break-after: page !important;
+            }}
+            
+            /* หน้าสุดท้ายของคนสุดท้ายไม่ต้อง break */
+            .patient-wrapper:last-child {{
+                page-break-after: auto !important;
+                break-after: auto !important;
+            }}
+
+            /* Container ของแต่ละรายงาน (สุขภาพ/สมรรถภาพ) */
+            .container {{
+                box-sizing: border-box !important;
+                margin: 0 !important;
+                padding: 0.5cm !important; /* ขอบ 0.5cm */
+                width: 210mm !important;
+                
+                /* ใช้ min-height A4 เพื่อดัน Footer ไปล่างสุดถ้าเนื้อหาน้อย */
+                min-height: 297mm !important; 
+                height: auto !important; 
+                
+                position: relative !important;
+                background-color: white !important;
+                overflow: visible !important; /* ห้ามซ่อนเนื้อหา */
+                
+                /* ห้าม break ในตัว container เองโดยไม่จำเป็น */
+                page-break-inside: avoid;
+            }}
+
+            /* ตัวคั่นระหว่างรายงานสุขภาพและสมรรถภาพ */
+            .report-separator {{
+                display: block;
+                height: 0;
+                margin: 0;
+                padding: 0;
+                page-break-before: always !important; /* ขึ้นหน้าใหม่เสมอ */
+                break-before: page !important;
+            }}
+            
+            /* Footer Fix */
+            .footer {{
+                position: absolute !important;
+                bottom: 0.5cm !important; /* ติดขอบล่าง 0.5cm */
+                left: 0 !important;
+                width: 100% !important;
+            }}
+        }}
+        
+        /* Screen view adjustments */
+        @media screen {{
+            .patient-wrapper {{
+                border-bottom: 5px solid #ccc;
+                margin-bottom: 20px;
+                padding-bottom: 20px;
+            }}
+            .report-separator {{
+                border-top: 2px dashed #999;
+                margin: 20px 0;
+                position: relative;
+            }}
+            .report-separator::after {{
+                content: "--- Page Break (Next Report) ---";
+                position: absolute;
+                top: -12px;
+                left: 50%;
+                transform: translateX(-50%);
+                background: white;
+                padding: 0 10px;
+                color: #666;
+                font-size: 12px;
+            }}
+        }}
+    </style>
+    """
+
+def iter_patient_records(source, selected_hns):
+    """
+    คืน (hn, ประวัติเรียงตาม Year จากน้อยไปมาก, แถวปีล่าสุดเป็น dict) ตามลำดับ HN ที่เลือก ในรอบเดียว
+    - source เป็น dataset (HealthDataset / SqlitePatientStore): ใช้ HN index กลาง (slice ไม่ต้อง scan)
+    - source เป็น DataFrame: groupby('HN') ครั้งเดียว แทนการกรอง df ทั้งตารางทีละคน
+    HN ที่ไม่พบจะได้ DataFrame ว่างและ None
+    """
+    if not isinstance(source, pd.DataFrame):
+        yield from source.iter_patient_records(selected_hns)
+        return
+
+    subset = source[source['HN'].isin(set(selected_hns))].sort_values(['HN', 'Year'], kind="stable")
+    groups = subset.groupby('HN', sort=False).indices
+    positions = [groups.get(hn) for hn in selected_hns]
+    latest = iter(subset.take([pos[-1] for pos in positions if pos is not None]).to_dict("records"))
+    empty = subset.iloc[0:0]
+    for hn, pos in zip(selected_hns, positions):
+        if pos is None:
+            yield hn, empty, None
+        else:
+            yield hn, subset.iloc[pos], next(latest)
+
+MAIN_REPORT_TYPES = ("รายงานสุขภาพ (Health Report)", "ทั้งรายงานสุขภาพและสมรรถภาพ")
+PERFORMANCE_REPORT_TYPES = ("รายงานสมรรถภาพ (Performance Report)", "ทั้งรายงานสุขภาพและสมรรถภาพ")
+
+def report_parts_for(person_data, report_type):
+    """ชนิดรายงาน (ตาม report_cache.RENDERERS) ที่ต้องพิมพ์ให้ผู้ป่วยคนนี้ เรียงตามลำดับในเอกสาร"""
+    kinds = []
+    # 1. Health Report Part
+    if report_type in MAIN_REPORT_TYPES and has_basic_health_data(person_data):
+        kinds.append("main")
+    # 2. Performance Report Part
+    if report_type in PERFORMANCE_REPORT_TYPES and (has_vision_data(person_data) or has_hearing_data(person_data) or has_lung_data(person_data)):
+        kinds.append("performance")
+    return kinds
+
+def join_patient_parts(parts):
+    """Join parts with a dedicated separator div แล้วห่อด้วย patient wrapper (None ถ้าไม่มีรายงาน)"""
+    if not parts:
+        return None
+    patient_html_content = '<div class="report-separator"></div>'.join(parts)
+    return f'<div class="patient-wrapper">{patient_html_content}</div>'
+
+def render_patient_block(person_data, person_history_df, report_type):
+    """HTML ของผู้ป่วย 1 คน (รายงานสุขภาพ / สมรรถภาพ ตามที่เลือก) หรือ None ถ้าไม่มีข้อมูลที่จะพิมพ์ (ไม่ใช้ cache)"""
+    return join_patient_parts([RENDERERS[kind][0](person_data, person_history_df) for kind in report_parts_for(person_data, report_type)])
+
+def render_batch_bodies(source, selected_hns, report_type, on_progress=None):
+    """
+    สร้าง HTML ของผู้ป่วยทุกคนใน process นี้ (ทีละคน ไม่ใช้ fragment cache: ใช้เป็นค่าอ้างอิงใน benchmark)
+    on_progress(done, total) ถูกเรียกหลังสร้างรายงานแต่ละคน
+    Returns: (report_bodies, skipped_count, errors) โดย errors เป็น list ของ (hn, ข้อความ)
+    """
+    report_bodies = []
+    errors = []
+    skipped_count = 0
+    total_patients = len(selected_hns)
+
+    for i, (hn, person_history_df, person_data) in enumerate(iter_patient_records(source, selected_hns)):
+        try:
+            if person_data is None:
+                skipped_count += 1
+                continue
+
+            body = render_patient_block(person_data, person_history_df, report_type)
+            if body is None:
+                skipped_count += 1
+                continue
+            report_bodies.append(body)
+
+        except Exception as e:
+            errors.append((hn, str(e)))
+        finally:
+            if on_progress: on_progress(i + 1, total_patients)
+
+    return report_bodies, skipped_count, errors
+
+def batch_html_head(full_css, title="รายงานผลการตรวจสุขภาพ (Batch Print)"):
+    """ส่วนหัวของเอกสารงานพิมพ์ชุด (ก่อน body ของผู้ป่วย)"""
+    return f"""
+    <!DOCTYPE html>
+    <html lang="th">
+    <head>
+        <meta charset="UTF-8">
+        <title>{title}</title>
+        {full_css}
+    </head>
+    <body>
+    """
+
+BATCH_HTML_TAIL = """
+    </body>
+    </html>
+    """
+
+def wrap_batch_html(all_bodies, full_css):
+    """ห่อ body ของผู้ป่วยเป็นเอกสาร HTML ที่พิมพ์ได้"""
+    return batch_html_head(full_css) + all_bodies + BATCH_HTML_TAIL
+
+
+# -----------------------------------------------------------------------------
+# Parallel Rendering (ProcessPoolExecutor)
+# -----------------------------------------------------------------------------
+
+_worker_reader = None
+_worker_version = None
+
+def _init_worker(snapshot_path, version):
+    """รันครั้งเดียวต่อ worker: memory-map columnar snapshot (ไม่ได้รับ DataFrame ทั้งตารางจาก process หลัก)"""
+    global _worker_reader, _worker_version
+    _worker_reader = SnapshotRowReader(snapshot_path)
+    _worker_version = version
+
+def _render_parts(person_data, history, kinds):
+    """สร้าง body ของแต่ละชนิดรายงาน คืน ({kind: html}, None) หรือ (None, ข้อความ error)"""
+    try:
+        return {kind: RENDERERS[kind][0](person_data, history) for kind in kinds}, None
+    except Exception as e:
+        return None, str(e)
+
+def _render_jobs(jobs):
+    """รันใน worker: jobs เป็น list ของ (hn, [kind, ...]) คืนผลของ _render_parts ตามลำดับเดียวกัน"""
+    hns = [hn for hn, _ in jobs]
+    records = iter_patient_records(_worker_reader.dataset(hns, _worker_version), hns)
+    return [_render_parts(person_data, history, kinds) for (_, kinds), (_, history, person_data) in zip(jobs, records)]
+
+_pool = None
+_pool_key = None
+_pool_users = {} # pool -> จำนวนงานพิมพ์ที่กำลังใช้ (รวม pool ที่ถูกแทนแล้วแต่งานเดิมยังไม่เสร็จ)
+_pool_lock = threading.Lock()
+_idle_timer = None
+
+def _acquire_pool(dataset, workers):
+    """
+    Pool ที่ใช้ร่วมกันทั้ง process (งานพิมพ์ที่ต่อเนื่องกันไม่ต้อง spawn worker ใหม่) ต้องคืนด้วย _release_pool
+    - worker อ่านข้อมูลจาก columnar snapshot ของ dataset (dataset.snapshot_path) แบบ memory-map
+      ไม่ได้รับ DataFrame ทั้งตาราง จึงไม่มีสำเนาข้อมูลเพิ่มตามจำนวน worker
+    - สร้างใหม่เมื่อข้อมูลเปลี่ยนเวอร์ชันหรือจำนวน worker เปลี่ยน pool เดิมถูกปิดเมื่องานที่ยังใช้อยู่คืนครบแล้ว
+      (ไม่ยกเลิกงานของ session อื่นที่กำลังพิมพ์) และถูกปิดเมื่อว่างนาน BATCH_POOL_IDLE_SECONDS
+    ใช้ spawn เพราะ process หลัก (Streamlit) มีหลาย thread การ fork อาจทำให้ lock ค้างใน worker
+    """
+    global _pool, _pool_key
+    key = (dataset.version, dataset.snapshot_path, workers)
+    idle = None
+    with _pool_lock:
+        if _idle_timer is not None: _idle_timer.cancel()
+        if _pool is None or _pool_key != key:
+            idle = _unset_current_pool()
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_init_worker, initargs=(dataset.snapshot_path, dataset.version))
+            _pool_key = key
+        _pool_users[_pool] = _pool_users.get(_pool, 0) + 1
+        pool = _pool
+    if idle is not None: idle.shutdown(wait=False)
+    return pool
+
+def _unset_current_pool():
+    """(ถือ _pool_lock อยู่) เลิกใช้ pool ปัจจุบันกับงานใหม่ คืน pool นั้นถ้าไม่มีงานใช้อยู่ (ผู้เรียกปิดเอง)"""
+    global _pool, _pool_key
+    pool, _pool, _pool_key = _pool, None, None
+    if pool is None or _pool_users.get(pool, 0) > 0: return None
+    _pool_users.pop(pool, None)
+    return pool
+
+def _release_pool(pool):
+    """คืน pool จาก _acquire_pool ปิด pool ที่ถูกแทนแล้วเมื่อไม่มีงานใช้อยู่"""
+    global _idle_timer
+    with _pool_lock:
+        users = _pool_users.get(pool, 0) - 1
+        idle = users <= 0 and pool is not _pool
+        if idle:
+            _pool_users.pop(pool, None)
+        else:
+            _pool_users[pool] = max(0, users)
+            if users <= 0:
+                _idle_timer = threading.Timer(BATCH_POOL_IDLE_SECONDS, _retire_pool, (pool, True))
+                _idle_timer.daemon = True
+                _idle_timer.start()
+    if idle: pool.shutdown(wait=False)
+
+def _retire_pool(pool, only_if_idle=False):
+    """
+    ไม่ใช้ pool นี้กับงานใหม่อีก (เช่น worker ตาย) ปิดทันทีถ้าไม่มีงานใช้อยู่ ไม่เช่นนั้นปิดเมื่อคืนครบ
+    only_if_idle=True (จาก idle timer): ไม่ทำอะไรถ้ามีงานกลับมาใช้ pool นี้แล้ว
+    """
+    with _pool_lock:
+        if only_if_idle and _pool_users.get(pool, 0) > 0: return
+        idle = _unset_current_pool() if _pool is pool else None
+    if idle is not None: idle.shutdown(wait=False)
+
+def shutdown_render_pool():
+    with _pool_lock:
+        pool = _pool
+    if pool is not None: _retire_pool(pool)
+
+def _plan_chunk(dataset, records, report_type, cache):
+    """
+    เตรียมผู้ป่วย 1 ชุด (records จาก iter_patient_records): list ของ [hn, person_data, history, {kind: cache key}, {kind: html หรือ None}]
+    html ที่มีใน cache แล้วจะถูกเติมไว้เลย เหลือ None เฉพาะส่วนที่ต้องสร้างใหม่
+    """
+    plan = []
+    for hn, history, person_data in records:
+        keys, parts = {}, {}
+        if person_data is not None:
+            kinds = report_parts_for(person_data, report_type)
+            if kinds and cache is not None:
+                digest = content_digest(person_data, history, dataset)
+                keys = {kind: fragment_key(kind, person_data, digest) for kind in kinds}
+                parts = {kind: cache.get(key) for kind, key in keys.items()}
+            else:
+                parts = dict.fromkeys(kinds)
+        plan.append([hn, person_data, history, keys, parts])
+    return plan
+
+def _assemble_chunk(plan, jobs, rendered, cache):
+    """รวม fragment จาก cache กับที่สร้างใหม่ (และเก็บส่วนใหม่ลง cache) คืน (report_bodies, skipped_count, errors)"""
+    errors = []
+    for (pos, hn, _), (parts, error) in zip(jobs, rendered):
+        if error is not None:
+            errors.append((hn, error))
+            continue
+        keys = plan[pos][3]
+        for kind, body in parts.items():
+            plan[pos][4][kind] = body
+            if cache is not None and kind in keys: cache.set(keys[kind], body)
+
+    failed = {hn for hn, _ in errors}
+    report_bodies, skipped_count = [], 0
+    for hn, person_data, _, _, parts in plan:
+        if hn in failed: continue
+        body = join_patient_parts(list(parts.values())) if person_data is not None else None
+        if body is None:
+            skipped_count += 1
+        else:
+            report_bodies.append(body)
+    return report_bodies, skipped_count, errors
+
+def iter_rendered_chunks(dataset, selected_hns, report_type, on_progress=None, workers=None, chunk_size=None, cache=fragment_cache):
+    """
+    สร้างรายงานเป็นชุดละ chunk_size คน คืน (report_bodies, skipped_count, errors) ของแต่ละชุดตามลำดับ HN ที่เลือก
+    - รายงานที่มีใน fragment cache แล้ว (ข้อมูลไม่เปลี่ยน) ไม่สร้างใหม่ ส่งเฉพาะส่วนที่ขาดไปยัง worker
+    - worker ทำงานล่วงหน้าได้ไม่เกิน 2 ชุดต่อ worker เพื่อไม่ให้ผลค้างในหน่วยความจำ
+    - workers <= 1, งานเล็ก หรือ dataset ไม่มี columnar snapshot (เช่น SqlitePatientStore): สร้างใน process นี้
+    - pool ใช้งานไม่ได้ (เช่น worker ตาย / งานถูกยกเลิก): เลิกใช้ pool แล้วสร้างส่วนที่เหลือใน process นี้แทน
+    - ชุดที่ worker ทำไม่สำเร็จด้วยเหตุอื่น (เช่น pickle ผลไม่ได้): log ไว้แล้วสร้างชุดนั้นใหม่ใน process นี้
+      (error ของรายงานแต่ละคนยังรายงานเป็นราย HN ผ่าน errors ตามเดิม)
+    cache=None ปิดการใช้ fragment cache / on_progress(done, total) ถูกเรียกเมื่อแต่ละชุดเสร็จ
+    """
+    workers = BATCH_RENDER_WORKERS if workers is None else workers
+    chunk_size = chunk_size or BATCH_RENDER_CHUNK_SIZE
+    total = len(selected_hns)
+    # ดึงประวัติของทุกคนในรอบเดียว (iter_patient_records) แล้วแบ่งเป็นชุด
+    records = iter_patient_records(dataset, selected_hns)
+    chunks = iter(lambda: list(islice(records, chunk_size)), [])
+    if cache is not None: cache.bind_snapshot(getattr(dataset, "version", None))
+
+    parallel = workers > 1 and total >= BATCH_PARALLEL_MIN_PATIENTS and getattr(dataset, "snapshot_path", None)
+    pool = acquired = _acquire_pool(dataset, workers) if parallel else None
+    window = workers * 2 if pool is not None else 1
+    in_flight = deque() # (จำนวนคน, plan, jobs, future)
+
+    def plan_next():
+        nonlocal pool
+        chunk = next(chunks, None)
+        if chunk is None: return False
+        plan = _plan_chunk(dataset, chunk, report_type, cache)
+        jobs = [(pos, entry[0], [kind for kind, body in entry[4].items() if body is None])
+                for pos, entry in enumerate(plan) if entry[1] is not None and None in entry[4].values()]
+        future = None
+        if jobs and pool is not None:
+            try:
+                future = pool.submit(_render_jobs, [(hn, kinds) for _, hn, kinds in jobs])
+            except (BrokenProcessPool, RuntimeError):
+                _retire_pool(pool)
+                pool = None
+        in_flight.append((len(chunk), plan, jobs, future))
+        return True
+
+    done = 0
+    try:
+        while len(in_flight) < window and plan_next(): pass
+        while in_flight:
+            count, plan, jobs, future = in_flight.popleft()
+            rendered = None
+            if future is not None:
+                try:
+                    rendered = future.result()
+                except (BrokenProcessPool, CancelledError):
+                    if pool is not None: _retire_pool(pool)
+                    pool = None
+                except Exception:
+                    logger.warning("batch render worker failed for %d patients; rendering in-process", len(jobs), exc_info=True)
+            if rendered is None:
+                rendered = [_render_parts(plan[pos][1], plan[pos][2], kinds) for pos, _, kinds in jobs]
+            result = _assemble_chunk(plan, jobs, rendered, cache)
+            done += count
+            if on_progress: on_progress(done, total)
+            plan_next()
+            yield result
+    finally:
+        # ผู้เรียกหยุดกลางทาง: ยกเลิกชุดที่ยังไม่เริ่ม
+        for _, _, _, future in in_flight:
+            if future is not None: future.cancel()
+        if acquired is not None: _release_pool(acquired)
+
+def render_batch_parallel(dataset, selected_hns, report_type, on_progress=None, workers=None, cache=fragment_cache):
+    """เหมือน render_batch_bodies แต่ใช้ fragment cache และกระจายงานไปยัง worker process (ผลเรียงตามลำดับ HN ที่เลือก)"""
+    report_bodies, errors, skipped_count = [], [], 0
+    for bodies, skipped, chunk_errors in iter_rendered_chunks(dataset, selected_hns, report_type, on_progress, workers, cache=cache):
+        report_bodies.extend(bodies)
+        skipped_count += skipped
+        errors.extend(chunk_errors)
+    return report_bodies, skipped_count, errors
+
+# -----------------------------------------------------------------------------
+# Spool Output (ไฟล์ละหลายคน)
+# -----------------------------------------------------------------------------
+
+class BatchSpoolWriter:
+    """
+    เขียน body ของผู้ป่วยลงไฟล์ทีละคน แบ่งเป็นเล่ม (volume) ละ volume_size คน
+    แต่ละเล่มเป็นเอกสาร HTML ที่พิมพ์ได้ในตัวเอง (มี CSS ชุดเดียวกัน)
+    เขียนลง .part ก่อน แล้ว rename เมื่อปิดเล่ม จึงไม่มีใครได้ไฟล์ที่เขียนไม่ครบ
+    """
+
+    def __init__(self, job_dir, full_css, volume_size=BATCH_VOLUME_SIZE):
+        self.job_dir = job_dir
+        self.volume_size = max(1, volume_size)
+        self.volumes = [] # [{"path", "patients", "bytes"}]
+        self._head = batch_html_head(full_css)
+        self._file = None
+        self._count = 0
+        # ไฟล์ spool เป็นผลตรวจสุขภาพรายบุคคล: เปิดให้เฉพาะผู้ใช้ของ process นี้อ่านได้
+        make_private_dir(os.path.dirname(job_dir))
+        make_private_dir(job_dir)
+
+    def _open_volume(self):
+        path = os.path.join(self.job_dir, f"volume_{len(self.volumes) + 1:03d}.html")
+        self._file = open(path + ".part", "w", encoding="utf-8", opener=private_opener)
+        self._file.write(self._head)
+        self._count = 0
+
+    def _close_volume(self):
+        self._file.write(BATCH_HTML_TAIL)
+        self._file.close()
+        part_path = self._file.name
+        path = part_path[:-len(".part")]
+        os.replace(part_path, path)
+        self.volumes.append({"path": path, "patients": self._count, "bytes": os.path.getsize(path)})
+        self._file = None
+
+    def add(self, body):
+        if self._file is None: self._open_volume()
+        self._file.write(body)
+        self._count += 1
+        if self._count >= self.volume_size: self._close_volume()
+
+    def close(self):
+        """ปิดเล่มสุดท้าย คืนรายการเล่มทั้งหมด"""
+        if self._file is not None: self._close_volume()
+        return self.volumes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._file is not None:
+            self._file.close()
+            os.remove(self._file.name)
+            self._file = None
+
+def prune_spool(spool_dir=BATCH_SPOOL_DIR, max_age=BATCH_SPOOL_TTL_SECONDS, now=None):
+    """ลบโฟลเดอร์งานพิมพ์ที่เก่ากว่า max_age วินาที"""
+    now = time.time() if now is None else now
+    if not os.path.isdir(spool_dir): return
+    for name in os.listdir(spool_dir):
+        path = os.path.join(spool_dir, name)
+        try:
+            if now - os.path.getmtime(path) > max_age: shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass # ถูกลบไปแล้ว
+
+def remove_spool_job(job_id, spool_dir=BATCH_SPOOL_DIR):
+    """ลบโฟลเดอร์ของงานพิมพ์ (เมื่องานหมดอายุ / ถูกดันออกจาก cache / process ปิด)"""
+    shutil.rmtree(os.path.join(spool_dir, job_id), ignore_errors=True)
+
+def write_batch_volumes(dataset, selected_hns, report_type, job_id, on_progress=None, workers=None,
+                        volume_size=BATCH_VOLUME_SIZE, spool_dir=BATCH_SPOOL_DIR):
+    """
+    สร้างรายงานแบบขนาน (iter_rendered_chunks) แล้วเขียนลงไฟล์ทันทีทีละชุด ไม่เก็บ HTML ทั้งหมดไว้ในหน่วยความจำ
+    Returns: (volumes, skipped_count, errors) โดย volumes เป็น list ของ {"path", "patients", "bytes"}
+    """
+    prune_spool(spool_dir)
+    errors, skipped_count = [], 0
+    job_dir = os.path.join(spool_dir, job_id)
+    try:
+        with BatchSpoolWriter(job_dir, build_batch_css(), volume_size) as writer:
+            for bodies, skipped, chunk_errors in iter_rendered_chunks(dataset, selected_hns, report_type, on_progress, workers):
+                for body in bodies: writer.add(body)
+                skipped_count += skipped
+                errors.extend(chunk_errors)
+    except BaseException:
+        remove_spool_job(job_id, spool_dir) # สร้างไม่เสร็จ (หรือ session ถูกหยุด): ไม่ทิ้งเล่มที่เขียนแล้วไว้
+        raise
+    if not writer.volumes: remove_spool_job(job_id, spool_dir)
+    return writer.volumes, skipped_count, errors
@@ -0,0 +1,106 @@
+"""
+วัดเวลาสร้างงานพิมพ์ชุด (Print Center) เทียบวิธีเดิม (กรอง df ทั้งตารางทีละ HN) กับการดึงประวัติรอบเดียว
+
+รัน:
+    python benchmark_batch_print.py                        # 10 / 100 / 500 / 1,000 / 5,000 คน
+    python benchmark_batch_print.py --sizes 10 500 --years 5
+    python benchmark_batch_print.py --render               # รวมเวลาสร้าง HTML ด้วย (ช้ากว่ามาก)
+    python benchmark_batch_print.py --render --workers 4   # เทียบสร้าง HTML ทีละคนกับแบบขนาน 4 process
+
+คอลัมน์ "พิมพ์ซ้ำ" คือการสร้างชุดเดิมอีกครั้งเมื่อ fragment ทุกคนอยู่ใน cache แล้ว (report_cache.py)
+
+ข้อมูลเป็นข้อมูลสังเคราะห์ (ตารางมีผู้ป่วยเท่ากับขนาดที่ใหญ่ที่สุด คนละ --years ปี)
+แล้วเลือกพิมพ์ N คนแรกจากตารางเดียวกัน เพื่อให้เห็นต้นทุนที่ขึ้นกับขนาดตาราง
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+
+import pandas as pd
+
+from utils import NUMERIC_LAB_COLUMNS
+from health_dataset import HealthDataset, read_health_table_columnar, columnar_snapshot_path, _write_columnar_snapshot
+from batch_renderer import iter_patient_records, render_batch_bodies, render_batch_parallel, shutdown_render_pool
+
+REPORT_TYPE = "ทั้งรายงานสุขภาพและสมรรถภาพ"
+DEFAULT_SIZES = [10, 100, 500, 1000, 5000]
+
+def make_health_frame(patients, years, seed=0):
+    """ตารางสุขภาพสังเคราะห์ patients x years แถว (มีคอลัมน์ตัวเลขที่รายงานใช้ครบ)"""
+    rng = random.Random(seed)
+    rows = []
+    for p in range(patients):
+        hn = str(100000 + p)
+        cid = str(1100000000000 + p)
+        for y in range(years):
+            row = {
+                "HN": hn, "Year": 2568 - y, "ชื่อ-สกุล": f"ทดสอบ{p} นามสกุล{p}", "เลขบัตรประชาชน": cid,
+                "หน่วยงาน": f"แผนก {p % 20}", "วันที่ตรวจ": f"{1 + p % 28}/1/{2568 - y}",
+            }
+            for col in NUMERIC_LAB_COLUMNS:
+                row[col] = round(rng.uniform(5, 150), 1)
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+def legacy_lookup(df, selected_hns):
+    """วิธีเดิม: กรองทั้งตาราง + sort ต่อ HN (O(จำนวนที่เลือก x จำนวนแถว))"""
+    for hn in selected_hns:
+        person_history_df = df[df["HN"] == hn]
+        if person_history_df.empty: continue
+        person_history_df.sort_values(by="Year", ascending=False).iloc[0].to_dict()
+
+def grouped_lookup(source, selected_hns):
+    """วิธีใหม่: iter_patient_records รอบเดียว (ประวัติ + แถวปีล่าสุดของทุกคน)"""
+    for _ in iter_patient_records(source, selected_hns):
+        pass
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="วัดเวลาสร้างงานพิมพ์ชุดตามจำนวนผู้ป่วย")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="จำนวนผู้ป่วยที่เลือกพิมพ์")
+    parser.add_argument("--years", type=int, default=3, help="จำนวนปีต่อผู้ป่วย")
+    parser.add_argument("--render", action="store_true", help="วัดเวลาสร้าง HTML ทั้งหมดด้วย")
+    parser.add_argument("--workers", type=int, default=0, help="วัดการสร้าง HTML แบบขนานด้วย worker N process (ใช้กับ --render)")
+    args = parser.parse_args()
+
+    sizes = sorted(args.sizes)
+    df = make_health_frame(max(sizes), args.years)
+    dataset = HealthDataset(df)
+    if args.workers > 1:
+        # worker อ่านข้อมูลจาก columnar snapshot (เหมือนใน app) จึงต้องมีไฟล์ snapshot
+        db_path = os.path.join(tempfile.mkdtemp(prefix="benchmark_batch_print_"), "data.db")
+        snapshot_path = columnar_snapshot_path(db_path, "benchmark")
+        _write_columnar_snapshot(df, [], snapshot_path)
+        dataset = HealthDataset(read_health_table_columnar(db_path, "benchmark")[0], snapshot_path=snapshot_path)
+    hns = list(dict.fromkeys(df["HN"]))
+    print(f"ตาราง: {len(df):,} แถว ({len(hns):,} คน x {args.years} ปี)\n")
+
+    header = f"{'คน':>6} {'เดิม (s)':>10} {'groupby (s)':>12} {'index (s)':>10} {'เร็วขึ้น':>8}"
+    if args.render: header += f" {'render (s)':>11} {'ms/คน':>7} {'พิมพ์ซ้ำ (s)':>12}"
+    if args.render and args.workers > 1:
+        header += f" {f'x{args.workers} (s)':>9}"
+        timed(render_batch_parallel, dataset, hns[:200], REPORT_TYPE, None, args.workers, None) # เริ่ม pool ก่อน (ไม่นับเวลา spawn)
+    print(header)
+    for n in sizes:
+        selected = hns[:n]
+        legacy = timed(legacy_lookup, df, selected)
+        grouped = timed(grouped_lookup, df, selected)
+        indexed = timed(grouped_lookup, dataset, selected)
+        line = f"{n:>6,} {legacy:>10.3f} {grouped:>12.3f} {indexed:>10.3f} {legacy / max(indexed, 1e-9):>7.0f}x"
+        if args.render:
+            render = timed(render_batch_bodies, dataset, selected, REPORT_TYPE)
+            render_batch_parallel(dataset, selected, REPORT_TYPE, None, 1) # เติม fragment cache
+            line += f" {render:>11.2f} {render * 1000 / n:>7.1f} {timed(render_batch_parallel, dataset, selected, REPORT_TYPE, None, 1):>12.2f}"
+            if args.workers > 1:
+                line += f" {timed(render_batch_parallel, dataset, selected, REPORT_TYPE, None, args.workers, None):>9.2f}"
+        print(line)
+    shutdown_render_pool()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# ==============================================================================
+# Module: cache_utils.py
+# Purpose: cache ในหน่วยความจำที่ใช้ร่วมกันทั้ง process (thread-safe)
+# และ helper สำหรับ cache บนดิสก์ที่เก็บข้อมูลสุขภาพรายบุคคล
+# ==============================================================================
+
+_MISSING = object()
+
+# โฟลเดอร์/ไฟล์ cache ที่มีผลตรวจรายบุคคล (batch spool, report fragment spill): เฉพาะผู้ใช้ของ process นี้อ่านได้
+PRIVATE_DIR_MODE = 0o700
+PRIVATE_FILE_MODE = 0o600
+
+def make_private_dir(path):
+    os.makedirs(path, mode=PRIVATE_DIR_MODE, exist_ok=True)
+    os.chmod(path, PRIVATE_DIR_MODE) # โฟลเดอร์ที่มีอยู่แล้ว (หรือถูก umask ปรับ mode) ให้เหลือสิทธิ์เท่ากัน
+
+def private_opener(path, flags):
+    """ใช้เป็น opener= ของ open() ให้ไฟล์ใหม่ถูกสร้างด้วย PRIVATE_FILE_MODE"""
+    return os.open(path, flags, PRIVATE_FILE_MODE)
+
+class TTLLRUCache:
+    """
+    Cache ขนาดจำกัด (LRU) ที่แต่ละค่ามีอายุ (TTL) ของตัวเอง
+    - get() คืน default เมื่อไม่มีค่าหรือหมดอายุ
+    - set(key, value, ttl=None) ใช้ default_ttl ถ้าไม่ระบุ
+    - stats() คืนจำนวน hit / miss / eviction สำหรับดูประสิทธิภาพ
+    - on_evict(key, value) ถูกเรียกเมื่อค่าถูกเอาออก (หมดอายุ / ถูกดันออก / invalidate / clear) นอก lock
+      ใช้ปล่อยทรัพยากรที่ค่าถือไว้ (เช่นไฟล์) ค่าที่หมดอายุถูกเอาออกเมื่อ get() หรือ purge_expired() เท่านั้น
+    """
+
+    def __init__(self, maxsize=1024, default_ttl=300.0, clock=time.monotonic, on_evict=None):
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        self._clock = clock
+        self._on_evict = on_evict
+        self._data = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        removed = []
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > self._clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                removed.append((key, value))
+            self.misses += 1
+        self._evicted(removed)
+        return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        removed = []
+        with self._lock:
+            self._data[key] = (self._clock() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                old_key, (_, old_value) = self._data.popitem(last=False)
+                removed.append((old_key, old_value))
+                self.evictions += 1
+        self._evicted(removed)
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is not None: self._evicted([(key, entry[1])])
+
+    def clear(self):
+        with self._lock:
+            removed = [(key, value) for key, (_, value) in self._data.items()]
+            self._data.clear()
+        self._evicted(removed)
+
+    def purge_expired(self):
+        """เอาค่าที่หมดอายุออกทั้งหมด (ไม่ต้องรอ get) คืนจำนวนที่เอาออก"""
+        with self._lock:
+            now = self._clock()
+            removed = [(key, value) for key, (expires_at, value) in self._data.items() if expires_at <= now]
+            for key, _ in removed:
+                del self._data[key]
+        self._evicted(removed)
+        return len(removed)
+
+    def _evicted(self, removed):
+        if self._on_evict is None: return
+        for key, value in removed:
+            self._on_evict(key, value)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
@@ -0,0 +1,244 @@
+import os
+import json
+import hashlib
+import tempfile
+import time
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+import requests
+
+# -----------------------------------------------------------------------------
+# Configuration
+# -----------------------------------------------------------------------------
+
+DB_FILE_ID = "1HruO9AMrUfniC8hBWtumVdxLJayEc1Xr"
+DB_DOWNLOAD_URL = os.environ.get("HEALTH_DB_DOWNLOAD_URL", f"https://drive.google.com/uc?export=download&id={DB_FILE_ID}")
+
+# โฟลเดอร์เก็บ snapshot ของฐานข้อมูล (อยู่รอดข้ามการ rerun และข้าม TTL ของ cache)
+CACHE_DIR = os.environ.get("HEALTH_DB_CACHE_DIR", os.path.join(tempfile.gettempdir(), "health_report_cache"))
+DB_FILENAME = "health_data.db"
+META_FILENAME = "health_data.meta.json"
+
+# Streaming download: อ่านทีละ chunk เพื่อไม่ให้ทั้งไฟล์ค้างอยู่ใน RAM
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_DB_BYTES = int(os.environ.get("HEALTH_DB_MAX_BYTES", 512 * 1024 * 1024))
+MAX_DOWNLOAD_SECONDS = float(os.environ.get("HEALTH_DB_MAX_DOWNLOAD_SECONDS", 300))
+
+# Background refresh: ตรวจไฟล์ต้นทางทุกๆ กี่วินาที
+REFRESH_INTERVAL_SECONDS = float(os.environ.get("HEALTH_DB_REFRESH_SECONDS", 600))
+
+DatabaseSnapshot = namedtuple("DatabaseSnapshot", ["path", "sha256", "changed"])
+
+class DownloadBudgetExceeded(Exception):
+    """ดาวน์โหลดเกินขนาดหรือเวลาที่กำหนด"""
+
+# -----------------------------------------------------------------------------
+# Helper Functions
+# -----------------------------------------------------------------------------
+
+def _db_path():
+    return os.path.join(CACHE_DIR, DB_FILENAME)
+
+def _meta_path():
+    return os.path.join(CACHE_DIR, META_FILENAME)
+
+def _read_meta():
+    """อ่าน metadata ของ snapshot ล่าสุด (ETag / Last-Modified / sha256)"""
+    try:
+        with open(_meta_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_meta(meta):
+    tmp_path = _meta_path() + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, _meta_path())
+
+def _conditional_headers(meta):
+    headers = {}
+    if meta.get("etag"): headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"): headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
+
+# -----------------------------------------------------------------------------
+# Snapshot Download
+# -----------------------------------------------------------------------------
+
+def _fsync_dir(path):
+    try:
+        dir_fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return # บาง OS (เช่น Windows) เปิด directory ไม่ได้
+    try: os.fsync(dir_fd)
+    finally: os.close(dir_fd)
+
+def _stream_to_file(response, file_obj, progress_callback=None, max_bytes=None, max_seconds=None):
+    """เขียน response ลงไฟล์ทีละ chunk พร้อมคำนวณ sha256 และตรวจ budget ขนาด/เวลา"""
+    max_bytes = MAX_DB_BYTES if max_bytes is None else max_bytes
+    max_seconds = MAX_DOWNLOAD_SECONDS if max_seconds is None else max_seconds
+    total = int(response.headers.get("Content-Length") or 0) or None
+    if total and max_bytes and total > max_bytes:
+        raise DownloadBudgetExceeded(f"ไฟล์มีขนาด {total} bytes เกินกำหนด {max_bytes} bytes")
+
+    hasher = hashlib.sha256()
+    done = 0
+    started = time.monotonic()
+    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+        if not chunk: continue
+        file_obj.write(chunk)
+        hasher.update(chunk)
+        done += len(chunk)
+        if max_bytes and done > max_bytes:
+            raise DownloadBudgetExceeded(f"ดาวน์โหลดเกิน {max_bytes} bytes")
+        if max_seconds and time.monotonic() - started > max_seconds:
+            raise DownloadBudgetExceeded(f"ดาวน์โหลดนานเกิน {max_seconds} วินาที")
+        if progress_callback: progress_callback(done, total)
+    file_obj.flush()
+    os.fsync(file_obj.fileno())
+    return hasher.hexdigest()
+
+def fetch_database_snapshot(url=DB_DOWNLOAD_URL, timeout=60, progress_callback=None):
+    """
+    ดาวน์โหลดฐานข้อมูลแบบมีเงื่อนไข (Conditional GET) และเก็บ snapshot ไว้บนดิสก์
+    - ดาวน์โหลดแบบ stream ลงไฟล์ชั่วคราว (fsync แล้ว rename ทับแบบ atomic)
+    - progress_callback(bytes_done, total_bytes) ถูกเรียกทุก chunk (total อาจเป็น None)
+    Returns: DatabaseSnapshot(path, sha256, changed)
+      - changed=False เมื่อไฟล์ต้นทางไม่เปลี่ยน (304 หรือ hash เท่าเดิม) -> ไม่ต้อง parse ใหม่
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    db_path = _db_path()
+    meta = _read_meta()
+    has_local = os.path.exists(db_path) and bool(meta.get("sha256"))
+
+    headers = _conditional_headers(meta) if has_local else {}
+    with requests.get(url, headers=headers, timeout=timeout, stream=True) as response:
+        # 1. Server ยืนยันว่าไฟล์ไม่เปลี่ยน -> ใช้ snapshot เดิม
+        if response.status_code == 304 and has_local:
+            return DatabaseSnapshot(db_path, meta["sha256"], False)
+
+        response.raise_for_status()
+        new_meta = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".db.part")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                sha256 = _stream_to_file(response, tmp, progress_callback)
+            new_meta["sha256"] = sha256
+
+            # 2. Google Drive มักไม่ส่ง ETag -> เทียบด้วย content hash แทน
+            if has_local and sha256 == meta.get("sha256"):
+                _write_meta(new_meta)
+                return DatabaseSnapshot(db_path, sha256, False)
+
+            # 3. ไฟล์เปลี่ยนจริง -> rename ทับแบบ atomic
+            os.replace(tmp_path, db_path)
+            _fsync_dir(CACHE_DIR)
+        finally:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+
+    _write_meta(new_meta)
+    return DatabaseSnapshot(db_path, sha256, True)
+
+def local_snapshot():
+    """คืน snapshot ล่าสุดที่มีอยู่บนดิสก์ (ไม่เรียก network) หรือ None ถ้ายังไม่เคยดาวน์โหลด"""
+    meta = _read_meta()
+    if os.path.exists(_db_path()) and meta.get("sha256"):
+        return DatabaseSnapshot(_db_path(), meta["sha256"], False)
+    return None
+
+# -----------------------------------------------------------------------------
+# Stale-While-Revalidate Refresher
+# -----------------------------------------------------------------------------
+
+class DatasetRefresher:
+    """
+    ถือ dataset เวอร์ชันปัจจุบัน และสร้างเวอร์ชันถัดไปใน background thread
+    - ผู้ใช้ทุกคนอ่านเวอร์ชันเดิมไปก่อนจนกว่าเวอร์ชันใหม่จะสร้างเสร็จ แล้วจึงสลับ reference (atomic)
+    - ถ้า refresh ล้มเหลว จะเก็บ error ไว้ใน status และใช้เวอร์ชันเดิมต่อ
+    build_fn(snapshot) -> dataset (ต้องมี attribute .version = sha256 ของไฟล์)
+    """
+
+    def __init__(self, build_fn, fetch_fn=fetch_database_snapshot, interval=REFRESH_INTERVAL_SECONDS):
+        self._build_fn = build_fn
+        self._fetch_fn = fetch_fn
+        self._interval = interval
+        self._current = None
+        self._init_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._status = {
+            "state": "loading",
+            "version": None,
+            "loaded_at": None,
+            "last_checked_at": None,
+            "last_error": None,
+            "refreshing": False,
+            "memory": None,
+        }
+
+    def get(self):
+        """คืน dataset ปัจจุบัน (ครั้งแรกจะโหลดแบบรอผล เพราะยังไม่มีเวอร์ชันเดิมให้ใช้)"""
+        if self._current is None:
+            with self._init_lock:
+                if self._current is None:
+                    self._initial_load()
+                    self._start_thread()
+        return self._current
+
+    def request_refresh(self):
+        """ปลุก background thread ให้ตรวจไฟล์ต้นทางทันที"""
+        self._wake.set()
+
+    def status(self):
+        return dict(self._status)
+
+    def _initial_load(self):
+        try:
+            self.refresh_once()
+        except Exception as e:
+            # Drive ล่ม/ช้า: ใช้ snapshot เดิมบนดิสก์ไปก่อน ถ้ามี
+            snapshot = local_snapshot()
+            if snapshot is None: raise
+            self._swap(self._build_fn(snapshot))
+            self._status.update({"state": "stale", "last_error": str(e)})
+
+    def refresh_once(self):
+        """ตรวจไฟล์ต้นทาง 1 ครั้ง และสลับเป็นเวอร์ชันใหม่ถ้าไฟล์เปลี่ยน"""
+        with self._refresh_lock:
+            self._status["refreshing"] = True
+            try:
+                snapshot = self._fetch_fn()
+                current = self._current
+                if current is None or snapshot.sha256 != current.version:
+                    self._swap(self._build_fn(snapshot))
+                self._status.update({"state": "ok", "last_error": None})
+            finally:
+                self._status["refreshing"] = False
+                self._status["last_checked_at"] = datetime.now()
+
+    def _swap(self, dataset):
+        self._current = dataset
+        self._status.update({"version": dataset.version, "loaded_at": datetime.now(),
+                             "memory": getattr(dataset, "memory_report", None)})
+
+    def _start_thread(self):
+        if self._thread is not None: return
+        self._thread = threading.Thread(target=self._run, name="dataset-refresher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            try:
+                self.refresh_once()
+            except Exception as e:
+                self._status.update({"state": "stale", "last_error": str(e)})
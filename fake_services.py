@@ -0,0 +1,209 @@
+"""
+Fake Apps Script + Drive server สำหรับทดสอบโหลด/latency แบบ offline (ใช้ stdlib อย่างเดียว)
+
+รัน:
+    python fake_services.py --db health_data.db --seed-users 500 --latency 0.3 --jitter 0.2 --error-rate 0.05
+
+แล้วชี้แอปมาที่ server นี้:
+    HEALTH_GAS_URL=http://127.0.0.1:8765/exec \\
+    HEALTH_WEB_APP_URL=http://127.0.0.1:8765/exec \\
+    HEALTH_DB_DOWNLOAD_URL=http://127.0.0.1:8765/db \\
+    streamlit run app.py
+
+Endpoints
+    GET /exec?action=get_user&line_id=...   -> {"found": bool, "fname", "lname", "card_id"}
+    GET /exec?action=read                   -> รายการผู้ใช้ทั้งหมด (รูปแบบเดียวกับ Sheet)
+    GET /exec?action=write&fname=&lname=&line_id=&card_id=[&request_id=]
+                                            -> {"result": "success"} (request_id ซ้ำจะไม่บันทึกซ้ำ)
+    GET /exec?action=check                  -> {"result": "success", "users": n}
+    GET /db                                 -> ไฟล์ฐานข้อมูล (รองรับ ETag / If-None-Match / Last-Modified)
+    GET /__control?latency=&jitter=&error_rate=&hang_rate=&hang=
+                                            -> เปลี่ยนเงื่อนไขระหว่างทดสอบ คืนค่าปัจจุบัน
+    GET /__stats                            -> จำนวน request ต่อ action / error ที่ฉีดเข้าไป
+"""
+import os
+import json
+import time
+import random
+import hashlib
+import sqlite3
+import argparse
+import threading
+from collections import Counter
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from health_dataset import list_tables, pick_table, normalize_cid, HN_COL, NAME_COL, CITIZEN_ID_COL
+
+# -----------------------------------------------------------------------------
+# State
+# -----------------------------------------------------------------------------
+
+class FakeState:
+    """ข้อมูลผู้ใช้ LINE + เงื่อนไขการหน่วง/ฉีด error (แก้ได้ขณะรันผ่าน /__control)"""
+
+    def __init__(self, db_path=None, latency=0.0, jitter=0.0, error_rate=0.0, hang_rate=0.0, hang=30.0):
+        self.db_path = db_path
+        self.conditions = {"latency": latency, "jitter": jitter, "error_rate": error_rate, "hang_rate": hang_rate, "hang": hang}
+        self.users = {} # line_id -> record
+        self.request_ids = set()
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def seed_from_db(self, count):
+        """สร้างผู้ใช้ LINE ปลอม (U<HN>) จากผู้ป่วย count คนแรกในฐานข้อมูล"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            table = pick_table(list_tables(conn))
+            rows = conn.execute(f'SELECT DISTINCT "{HN_COL}", "{NAME_COL}", "{CITIZEN_ID_COL}" FROM "{table}" LIMIT ?', (count,)).fetchall()
+        finally:
+            conn.close()
+        for hn, name, cid in rows:
+            parts = str(name or "").split()
+            if not parts: continue
+            hn = str(hn).strip().removesuffix(".0")
+            self.add_user(f"U{hn}", parts[0], " ".join(parts[1:]), normalize_cid(cid))
+
+    def add_user(self, line_id, fname, lname, card_id):
+        with self.lock:
+            self.users[line_id] = {"LINE User ID": line_id, "ชื่อ": fname, "นามสกุล": lname, "เลขบัตรประชาชน": card_id,
+                                   "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+    def db_etag(self):
+        """ETag = sha256 ของไฟล์ (คำนวณใหม่เมื่อ mtime เปลี่ยน)"""
+        mtime = os.path.getmtime(self.db_path)
+        cached = getattr(self, "_etag_cache", None)
+        if cached and cached[0] == mtime: return cached[1]
+        hasher = hashlib.sha256()
+        with open(self.db_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""): hasher.update(chunk)
+        self._etag_cache = (mtime, f'"{hasher.hexdigest()}"')
+        return self._etag_cache[1]
+
+# -----------------------------------------------------------------------------
+# HTTP Handler
+# -----------------------------------------------------------------------------
+
+class FakeHandler(BaseHTTPRequestHandler):
+    state = None # FakeState (กำหนดตอนสร้าง server)
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject(self, name):
+        """หน่วงเวลา/ฉีด error ตามเงื่อนไขปัจจุบัน คืน True ถ้าตอบ error ไปแล้ว"""
+        cond = self.state.conditions
+        self.state.stats[name] += 1
+        time.sleep(max(0.0, cond["latency"] + random.uniform(0, cond["jitter"])))
+        if random.random() < cond["hang_rate"]:
+            self.state.stats["injected_hang"] += 1
+            time.sleep(cond["hang"])
+        if random.random() < cond["error_rate"]:
+            self.state.stats["injected_error"] += 1
+            self._send_json({"result": "error", "message": "injected failure"}, status=503)
+            return True
+        return False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == "/__control": return self._control(params)
+        if url.path == "/__stats": return self._send_json(dict(self.state.stats))
+        if url.path == "/db": return self._db()
+        if url.path in ("/exec", "/"): return self._exec(params)
+        self._send_json({"result": "error", "message": "not found"}, status=404)
+
+    def _control(self, params):
+        for key in self.state.conditions:
+            if key in params: self.state.conditions[key] = float(params[key])
+        self._send_json(self.state.conditions)
+
+    def _exec(self, params):
+        action = params.get("action", "")
+        if self._inject(action or "unknown"): return
+        users = self.state.users
+
+        if action == "get_user":
+            user = users.get(params.get("line_id", "").strip())
+            if user is None: return self._send_json({"found": False})
+            return self._send_json({"found": True, "fname": user["ชื่อ"], "lname": user["นามสกุล"], "card_id": user["เลขบัตรประชาชน"]})
+        if action == "read":
+            with self.state.lock: return self._send_json(list(users.values()))
+        if action == "write":
+            request_id = params.get("request_id")
+            with self.state.lock:
+                duplicate = bool(request_id) and request_id in self.state.request_ids
+                if request_id: self.state.request_ids.add(request_id)
+            if not duplicate:
+                self.state.add_user(params.get("line_id", ""), params.get("fname", ""), params.get("lname", ""), params.get("card_id", ""))
+            return self._send_json({"result": "success", "duplicate": duplicate})
+        if action == "check":
+            return self._send_json({"result": "success", "users": len(users)})
+        self._send_json({"result": "error", "message": f"unknown action: {action}"})
+
+    def _db(self):
+        if not self.state.db_path or not os.path.exists(self.state.db_path):
+            return self._send_json({"result": "error", "message": "no db configured"}, status=404)
+        if self._inject("db"): return
+        etag = self.state.db_etag()
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        size = os.path.getsize(self.state.db_path)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(os.path.getmtime(self.state.db_path), usegmt=True))
+        self.end_headers()
+        with open(self.state.db_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""): self.wfile.write(chunk)
+
+# -----------------------------------------------------------------------------
+# Entry Point
+# -----------------------------------------------------------------------------
+
+def make_server(state, host="127.0.0.1", port=8765):
+    handler = type("BoundFakeHandler", (FakeHandler,), {"state": state})
+    return ThreadingHTTPServer((host, port), handler)
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Apps Script / Drive server สำหรับทดสอบ offline")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--db", help="ไฟล์ SQLite ที่จะให้บริการที่ /db")
+    parser.add_argument("--seed-users", type=int, default=0, help="สร้างผู้ใช้ LINE ปลอมจากผู้ป่วย N คนแรกใน --db")
+    parser.add_argument("--latency", type=float, default=0.0, help="หน่วงทุก request (วินาที)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="หน่วงเพิ่มแบบสุ่ม 0..jitter วินาที")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="สัดส่วน request ที่ตอบ 503")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="สัดส่วน request ที่ค้างนาน --hang วินาที")
+    parser.add_argument("--hang", type=float, default=30.0)
+    args = parser.parse_args()
+
+    state = FakeState(args.db, args.latency, args.jitter, args.error_rate, args.hang_rate, args.hang)
+    if args.seed_users and args.db: state.seed_from_db(args.seed_users)
+
+    server = make_server(state, args.host, args.port)
+    print(f"Fake services on http://{args.host}:{args.port} (users={len(state.users)}, db={args.db or '-'})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import os
+import time
+import random
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# ==============================================================================
+# Module: gas_client.py
+# Purpose: HTTP client กลางสำหรับเรียก Google Apps Script (Web App) ทุกจุดในระบบ
+# - ใช้ Session ที่ keep-alive ร่วมกันทั้ง process (ไม่ต้องเปิด TLS ใหม่ทุกครั้ง)
+# - Retry แบบ exponential backoff + jitter ภายในงบเวลาของแต่ละ endpoint
+# - Circuit breaker: เมื่อล้มเหลวติดกันหลายครั้ง จะตอบกลับทันที (CircuitOpenError)
+#   แทนการรอ timeout ซ้ำๆ จนทุก worker thread ค้าง
+# ==============================================================================
+
+POOL_SIZE = int(os.environ.get("GAS_POOL_SIZE", 10))
+
+# (connect timeout, read timeout) ต่อ action และงบเวลารวมรวม retry (วินาที)
+ENDPOINT_TIMEOUTS = {
+    "get_user": (3.05, 8),
+    "read": (3.05, 20),
+    "write": (3.05, 15),
+}
+ENDPOINT_BUDGETS = {
+    "get_user": 10,
+    "read": 30,
+    "write": 20,
+}
+DEFAULT_TIMEOUT = (3.05, 15)
+DEFAULT_BUDGET = 20
+
+MAX_RETRIES = int(os.environ.get("GAS_MAX_RETRIES", 2))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 4.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("GAS_BREAKER_FAILURES", 5))
+BREAKER_RESET_SECONDS = float(os.environ.get("GAS_BREAKER_RESET_SECONDS", 30))
+
+# -----------------------------------------------------------------------------
+# Errors
+# -----------------------------------------------------------------------------
+
+class GasError(Exception):
+    """เรียก Apps Script ไม่สำเร็จ"""
+
+class CircuitOpenError(GasError):
+    """Circuit breaker เปิดอยู่ (ปลายทางล่ม) จึงไม่เรียกจริง"""
+
+class GasPermissionError(GasError):
+    """Web App ไม่ได้ deploy เป็น 'Anyone' (ถูก redirect ไปหน้า login ของ Google)"""
+
+class GasResponseError(GasError):
+    """ได้รับคำตอบที่อ่านเป็น JSON ไม่ได้"""
+
+class GasOutcomeUnknownError(GasError):
+    """
+    request ที่ไม่ idempotent ถูกส่งออกไปแล้วแต่ไม่ได้คำตอบ (เช่น read timeout) ปลายทางอาจบันทึกไปแล้ว
+    ผู้เรียกต้องตรวจผลจากข้อมูลปลายทางก่อนส่งซ้ำ
+    """
+
+# -----------------------------------------------------------------------------
+# Circuit Breaker
+# -----------------------------------------------------------------------------
+
+class CircuitBreaker:
+    """
+    closed -> (ล้มเหลวติดกัน failure_threshold ครั้ง) -> open
+    open -> (ครบ reset_timeout วินาที) -> half_open: ปล่อยให้ลองเรียกได้ 1 ครั้ง
+    half_open -> สำเร็จ = closed / ล้มเหลว = open ใหม่
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_SECONDS, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None: return "closed"
+        if self._clock() - self._opened_at >= self.reset_timeout: return "half_open"
+        return "open"
+
+    def allow(self):
+        """True ถ้าเรียกปลายทางได้ (half_open อนุญาตทีละ 1 request)"""
+        with self._lock:
+            state = self._state()
+            if state == "closed": return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+            self._probing = False
+
+    def retry_after(self):
+        """วินาทีที่เหลือก่อนจะลองเรียกใหม่ได้"""
+        with self._lock:
+            if self._opened_at is None: return 0.0
+            return max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+
+# -----------------------------------------------------------------------------
+# Client
+# -----------------------------------------------------------------------------
+
+def _backoff_delay(attempt):
+    """Full jitter: สุ่มระหว่าง 0 ถึง base * 2^attempt (ไม่เกิน BACKOFF_MAX_SECONDS)"""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+def _may_have_reached_server(e):
+    """False เฉพาะเมื่อแน่ใจว่า request ยังไม่ถูกส่ง (เชื่อมต่อไม่สำเร็จ / connect timeout)"""
+    if isinstance(e, requests.ConnectTimeout): return False
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return not isinstance(reason, NewConnectionError)
+
+def _new_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+class GasClient:
+    """
+    Client ของ Web App 1 URL (มี circuit breaker ของตัวเอง)
+    call(action, params) -> dict/list ที่ parse จาก JSON แล้ว หรือ raise GasError
+    """
+
+    def __init__(self, base_url, session=None, breaker=None):
+        self.base_url = base_url
+        self.session = session or _new_session()
+        self.breaker = breaker or CircuitBreaker()
+
+    def call(self, action, params=None, idempotent=True):
+        """
+        idempotent=False (เช่น write): retry เฉพาะกรณีเชื่อมต่อไม่ได้ (request ยังไม่ถูกส่ง)
+        เพื่อไม่ให้บันทึกซ้ำเมื่อ timeout หลังปลายทางได้รับข้อมูลไปแล้ว
+        กรณีนั้น raise GasOutcomeUnknownError แทน GasError
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Apps Script ไม่พร้อมใช้งาน (ลองใหม่ใน {self.breaker.retry_after():.0f} วินาที)")
+
+        query = {"action": action, **(params or {})}
+        timeout = ENDPOINT_TIMEOUTS.get(action, DEFAULT_TIMEOUT)
+        deadline = time.monotonic() + ENDPOINT_BUDGETS.get(action, DEFAULT_BUDGET)
+        attempt = 0
+        try:
+            while True:
+                try:
+                    response = self.session.get(self.base_url, params=query, timeout=timeout, allow_redirects=True)
+                    if response.status_code in RETRY_STATUS_CODES:
+                        raise requests.HTTPError(f"HTTP Error: {response.status_code}", response=response)
+                    break
+                except requests.RequestException as e:
+                    transient = isinstance(e, (requests.ConnectionError, requests.Timeout, requests.HTTPError))
+                    reached = _may_have_reached_server(e)
+                    retryable = transient and (idempotent or not reached)
+                    delay = _backoff_delay(attempt)
+                    if not retryable or attempt >= MAX_RETRIES or time.monotonic() + delay >= deadline:
+                        if transient and not idempotent and reached:
+                            raise GasOutcomeUnknownError(str(e)) from e
+                        raise GasError(str(e)) from e
+                    time.sleep(delay)
+                    attempt += 1
+        except BaseException:
+            # บันทึกทุกความล้มเหลว (รวม exception ที่ไม่ใช่ของ requests) ไม่เช่นนั้น probe ของ half_open จะค้างและไม่ปล่อยให้เรียกอีกเลย
+            self.breaker.record_failure()
+            raise
+
+        # ปลายทางตอบกลับแล้ว (แม้จะเป็น error ของสคริปต์) ถือว่าบริการยังทำงาน
+        self.breaker.record_success()
+        if "accounts.google.com" in response.url:
+            raise GasPermissionError("Permission Error: กรุณาตั้งค่า Deploy เป็น 'Anyone'")
+        if response.status_code != 200:
+            raise GasError(f"HTTP Error: {response.status_code}")
+        try:
+            return response.json()
+        except ValueError as e:
+            raise GasResponseError(f"Response Error: อ่านค่าตอบกลับไม่ได้ ({response.text[:50]}...)") from e
+
+    def status(self):
+        return {"url": self.base_url, "breaker": self.breaker.state, "retry_after": self.breaker.retry_after()}
+
+# -----------------------------------------------------------------------------
+# Shared Instances
+# -----------------------------------------------------------------------------
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(base_url):
+    """Client ของ URL นี้ (1 ตัวต่อ URL ต่อ process เพื่อให้ connection pool และ breaker อยู่รอดข้าม rerun)"""
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = _clients[base_url] = GasClient(base_url)
+        return client
+
+def all_client_status():
+    with _clients_lock:
+        return [client.status() for client in _clients.values()]
@@ -0,0 +1,659 @@
+import os
+import json
+import glob
+import hashlib
+import sqlite3
+import tempfile
+import math
+import difflib
+import threading
+import weakref
+from collections import Counter, defaultdict, namedtuple
+
+import pandas as pd
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
+
+from utils import NUMERIC_LAB_COLUMNS, NUMERIC_SUFFIX
+
+# ==============================================================================
+# Module: health_dataset.py
+# Purpose: ชุดข้อมูลสุขภาพแบบ read-only ที่ทุก session ใช้ร่วมกันทั้ง process
+# (ถือผ่าน st.cache_resource) แทนการ copy DataFrame ให้แต่ละ session
+# ==============================================================================
+
+HN_COL = "HN"
+YEAR_COL = "Year"
+CITIZEN_ID_COL = "เลขบัตรประชาชน"
+NAME_COL = "ชื่อ-สกุล"
+# คอลัมน์คีย์ที่สร้างตอนโหลด (ชื่อต้น / นามสกุลแบบตัดช่องว่าง) สำหรับเทียบชื่อโดยไม่ต้องวน iterrows
+FIRST_NAME_KEY_COL = "_first_name_key"
+LAST_NAME_KEY_COL = "_last_name_key"
+DEFAULT_TABLE = "health_data"
+KEY_TABLE = "patient_keys"
+
+# เปลี่ยนเลขนี้เมื่อขั้นตอน clean/แปลงข้อมูลเปลี่ยน เพื่อให้ snapshot เก่าถูกสร้างใหม่
+COLUMNAR_SCHEMA_VERSION = 2
+COLUMNAR_KEEP_VERSIONS = 2
+# ไฟล์คีย์ของ SqlitePatientStore (แยกจากไฟล์ snapshot) เปลี่ยนเลขเมื่อโครงสร้าง KEY_TABLE เปลี่ยน
+KEY_INDEX_SCHEMA_VERSION = 1
+
+# Compaction: คอลัมน์ข้อความที่จำนวนค่าไม่ซ้ำต่ำกว่าสัดส่วนนี้ของจำนวนแถว -> category
+# และคอลัมน์ตัวเลข "__num" ที่มีค่าน้อยกว่าสัดส่วนนี้ -> sparse
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+SPARSE_MAX_DENSITY = 0.3
+# คอลัมน์คีย์ที่ใช้สร้าง index / เทียบค่า ไม่แปลง dtype
+COMPACT_SKIP_COLUMNS = (HN_COL, YEAR_COL, CITIZEN_ID_COL, NAME_COL, FIRST_NAME_KEY_COL, LAST_NAME_KEY_COL)
+RAW_LAB_COLUMNS = frozenset(NUMERIC_LAB_COLUMNS)
+
+# Name search: ขนาด n-gram / สัดส่วน n-gram ของคำค้นที่ต้องตรงขั้นต่ำ (ยิ่งต่ำยิ่งทนคำสะกดผิด) / จำนวนผลสูงสุด
+SEARCH_NGRAM_SIZE = 3
+SEARCH_MIN_OVERLAP = 0.4
+SEARCH_RESULT_LIMIT = 100
+SEARCH_RERANK_LIMIT = 500
+
+# -----------------------------------------------------------------------------
+# Loading & Cleaning
+# -----------------------------------------------------------------------------
+
+def normalize_cid(val):
+    """ฟังก์ชันทำความสะอาดเลขบัตรประชาชนให้เป็นตัวเลข 13 หลักล้วน"""
+    if pd.isna(val): return ""
+    s = str(val).strip().replace("-", "").replace(" ", "").replace("'", "").replace('"', "")
+    if "E" in s or "e" in s:
+        try: s = str(int(float(s)))
+        except: pass
+    if s.endswith(".0"): s = s[:-2]
+    return s
+
+def list_tables(conn):
+    return [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE '\\_%' ESCAPE '\\';")]
+
+def pick_table(table_names):
+    """ใช้ตาราง health_data ถ้ามี ไม่เช่นนั้นใช้ตารางแรก"""
+    if DEFAULT_TABLE in table_names or not table_names: return DEFAULT_TABLE
+    return table_names[0]
+
+def normalize_cid_series(values):
+    """normalize_cid แบบ vectorized (ใช้ .str ทั้งคอลัมน์ แทน .apply ทีละค่า)"""
+    s = values.astype("string").str.strip().str.replace(r"[- '\"]", "", regex=True)
+    sci = s.str.contains("e", case=False, na=False)
+    if sci.any():
+        # ค่าที่ถูกเก็บเป็น scientific notation (เช่น 1.23456789e+12)
+        as_num = pd.to_numeric(s[sci], errors="coerce").dropna()
+        s.loc[as_num.index] = as_num.round().astype("int64").astype("string")
+    s = s.str.replace(r"\.0$", "", regex=True)
+    return s.fillna("").astype(str)
+
+def name_key(val):
+    """นามสกุลแบบตัดช่องว่างทั้งหมด (กติกาเดียวกับการเทียบชื่อใน login)"""
+    return str(val).replace(" ", "")
+
+def name_index_key(fname, lname=""):
+    """
+    คีย์ (ชื่อต้น, นามสกุลแบบตัดช่องว่าง) ของชื่อที่ผู้ใช้กรอก ด้วยกติกาเดียวกับตอนโหลดข้อมูล
+    (ยุบช่องว่าง แล้วแยกคำแรกเป็นชื่อต้น เหมือน normalize_db_name_field)
+    """
+    full = " ".join(f"{fname or ''} {lname or ''}".split())
+    first, _, last = full.partition(" ")
+    return first, name_key(last)
+
+def coerce_numeric_columns(df_loaded, columns=NUMERIC_LAB_COLUMNS):
+    """
+    แปลงคอลัมน์ผลแล็บ/สัญญาณชีพเป็น float ครั้งเดียวตอนโหลด (กติกาเดียวกับ get_float: ตัด ',' และช่องว่าง)
+    เก็บผลไว้ในคอลัมน์ "<ชื่อเดิม>__num" ส่วนคอลัมน์เดิมยังเป็นข้อความสำหรับแสดงผล
+    """
+    typed = {}
+    for col in columns:
+        if col not in df_loaded.columns: continue
+        values = df_loaded[col]
+        if pd.api.types.is_numeric_dtype(values):
+            typed[col + NUMERIC_SUFFIX] = values.astype("float64")
+        else:
+            text = values.astype(str).str.replace(",", "", regex=False).str.strip()
+            typed[col + NUMERIC_SUFFIX] = pd.to_numeric(text, errors="coerce").astype("float64")
+    if typed:
+        df_loaded = pd.concat([df_loaded, pd.DataFrame(typed, index=df_loaded.index)], axis=1)
+    return df_loaded
+
+def clean_health_frame(df_loaded):
+    """ทำความสะอาดคอลัมน์หลัก (HN / ชื่อ / เลขบัตร / Year) สร้างคอลัมน์คีย์สำหรับค้นหา และแปลงคอลัมน์ตัวเลข (vectorized ทั้งหมด)"""
+    df_loaded.columns = df_loaded.columns.str.strip()
+    df_loaded[HN_COL] = df_loaded[HN_COL].astype(str).str.strip().str.replace(r"\.0$", "", regex=True)
+    if NAME_COL in df_loaded.columns:
+        names = df_loaded[NAME_COL].astype(str).str.strip().str.replace(r'\s+', ' ', regex=True)
+        parts = names.str.split(" ", n=1, expand=True).reindex(columns=[0, 1]).fillna("").astype(str)
+        df_loaded[NAME_COL] = names
+        df_loaded[FIRST_NAME_KEY_COL] = parts[0]
+        df_loaded[LAST_NAME_KEY_COL] = parts[1].str.replace(" ", "", regex=False)
+    if CITIZEN_ID_COL in df_loaded.columns:
+        df_loaded[CITIZEN_ID_COL] = normalize_cid_series(df_loaded[CITIZEN_ID_COL])
+    df_loaded[YEAR_COL] = df_loaded[YEAR_COL].astype(int)
+    return coerce_numeric_columns(df_loaded)
+
+def read_health_table(db_path):
+    """Parse ไฟล์ SQLite ทั้งตารางเป็น DataFrame พร้อมทำความสะอาดคอลัมน์หลัก"""
+    conn = sqlite3.connect(db_path)
+    try:
+        table_names = list_tables(conn)
+        df_loaded = pd.read_sql(f'SELECT * FROM "{pick_table(table_names)}"', conn)
+    finally:
+        conn.close()
+    return clean_health_frame(df_loaded), table_names
+
+# -----------------------------------------------------------------------------
+# Columnar Snapshot (Arrow IPC / Feather)
+# -----------------------------------------------------------------------------
+
+def columnar_snapshot_path(db_path, content_hash):
+    return os.path.join(os.path.dirname(db_path), f"health_data.{content_hash[:16]}.v{COLUMNAR_SCHEMA_VERSION}.arrow")
+
+def _arrow_safe(df):
+    """คอลัมน์ object ที่มีทั้งตัวเลขและข้อความปนกัน แปลงค่าที่ไม่ว่างเป็นข้อความ (Arrow ต้องการ type เดียวต่อคอลัมน์)"""
+    df = df.infer_objects()
+    for col in df.columns[df.dtypes == object]:
+        kind = pd.api.types.infer_dtype(df[col], skipna=True)
+        if kind not in ("string", "empty", "boolean", "integer", "floating"):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+def _write_columnar_snapshot(df, table_names, path):
+    table = pa.Table.from_pandas(_arrow_safe(df), preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"table_names"] = json.dumps(table_names).encode("utf-8")
+    table = table.replace_schema_metadata(metadata)
+    # ไม่บีบอัด เพื่อให้ memory-map ได้โดยตรง
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".arrow.part")
+    os.close(fd)
+    try:
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+
+def _prune_old_versions(keep_path, name_pattern):
+    """ลบไฟล์เวอร์ชันเก่าที่ชื่อตรง name_pattern ในโฟลเดอร์เดียวกัน เหลือรวมไฟล์ปัจจุบันไม่เกิน COLUMNAR_KEEP_VERSIONS"""
+    pattern = os.path.join(os.path.dirname(keep_path), name_pattern)
+    old = sorted((p for p in glob.glob(pattern) if p != keep_path), key=os.path.getmtime, reverse=True)
+    for path in old[COLUMNAR_KEEP_VERSIONS - 1:]:
+        try: os.remove(path)
+        except OSError: pass
+
+def read_health_table_columnar(db_path, content_hash):
+    """
+    อ่านข้อมูลจาก columnar snapshot (memory-map) ของไฟล์เวอร์ชันนี้ ถ้ามี
+    ถ้ายังไม่มี: parse SQLite 1 ครั้ง แล้วเขียน snapshot ไว้ให้ process/refresh ถัดไปใช้
+    (ถ้าไม่มี pyarrow จะ parse SQLite ตามเดิม)
+    """
+    if feather is None or not content_hash:
+        return read_health_table(db_path)
+
+    path = columnar_snapshot_path(db_path, content_hash)
+    if not os.path.exists(path):
+        df_loaded, table_names = read_health_table(db_path)
+        try:
+            _write_columnar_snapshot(df_loaded, table_names, path)
+            _prune_old_versions(path, "health_data.*.arrow")
+        except (OSError, pa.ArrowException):
+            return df_loaded, table_names
+
+    table = feather.read_table(path, memory_map=True)
+    table_names = json.loads((table.schema.metadata or {}).get(b"table_names", b"[]"))
+    return table.to_pandas(split_blocks=True), table_names
+
+class SnapshotRowReader:
+    """
+    อ่านเฉพาะแถวของผู้ป่วยที่ต้องการจาก columnar snapshot แบบ memory-map (ไม่แปลงทั้งตารางเป็น DataFrame)
+    ใช้ใน worker process ของงานพิมพ์ชุด: ทุก process อ่านไฟล์เดียวกันผ่าน page cache ของระบบ แทนการได้ DataFrame คนละชุด
+    """
+
+    def __init__(self, path):
+        self._table = feather.read_table(path, memory_map=True)
+        hns = self._table.column(HN_COL).to_pandas()
+        self._rows = hns.groupby(hns, sort=False).indices
+
+    def dataset(self, hns, version=None):
+        """HealthDataset ขนาดเล็กที่มีเฉพาะประวัติของ hns (ค่าเหมือนที่อ่านจาก snapshot ทั้งตาราง)"""
+        positions = [self._rows[hn] for hn in dict.fromkeys(str(hn).strip() for hn in hns) if hn in self._rows]
+        take = np.concatenate(positions) if positions else np.array([], dtype=np.int64)
+        part = self._table.take(pa.array(take, type=pa.int64())).to_pandas(split_blocks=True)
+        return HealthDataset(part, version=version, compact=False)
+
+# -----------------------------------------------------------------------------
+# Memory Compaction
+# -----------------------------------------------------------------------------
+
+def frame_memory_bytes(df):
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+def compact_health_frame(df):
+    """
+    ลดหน่วยความจำของตารางก่อนใช้งาน (ค่าที่อ่านออกมาเหมือนเดิมทุกช่อง)
+    - คอลัมน์ข้อความที่ค่าซ้ำกันมาก/ว่างเกือบทั้งคอลัมน์ (เพศ, หน่วยงาน, วันที่ตรวจ, ผลอ่าน, คำแนะนำ) -> category
+    - คอลัมน์ "__num" ที่ว่างเกือบทั้งคอลัมน์ -> Sparse[float64] (เก็บเฉพาะช่องที่มีค่า)
+    - คอลัมน์ผลแล็บ/สัญญาณชีพต้นฉบับ (NUMERIC_LAB_COLUMNS) คงเดิม: กราฟแนวโน้มใช้คอลัมน์เหล่านี้โดยตรง
+      และค่าตัวเลขอยู่ในคอลัมน์ "__num" คู่กันแล้ว
+    Returns: (df, report) report = {"before": bytes, "after": bytes, "category": n, "sparse": n}
+    """
+    before = frame_memory_bytes(df)
+    n_rows = len(df)
+    converted = {}
+    n_category = n_sparse = 0
+    for col in df.columns:
+        if col in COMPACT_SKIP_COLUMNS or col in RAW_LAB_COLUMNS or not n_rows: continue
+        values = df[col]
+        if col.endswith(NUMERIC_SUFFIX):
+            if values.dtype == "float64" and values.notna().mean() < SPARSE_MAX_DENSITY:
+                converted[col] = values.astype(pd.SparseDtype("float64", np.nan))
+                n_sparse += 1
+        elif pd.api.types.is_string_dtype(values) and not isinstance(values.dtype, pd.CategoricalDtype):
+            # ข้าม object ที่มีตัวเลขปนข้อความ (category ต้องเรียงค่าได้)
+            if pd.api.types.infer_dtype(values, skipna=True) not in ("string", "empty"): continue
+            if values.nunique(dropna=True) <= n_rows * CATEGORY_MAX_UNIQUE_RATIO:
+                converted[col] = values.astype("category")
+                n_category += 1
+    if converted:
+        df = df.copy(deep=False)
+        for col, values in converted.items(): df[col] = values
+    return df, {"before": before, "after": frame_memory_bytes(df), "category": n_category, "sparse": n_sparse}
+
+# -----------------------------------------------------------------------------
+# Name Search Index
+# -----------------------------------------------------------------------------
+
+SearchHit = namedtuple("SearchHit", ["hn", "name", "score"])
+
+def _search_key(val):
+    """ชื่อสำหรับค้นหา: ตัดช่องว่างทั้งหมด + ตัวพิมพ์เล็ก"""
+    return "".join(str(val).split()).lower()
+
+def _ngrams(text, n=SEARCH_NGRAM_SIZE):
+    if len(text) <= n: return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+class NameSearchIndex:
+    """
+    ดัชนีค้นหาผู้ป่วยสำหรับหน้า Admin (สร้างครั้งเดียวต่อเวอร์ชันของข้อมูล)
+    - ชื่อไม่ซ้ำกัน (ต่อ HN) -> trigram postings: ค้นหาแบบ substring และทนคำสะกดผิดได้
+    - HN / เลขบัตรประชาชน -> map ตรงตัว
+    search() คืน SearchHit(hn, name, score) เรียงตามคะแนน ไม่ซ้ำ HN
+    """
+
+    def __init__(self, df):
+        self.hn_names = {}
+        names = {} # search key -> (ชื่อที่แสดง, [HN])
+        if NAME_COL in df.columns:
+            pairs = df[[HN_COL, NAME_COL]].dropna().drop_duplicates()
+            for hn, name in zip(pairs[HN_COL].to_numpy(), pairs[NAME_COL].astype(str).to_numpy()):
+                self.hn_names.setdefault(hn, name)
+                key = _search_key(name)
+                if not key: continue
+                names.setdefault(key, (name, []))[1].append(hn)
+        self._keys = list(names)
+        self._display = [names[k][0] for k in self._keys]
+        self._hns = [tuple(dict.fromkeys(names[k][1])) for k in self._keys]
+
+        postings = defaultdict(list)
+        for name_id, key in enumerate(self._keys):
+            for gram in _ngrams(key): postings[gram].append(name_id)
+        self._postings = dict(postings)
+
+        hn_values = df[HN_COL].to_numpy()
+        self._hn_set = set(hn_values)
+        self._cid_hns = {}
+        if CITIZEN_ID_COL in df.columns:
+            for cid, pos in df.groupby(CITIZEN_ID_COL, sort=False).indices.items():
+                if cid: self._cid_hns[cid] = tuple(dict.fromkeys(hn_values[pos]))
+
+    def _name_scores(self, query_key):
+        """คะแนนต่อชื่อ: substring = 1 (+0.5 ถ้าขึ้นต้นด้วยคำค้น) / ไม่ใช่ substring = สัดส่วน trigram ที่ตรง"""
+        scores = {}
+        if len(query_key) < SEARCH_NGRAM_SIZE:
+            # คำค้นสั้นเกินจะมี trigram: scan เฉพาะรายชื่อที่ไม่ซ้ำ (ไม่ใช่ทุกแถวของตาราง)
+            for name_id, key in enumerate(self._keys):
+                if query_key in key: scores[name_id] = 1.5 if key.startswith(query_key) else 1.0
+            return scores
+
+        grams = _ngrams(query_key)
+        counts = Counter()
+        for gram in grams: counts.update(self._postings.get(gram, ()))
+        min_shared = max(1, math.ceil(len(grams) * SEARCH_MIN_OVERLAP))
+        fuzzy = []
+        for name_id, shared in counts.items():
+            if shared < min_shared: continue
+            key = self._keys[name_id]
+            if query_key in key:
+                scores[name_id] = (1.5 if key.startswith(query_key) else 1.0) - 0.001 * abs(len(key) - len(query_key))
+            else:
+                fuzzy.append((shared, name_id))
+
+        # คำสะกดผิด: เรียงผู้สมัครตามจำนวน trigram ที่ตรง แล้วให้คะแนนละเอียดด้วยสัดส่วนตัวอักษรของคำค้นที่จับคู่ได้
+        fuzzy.sort(reverse=True)
+        for shared, name_id in fuzzy[:SEARCH_RERANK_LIMIT]:
+            key = self._keys[name_id]
+            blocks = difflib.SequenceMatcher(None, query_key, key, autojunk=False).get_matching_blocks()
+            matched = sum(block.size for block in blocks) / len(query_key)
+            scores[name_id] = 0.9 * matched - 0.001 * abs(len(key) - len(query_key))
+        return scores
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        text = str(query or "").strip()
+        if not text: return []
+        best = {}
+        def add(hn, score):
+            if score > best.get(hn, float("-inf")): best[hn] = score
+
+        if text in self._hn_set: add(text, 3.0)
+        cid = normalize_cid(text)
+        for hn in self._cid_hns.get(cid, ()): add(hn, 2.5)
+        for name_id, score in self._name_scores(_search_key(text)).items():
+            for hn in self._hns[name_id]: add(hn, score)
+
+        ranked = sorted(best.items(), key=lambda item: (-item[1], self.hn_names.get(item[0], "")))
+        return [SearchHit(hn, self.hn_names.get(hn, "-"), score) for hn, score in ranked[:limit]]
+
+    def display_name(self, hn):
+        return self.hn_names.get(hn, "-")
+
+_search_index_lock = threading.Lock()
+
+# -----------------------------------------------------------------------------
+# Datasets
+# -----------------------------------------------------------------------------
+
+class _PatientLookupMixin:
+    """เมธอดที่ใช้ร่วมกันของ backend ทุกแบบ (ต้องมี patient_history)"""
+
+    @property
+    def search_index(self):
+        """NameSearchIndex ของข้อมูลเวอร์ชันนี้ (สร้างเมื่อถูกเรียกครั้งแรก เช่น ตอน Admin ค้นหา)"""
+        index = self.__dict__.get("_search_index")
+        if index is None:
+            with _search_index_lock:
+                index = self.__dict__.get("_search_index")
+                if index is None:
+                    index = self._search_index = NameSearchIndex(self.df)
+        return index
+
+    def patient_year_row(self, hn, year):
+        """ข้อมูลของ HN ในปีที่เลือก (รวมหลายแถวของปีเดียวกันด้วย bfill/ffill) เป็น dict หรือ None"""
+        history = self.patient_history(hn)
+        yr_df = history[history[YEAR_COL] == year]
+        return yr_df.bfill().ffill().iloc[0].to_dict() if not yr_df.empty else None
+
+    def find_patient(self, cid, fname, lname):
+        """หาแถวที่เลขบัตร + ชื่อ + นามสกุลตรงกัน (เทียบผ่านคอลัมน์คีย์) คืน dict หรือ None"""
+        rows = self.rows_for_cid(cid)
+        if rows.empty or FIRST_NAME_KEY_COL not in rows.columns: return None
+        first, last = name_index_key(fname, lname)
+        hit = rows[(rows[FIRST_NAME_KEY_COL] == first) & (rows[LAST_NAME_KEY_COL] == last)]
+        return hit.iloc[0].to_dict() if not hit.empty else None
+
+    def find_by_name(self, fname, lname):
+        """แถวล่าสุดของผู้ป่วยที่ชื่อ + นามสกุลตรงกัน (ผ่าน name index) เป็น dict หรือ None"""
+        for hn in self.hns_for_name(fname, lname):
+            history = self.patient_history(hn)
+            if not history.empty: return history.iloc[-1].to_dict()
+        return None
+
+
+class PatientIndex:
+    """
+    Hash index สร้างครั้งเดียวต่อเวอร์ชันของข้อมูล (df ต้องเรียงตาม HN แล้ว)
+    - HN -> ช่วงแถว (start, stop)
+    - เลขบัตรประชาชน -> ตำแหน่งแถว และ HN ที่เกี่ยวข้อง
+    - (ชื่อต้น, นามสกุลแบบตัดช่องว่าง) -> HN
+    """
+
+    def __init__(self, df):
+        hn_values = df[HN_COL].to_numpy()
+        if len(hn_values):
+            bounds = np.flatnonzero(hn_values[1:] != hn_values[:-1]) + 1
+            starts = np.concatenate(([0], bounds))
+            stops = np.concatenate((bounds, [len(hn_values)]))
+            self.hn_slices = {hn: (int(a), int(b)) for hn, a, b in zip(hn_values[starts], starts, stops)}
+        else:
+            self.hn_slices = {}
+
+        self.cid_positions = {}
+        self.cid_hns = {}
+        if CITIZEN_ID_COL in df.columns:
+            for cid, pos in df.groupby(CITIZEN_ID_COL, sort=False).indices.items():
+                if not cid: continue
+                self.cid_positions[cid] = pos
+                self.cid_hns[cid] = tuple(dict.fromkeys(hn_values[pos]))
+
+        self.name_hns = {}
+        if FIRST_NAME_KEY_COL in df.columns:
+            groups = df.groupby([FIRST_NAME_KEY_COL, LAST_NAME_KEY_COL], sort=False).indices
+            for name, pos in groups.items():
+                self.name_hns[name] = tuple(dict.fromkeys(hn_values[pos]))
+
+
+class HealthDataset(_PatientLookupMixin):
+    """
+    ข้อมูลสุขภาพทั้งตาราง (ห้ามแก้ไขข้อมูลภายใน)
+    - เรียงแถวตาม (HN, Year) ไว้ล่วงหน้า ทำให้ประวัติของผู้ป่วยแต่ละคนเป็นช่วงแถวต่อเนื่อง
+      และ patient_history() คืนเป็น slice (view) ได้โดยไม่ต้อง copy
+      ผู้เรียกที่ต้องแก้ไขข้อมูลต้อง .copy() เอง (เช่น visualization.plot_historical_trends) ไม่พึ่ง option ของ pandas
+    - การค้นหาด้วย HN / เลขบัตร / ชื่อ ใช้ PatientIndex (O(1)) แทนการ scan ทั้งตาราง
+    - compact=True: ลด dtype ด้วย compact_health_frame() ผลอยู่ใน memory_report
+    - snapshot_path: ไฟล์ columnar snapshot ที่ df อ่านมา (ถ้ามี) ให้ worker ของงานพิมพ์ชุดอ่านจากไฟล์แทนการรับ df
+    """
+
+    def __init__(self, df, version=None, table_names=None, compact=True, snapshot_path=None):
+        df = df.sort_values([HN_COL, YEAR_COL], kind="stable").reset_index(drop=True)
+        self.memory_report = None
+        if compact: df, self.memory_report = compact_health_frame(df)
+        self._df = df
+        self._row_hashes = None
+        self._schema_bytes = repr(list(df.columns)).encode("utf-8")
+        # ประวัติที่ dataset นี้คืนให้ผู้เรียก (id -> DataFrame) ใช้ยืนยันว่า history_hash_bytes ได้ slice ของข้อมูลกลางจริง
+        self._issued = weakref.WeakValueDictionary()
+        self.index = PatientIndex(df)
+        self.version = version
+        self.table_names = table_names or []
+        self.snapshot_path = snapshot_path
+
+    @property
+    def df(self):
+        """DataFrame ทั้งตาราง (ใช้อ่านอย่างเดียว)"""
+        return self._df
+
+    def __len__(self):
+        return len(self._df)
+
+    def patient_history(self, hn):
+        """ประวัติทุกปีของ HN นี้ (เรียงตาม Year จากน้อยไปมาก) เป็น slice ของข้อมูลกลาง"""
+        start, stop = self.index.hn_slices.get(str(hn).strip(), (0, 0))
+        return self._issue(self._df.iloc[start:stop])
+
+    def iter_patient_records(self, hns):
+        """
+        คืน (hn, ประวัติ, แถวปีล่าสุดเป็น dict) ตามลำดับ hns ในรอบเดียว สำหรับงานพิมพ์ชุด
+        แถวปีล่าสุดของทุกคนแปลงเป็น dict ด้วย take + to_dict('records') ครั้งเดียว แทนทีละแถว
+        HN ที่ไม่พบจะได้ประวัติว่างและ None
+        """
+        slices = [self.index.hn_slices.get(str(hn).strip()) for hn in hns]
+        latest = iter(self._df.take([s[1] - 1 for s in slices if s]).to_dict("records"))
+        for hn, bounds in zip(hns, slices):
+            if bounds is None:
+                yield hn, self._df.iloc[0:0], None
+            else:
+                yield hn, self._issue(self._df.iloc[bounds[0]:bounds[1]]), next(latest)
+
+    def _issue(self, history):
+        self._issued[id(history)] = history
+        return history
+
+    @property
+    def row_hashes(self):
+        """hash ของแต่ละแถว (uint64) คำนวณครั้งเดียวต่อ snapshot แบบ vectorized"""
+        if self._row_hashes is None:
+            self._row_hashes = pd.util.hash_pandas_object(self._df, index=False).to_numpy()
+        return self._row_hashes
+
+    def history_hash_bytes(self, history):
+        """
+        ชื่อคอลัมน์ + row hash ของประวัติที่ได้จาก patient_history() / iter_patient_records() ของ dataset นี้ (ใช้ทำ key ของ report_cache)
+        คืน None ถ้า history ไม่ใช่ object ที่ dataset นี้คืนให้ (เช่น .copy() ที่ถูกแก้ไข แม้ index จะเหมือนเดิม)
+        ผู้เรียกจึงต้อง hash จากค่าจริงแทน
+        """
+        if self._issued.get(id(history)) is not history: return None
+        return self._schema_bytes + self.row_hashes[history.index.to_numpy()].tobytes()
+
+    def rows_for_cid(self, cid):
+        """แถวทั้งหมดที่มีเลขบัตรประชาชนตรงกัน"""
+        return self._df.take(self.index.cid_positions.get(cid, []))
+
+    def hns_for_cid(self, cid):
+        return self.index.cid_hns.get(cid, ())
+
+    def hns_for_name(self, fname, lname):
+        """HN ที่ชื่อ + นามสกุลตรงกัน (นามสกุลเทียบแบบตัดช่องว่าง)"""
+        return self.index.name_hns.get(name_index_key(fname, lname), ())
+
+    def find_patient(self, cid, fname, lname):
+        """หาแถวที่เลขบัตร + ชื่อ + นามสกุลตรงกัน (ใช้ index ทั้งหมด ไม่ scan ตาราง)"""
+        first, last = name_index_key(fname, lname)
+        name_hns = set(self.index.name_hns.get((first, last), ()))
+        for hn in self.hns_for_cid(cid):
+            if hn not in name_hns: continue
+            history = self.patient_history(hn)
+            hit = history[(history[CITIZEN_ID_COL] == cid) & (history[FIRST_NAME_KEY_COL] == first)
+                          & (history[LAST_NAME_KEY_COL] == last)]
+            if not hit.empty: return hit.iloc[0].to_dict()
+        return None
+
+
+class SqlitePatientStore(_PatientLookupMixin):
+    """
+    Backend แบบ lazy: เปิดไฟล์ SQLite แบบ read-only ค้างไว้ แล้ว query เฉพาะแถวของผู้ป่วยที่ต้องการ
+    - ใช้หน่วยความจำ/เวลาเริ่มต้นตามจำนวนแถวของผู้ป่วย 1 คน แทนทั้งตาราง
+    - .df (ทั้งตาราง) จะโหลดเมื่อถูกเรียกครั้งแรกเท่านั้น (สำหรับหน้า Admin / Print Center)
+    """
+
+    def __init__(self, db_path, version=None):
+        self.version = version
+        self.table_names, self._table, key_path = ensure_patient_key_index(db_path, version)
+        self._conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self._conn.execute("ATTACH DATABASE ? AS keys", (f"file:{key_path}?mode=ro",))
+        self._lock = threading.Lock()
+        self._full = None
+
+    def _query(self, where_sql, params):
+        sql = (f'SELECT h.* FROM "{self._table}" h JOIN keys.{KEY_TABLE} k ON k.row_id = h.rowid '
+               f'WHERE {where_sql} ORDER BY k.year, h.rowid')
+        with self._lock:
+            df_rows = pd.read_sql(sql, self._conn, params=params)
+        return clean_health_frame(df_rows)
+
+    def _ensure_full(self):
+        """HealthDataset ของทั้งตาราง (โหลดครั้งแรกที่ถูกเรียก แล้วเก็บไว้ใช้ซ้ำ)"""
+        if self._full is None:
+            with self._lock:
+                if self._full is None:
+                    df_all = clean_health_frame(pd.read_sql(f'SELECT * FROM "{self._table}"', self._conn))
+                    self._full = HealthDataset(df_all, version=self.version, table_names=self.table_names)
+        return self._full
+
+    @property
+    def df(self):
+        """DataFrame ทั้งตาราง"""
+        return self._ensure_full().df
+
+    @property
+    def memory_report(self):
+        return self._full.memory_report if self._full is not None else None
+
+    def patient_history(self, hn):
+        # โหลดทั้งตารางแล้ว (เช่น Print Center): ใช้ slice จาก index ในหน่วยความจำแทน query ทีละคน
+        if self._full is not None: return self._full.patient_history(hn)
+        return self._query("k.hn = ?", (str(hn).strip(),))
+
+    def iter_patient_records(self, hns):
+        """เหมือน HealthDataset.iter_patient_records (โหลดทั้งตารางก่อน เพราะงานพิมพ์ชุดใช้ข้อมูลหลายคน)"""
+        return self._ensure_full().iter_patient_records(hns)
+
+    def history_hash_bytes(self, history):
+        return self._full.history_hash_bytes(history) if self._full is not None else None
+
+    def rows_for_cid(self, cid):
+        return self._query("k.cid = ?", (cid,))
+
+    def _distinct_hns(self, where_sql, params):
+        with self._lock:
+            rows = self._conn.execute(f"SELECT DISTINCT hn FROM keys.{KEY_TABLE} WHERE {where_sql}", params).fetchall()
+        return tuple(r[0] for r in rows)
+
+    def hns_for_cid(self, cid):
+        return self._distinct_hns("cid = ?", (cid,))
+
+    def hns_for_name(self, fname, lname):
+        return self._distinct_hns("fname = ? AND lname = ?", name_index_key(fname, lname))
+
+
+def patient_key_index_path(db_path, content_hash):
+    return os.path.join(os.path.dirname(db_path), f"patient_keys.{content_hash[:16]}.v{KEY_INDEX_SCHEMA_VERSION}.db")
+
+def _file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""): hasher.update(chunk)
+    return hasher.hexdigest()
+
+def _write_key_index(rows, path):
+    """เขียนตารางคีย์ + index ลงไฟล์ชั่วคราว แล้ว rename (process อื่นจะไม่เห็นไฟล์ที่เขียนไม่ครบ)"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".db.part")
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            with conn:
+                conn.execute(f"CREATE TABLE {KEY_TABLE} (row_id INTEGER PRIMARY KEY, hn TEXT, cid TEXT, year INTEGER, fname TEXT, lname TEXT)")
+                conn.executemany(f"INSERT INTO {KEY_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+                                 rows.astype(object).where(rows.notna(), None).itertuples(index=False, name=None))
+                conn.execute(f"CREATE INDEX idx_{KEY_TABLE}_hn ON {KEY_TABLE}(hn, year)")
+                conn.execute(f"CREATE INDEX idx_{KEY_TABLE}_cid ON {KEY_TABLE}(cid)")
+                conn.execute(f"CREATE INDEX idx_{KEY_TABLE}_year ON {KEY_TABLE}(year)")
+                conn.execute(f"CREATE INDEX idx_{KEY_TABLE}_name ON {KEY_TABLE}(fname, lname)")
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+
+def ensure_patient_key_index(db_path, content_hash=None):
+    """
+    สร้างตารางคีย์ที่ normalize แล้ว (HN / เลขบัตร / Year / ชื่อ) พร้อม index ในไฟล์แยก (sidecar) ข้างไฟล์ snapshot
+    ทำครั้งเดียวต่อเวอร์ชัน (ชื่อไฟล์ตาม sha256 ของ snapshot) ตัว snapshot เปิดแบบ read-only เสมอ จึงยังตรงกับ sha256 ใน metadata
+    ต้องเก็บค่าที่ normalize แล้ว เพราะไฟล์ต้นทางเก็บ HN/เลขบัตรปนกันทั้งแบบข้อความและตัวเลข (เช่น '123.0')
+    Returns: (table_names, table_name, path ของไฟล์คีย์)
+    """
+    path = patient_key_index_path(db_path, content_hash or _file_sha256(db_path))
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        table_names = list_tables(conn)
+        table = pick_table(table_names)
+        if not os.path.exists(path):
+            cols = {c[1].strip(): c[1] for c in conn.execute(f'PRAGMA table_info("{table}")')}
+            cid_sql = f'"{cols[CITIZEN_ID_COL]}"' if CITIZEN_ID_COL in cols else "NULL"
+            name_sql = f'"{cols[NAME_COL]}"' if NAME_COL in cols else "NULL"
+            keys = pd.read_sql(
+                f'SELECT rowid AS row_id, "{cols[HN_COL]}" AS "{HN_COL}", {cid_sql} AS "{CITIZEN_ID_COL}", '
+                f'{name_sql} AS "{NAME_COL}", "{cols[YEAR_COL]}" AS "{YEAR_COL}" FROM "{table}"', conn
+            )
+            # ใช้กติกา normalize เดียวกับตอนโหลดทั้งตาราง
+            keys[YEAR_COL] = pd.to_numeric(keys[YEAR_COL], errors="coerce").fillna(0)
+            keys = clean_health_frame(keys)
+            _write_key_index(keys[["row_id", HN_COL, CITIZEN_ID_COL, YEAR_COL, FIRST_NAME_KEY_COL, LAST_NAME_KEY_COL]], path)
+            _prune_old_versions(path, "patient_keys.*.db")
+    finally:
+        conn.close()
+    return table_names, table, path
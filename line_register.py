@@ -1,98 +1,129 @@
 import streamlit as st
 import pandas as pd
 import streamlit.components.v1 as components
-import requests # ใช้ requests แทน gspread
 from datetime import datetime
 import json
 import os
 import time
+import sqlite3
+
+from line_user_store import LineUserStore
+from cache_utils import TTLLRUCache
+from gas_client import get_client, GasError, CircuitOpenError, GasOutcomeUnknownError
+from registration_outbox import RegistrationOutbox
 
 # --- Constants ---
 LIFF_ID = "2008725340-YHOiWxtj"
 
 # ✅ URL ของ Google Apps Script Web App
-WEB_APP_URL = "https://script.google.com/macros/s/AKfycbw0Dq-kZ2EfQtMSed-qbvt-2u2p4xASbKDVOa96sVAOBYbvLHIR7nKoMw8NSWWNIodb/exec"
+WEB_APP_URL = os.environ.get("HEALTH_WEB_APP_URL", "https://script.google.com/macros/s/AKfycbw0Dq-kZ2EfQtMSed-qbvt-2u2p4xASbKDVOa96sVAOBYbvLHIR7nKoMw8NSWWNIodb/exec")
+
+# Cache ผลการถามตัวตนจาก LINE ID (app.get_user_info_from_gas) ทั้งกรณีพบและไม่พบ
+# ล้างค่าของ LINE ID นั้นทันทีเมื่อ save_user_to_api บันทึกสำเร็จ
+LINE_IDENTITY_TTL_SECONDS = float(os.environ.get("LINE_IDENTITY_TTL_SECONDS", 600))
+LINE_IDENTITY_NEGATIVE_TTL_SECONDS = float(os.environ.get("LINE_IDENTITY_NEGATIVE_TTL_SECONDS", 60))
+line_identity_cache = TTLLRUCache(maxsize=int(os.environ.get("LINE_IDENTITY_CACHE_SIZE", 4096)),
+                                  default_ttl=LINE_IDENTITY_TTL_SECONDS)
 
 # --- API Helper Functions ---
 
-def get_all_users_from_api():
-    """ดึงข้อมูล User ทั้งหมดผ่าน Web App URL"""
+class RegistryFetchError(Exception):
+    """ดึงทะเบียนผู้ใช้จาก Web App ไม่สำเร็จ"""
+
+def fetch_all_users():
+    """
+    ดึงข้อมูล User ทั้งหมดผ่าน Web App URL (ไม่เรียก st.* จึงใช้จาก background thread ได้)
+    raise RegistryFetchError เมื่อเรียกไม่สำเร็จ
+    """
     try:
-        # ใช้ GET request และ follow redirects
-        response = requests.get(WEB_APP_URL, params={"action": "read"}, timeout=15, allow_redirects=True)
-        
-        if "accounts.google.com" in response.url:
-             st.error("🚨 Permission Error: สคริปต์ Google Sheet ของคุณไม่ได้เปิดเป็น 'Anyone' (ทุกคน)")
-             return []
+        data = get_client(WEB_APP_URL).call("read")
+    except GasError as e:
+        raise RegistryFetchError(f"Connection Error (Read): {e}") from e
 
-        if response.status_code == 200:
-            try:
-                data = response.json()
-            except json.JSONDecodeError:
-                try:
-                    data = json.loads(response.text)
-                except:
-                    st.error(f"⚠️ ได้รับ HTML แทน JSON: อาจเกิดจาก URL ผิด หรือสิทธิ์ไม่ถูกต้อง")
-                    return []
+    if isinstance(data, dict) and data.get("result") == "error":
+        raise RegistryFetchError(f"Google Script Error: {data.get('message')}")
+    return data
 
-            if isinstance(data, dict) and data.get("result") == "error":
-                st.error(f"Google Script Error: {data.get('message')}")
-                return []
-            return data
-        else:
-            st.error(f"API HTTP Error: {response.status_code}")
-            return []
-    except Exception as e:
-        st.error(f"Connection Error (Read): {e}")
+def get_all_users_from_api():
+    """ดึงข้อมูล User ทั้งหมด (แสดง error บนหน้าจอ และคืน [] เมื่อไม่สำเร็จ)"""
+    try:
+        return fetch_all_users()
+    except RegistryFetchError as e:
+        st.error(str(e))
         return []
 
-def save_user_to_api(fname, lname, line_user_id, id_card=""):
-    """ส่งข้อมูลไปบันทึกผ่าน Web App URL"""
-    st.info(f"🔄 กำลังส่งข้อมูลไปยัง Google Sheet... (Name: {fname})") # DEBUG
+@st.cache_resource
+def get_line_user_store():
+    """ทะเบียนผู้ใช้ LINE บนเครื่อง (ใช้ร่วมกันทั้ง process และ sync กับ Sheet ใน background)"""
+    store = LineUserStore(fetch_all_users)
+    store.ensure_started()
+    return store
+
+def save_user_to_api(fname, lname, line_user_id, id_card="", request_id=None):
+    """
+    ส่งข้อมูลไปบันทึกผ่าน Web App URL คืน (สำเร็จหรือไม่, ข้อความ)
+    สำเร็จ = None เมื่อไม่ทราบผล (ส่งถึงสคริปต์แล้วแต่ timeout) ห้ามส่งซ้ำจนกว่าจะตรวจกับ Sheet แล้ว
+    request_id: idempotency key จาก outbox (ส่งไปด้วยเผื่อสคริปต์ใช้กันบันทึกซ้ำ แต่ไม่พึ่งค่านี้)
+    """
+    params = {
+        "fname": fname,
+        "lname": lname,
+        "line_id": line_user_id,
+        "card_id": id_card
+    }
+    if request_id: params["request_id"] = request_id
     try:
-        # เตรียมข้อมูล
-        params = {
-            "action": "write",
-            "fname": fname,
-            "lname": lname,
-            "line_id": line_user_id,
-            "card_id": id_card
-        }
-        
-        # DEBUG: แสดง URL ที่กำลังจะยิง
-        st.write(f"Target URL: {WEB_APP_URL}")
-        st.write(f"Params: {params}")
+        # write ไม่ idempotent: client จะ retry เฉพาะกรณีที่ request ยังส่งไม่ถึงปลายทาง
+        res_json = get_client(WEB_APP_URL).call("write", params, idempotent=False)
+    except CircuitOpenError as e:
+        return False, f"ระบบบันทึกข้อมูลขัดข้องชั่วคราว: {e}"
+    except GasOutcomeUnknownError as e:
+        return None, f"ไม่ทราบผลการบันทึก (รอตรวจกับ Google Sheet): {e}"
+    except GasError as e:
+        return False, f"Write Error: {e}"
 
-        # 🟢 ใช้ GET Request
-        response = requests.get(WEB_APP_URL, params=params, timeout=15, allow_redirects=True)
-        
-        # DEBUG: แสดงผลลัพธ์ดิบๆ
-        st.write(f"Response Status: {response.status_code}")
-        # st.code(response.text) # ดูว่า Google ตอบอะไรกลับมา
+    # ตรวจสอบผลลัพธ์
+    if isinstance(res_json, dict) and res_json.get("result") == "success":
+        line_identity_cache.invalidate(str(line_user_id).strip())
+        # Write-through: อัปเดตทะเบียนบนเครื่องทันที ไม่ต้องรอรอบ sync
+        # (ถ้าเขียนไม่สำเร็จ รอบ sync ถัดไปจะดึงแถวนี้มาจาก Sheet เอง)
+        try: get_line_user_store().upsert_local(fname, lname, line_user_id, id_card)
+        except sqlite3.Error: pass
+        return True, "บันทึกข้อมูลลง Google Sheet เรียบร้อยแล้ว"
+    message = res_json.get("message") if isinstance(res_json, dict) else res_json
+    return False, f"Script Error: {message}"
 
-        if "accounts.google.com" in response.url:
-             return False, "Permission Error: กรุณาตั้งค่า Deploy เป็น 'Anyone'"
+def _send_queued_registration(job):
+    return save_user_to_api(job["fname"], job["lname"], job["line_id"], job["card_id"], request_id=job["idempotency_key"])
 
-        if response.status_code == 200:
-            # พยายาม Parse JSON
-            try:
-                res_json = response.json()
-            except json.JSONDecodeError:
-                try:
-                    res_json = json.loads(response.text)
-                except:
-                     return False, f"Response Error: อ่านค่าตอบกลับไม่ได้ ({response.text[:50]}...)"
+def _confirm_queued_registration(job):
+    """
+    งานที่ส่งแล้วไม่ทราบผล: sync ทะเบียนจาก Sheet ใหม่ (ถ้ายังไม่ได้ sync หลัง check_after) แล้วดูว่ามีแถวนี้แล้วหรือยัง
+    คืน True / False หรือ None ถ้าดึง Sheet ไม่สำเร็จ
+    """
+    store = get_line_user_store()
+    if store.synced_since() < job["check_after"]:
+        try: store.sync_once()
+        except RegistryFetchError: return None
+    return store.has_remote_registration(job["line_id"], job["fname"], job["lname"], job["card_id"])
 
-            # ตรวจสอบผลลัพธ์
-            if res_json.get("result") == "success":
-                return True, "บันทึกข้อมูลลง Google Sheet เรียบร้อยแล้ว"
-            else:
-                return False, f"Script Error: {res_json.get('message')}"
-        else:
-            return False, f"HTTP Error: {response.status_code}"
-    except Exception as e:
-        st.error(f"🔥 Python Error: {e}") # DEBUG
-        return False, f"Write Error: {e}"
+@st.cache_resource
+def get_registration_outbox():
+    """คิว write-behind ของการลงทะเบียน (worker ส่งไป Google Sheet ใน background)"""
+    outbox = RegistrationOutbox(_send_queued_registration, _confirm_queued_registration)
+    outbox.ensure_started()
+    return outbox
+
+def queue_user_registration(fname, lname, line_user_id, id_card=""):
+    """
+    บันทึกการลงทะเบียนลงคิวบนดิสก์ และอัปเดตทะเบียนบนเครื่องทันที (ไม่รอ Apps Script)
+    คืน idempotency key ของงาน
+    """
+    key = get_registration_outbox().enqueue(fname, lname, line_user_id, id_card)
+    line_identity_cache.invalidate(str(line_user_id).strip())
+    try: get_line_user_store().upsert_local(fname, lname, line_user_id, id_card)
+    except sqlite3.Error: pass
+    return key
 
 # --- Compatibility Functions ---
 save_new_user_to_gsheet = save_user_to_api
@@ -103,28 +134,16 @@ def test_connection_status():
 
 # --- User Management ---
 def check_if_user_registered(line_user_id):
+    """ค้นหา LINE ID จากทะเบียนบนเครื่อง (ไม่เรียก Google Sheet ระหว่างการใช้งาน)"""
     try:
-        users = get_all_users_from_api()
-        if not users: return False, None
-        
-        df = pd.DataFrame(users)
-        if df.empty: return False, None
-        
-        target_col = "LINE User ID"
-        actual_cols = df.columns.tolist()
-        for col in actual_cols:
-             if "line" in str(col).lower() and "id" in str(col).lower():
-                 target_col = col
-                 break
-        
-        if target_col in df.columns:
-            match = df[df[target_col].astype(str).str.strip() == str(line_user_id).strip()]
-            if not match.empty:
-                r = match.iloc[0]
-                fname = r.get("ชื่อ") or r.get("fname") or ""
-                lname = r.get("นามสกุล") or r.get("lname") or ""
-                return True, {"first_name": str(fname), "last_name": str(lname), "line_id": str(line_user_id)}
-        return False, None
+        store = get_line_user_store()
+        user = store.lookup(line_user_id)
+        if user is None:
+            # ยังไม่เคย sync สำเร็จเลย -> แจ้งสาเหตุแทนการบอกว่าไม่เคยลงทะเบียน
+            if not store.has_synced() and store.status().get("last_error"):
+                st.error(store.status()["last_error"])
+            return False, None
+        return True, {"first_name": user["first_name"], "last_name": user["last_name"], "line_id": str(line_user_id)}
     except Exception as e: 
         st.error(f"Check Logic Error: {e}")
         return False, None
@@ -135,18 +154,18 @@ def normalize_db_name_field(s):
     parts = clean_string(s).split()
     return (parts[0], " ".join(parts[1:])) if len(parts)>=2 else (parts[0], "") if parts else ("","")
 
-def check_registration_logic(df, f, l, i):
+def check_registration_logic(dataset, f, l, i):
     f, l, i = clean_string(f), clean_string(l), clean_string(i)
     if not f or not l or not i: return False, "กรอกข้อมูลให้ครบ", None
     if len(i.replace("-","")) != 13: return False, "เลขบัตรต้องมี 13 หลัก", None
     
     try:
         # Check SQLite Database
-        match = df[df['เลขบัตรประชาชน'].astype(str).str.strip().str.replace("-","") == i.replace("-","")]
+        cid = i.replace("-","")
+        match = dataset.rows_for_cid(cid)
         if match.empty: return False, "ไม่พบข้อมูลในระบบ", None
-        for _, row in match.iterrows():
-            db_f, db_l = normalize_db_name_field(row['ชื่อ-สกุล'])
-            if db_f == f and db_l.replace(" ","") == l.replace(" ",""): return True, "OK", row.to_dict()
+        row = dataset.find_patient(cid, f, l)
+        if row is not None: return True, "OK", row
         return False, "ชื่อ-นามสกุลไม่ตรง", None
     except Exception as e: return False, f"System Error: {e}", None
 
@@ -177,7 +196,7 @@ def liff_initializer_component():
 def render_admin_line_manager(): st.error("Disabled")
 
 # --- UI ---
-def render_registration_page(df):
+def render_registration_page(dataset):
     st.markdown("""<style>.reg-container {padding: 2rem; border-radius: 15px; box-shadow: 0 4px 15px rgba(0,0,0,0.1); max-width: 500px; margin: auto; background-color: white;} .stButton>button {background-color: #00B900 !important; color: white !important;}</style>""", unsafe_allow_html=True)
     
     qp = st.query_params.get("userid")
@@ -210,11 +229,7 @@ def render_registration_page(df):
         
         if is_reg:
             # เคยลงทะเบียน: เช็คว่าตรงกับ Database สุขภาพไหม
-            found = df[df['ชื่อ-สกุล'].str.contains(info['first_name'], na=False)]
-            user = None
-            for _, r in found.iterrows():
-                dbf, dbl = normalize_db_name_field(r['ชื่อ-สกุล'])
-                if dbf == info['first_name'] and dbl == info['last_name']: user = r; break
+            user = dataset.find_by_name(info['first_name'], info['last_name'])
             
             if user is not None:
                 # ข้อมูลตรง -> ให้เลือก Login หรือ ลงทะเบียนใหม่
@@ -266,29 +281,20 @@ def render_registration_page(df):
             
             # --- Logic หลังกดปุ่ม Submit ---
             if sub:
-                st.write("DEBUG: Submit button pressed!") # DEBUG Checkpoint 1
-                
                 if not pdpa: st.warning("กรุณายอมรับ PDPA")
                 else:
-                    suc, msg, row = check_registration_logic(df, f, l, i)
+                    suc, msg, row = check_registration_logic(dataset, f, l, i)
                     if suc:
-                        st.write("DEBUG: Logic Passed. Saving...") # DEBUG Checkpoint 2
-                        with st.spinner("⏳ กำลังบันทึกข้อมูลไปยัง Google Sheets..."):
-                            sv_suc, sv_msg = save_user_to_api(clean_string(f), clean_string(l), uid, clean_string(i))
-                        
-                        if sv_suc:
-                            st.success(f"✅ {sv_msg}") 
-                            st.session_state['line_saved'] = True
-                            st.session_state['line_register_success'] = True
-                            st.session_state['authenticated'] = True
-                            st.session_state['pdpa_accepted'] = True
-                            st.session_state['user_hn'] = row['HN']
-                            st.session_state['user_name'] = row['ชื่อ-สกุล']
-                            if 'force_re_register' in st.session_state: del st.session_state['force_re_register']
-                            time.sleep(2)
-                            st.rerun()
-                        else: 
-                            st.error(f"❌ บันทึกไม่สำเร็จ: {sv_msg}")
+                        # ยืนยันตัวตนกับฐานข้อมูลสุขภาพแล้ว -> บันทึกลงคิว (ส่งไป Google Sheet ใน background)
+                        queue_user_registration(clean_string(f), clean_string(l), uid, clean_string(i))
+                        st.session_state['line_saved'] = True
+                        st.session_state['line_register_success'] = True
+                        st.session_state['authenticated'] = True
+                        st.session_state['pdpa_accepted'] = True
+                        st.session_state['user_hn'] = row['HN']
+                        st.session_state['user_name'] = row['ชื่อ-สกุล']
+                        if 'force_re_register' in st.session_state: del st.session_state['force_re_register']
+                        st.rerun()
                     else: 
                         st.error(f"❌ {msg}")
             st.markdown("</div>", unsafe_allow_html=True)
@@ -0,0 +1,173 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime
+
+from data_loader import CACHE_DIR
+
+# ==============================================================================
+# Module: line_user_store.py
+# Purpose: สำเนาทะเบียนผู้ใช้ LINE (Google Sheet) ลง SQLite บนเครื่อง
+# - หน้า ลงทะเบียน / Auto-login อ่านจากไฟล์นี้แทนการดาวน์โหลดทั้ง Sheet ทุกครั้ง
+# - background thread ดึง Sheet มาเทียบ แล้วเขียนเฉพาะแถวที่เปลี่ยน (diff-upsert)
+# - การลงทะเบียนใหม่เขียนลงไฟล์นี้ทันที (write-through) ไม่ต้องรอรอบ sync
+# ==============================================================================
+
+LINE_USERS_DB = os.environ.get("LINE_USERS_DB", os.path.join(CACHE_DIR, "line_users.db"))
+LINE_USERS_SYNC_SECONDS = float(os.environ.get("LINE_USERS_SYNC_SECONDS", 300))
+
+# -----------------------------------------------------------------------------
+# Record Normalization
+# -----------------------------------------------------------------------------
+
+def _clean(val):
+    return "" if val is None else str(val).strip()
+
+def _pick_line_id_key(record):
+    """คอลัมน์ LINE ID ของ Sheet (ชื่อคอลัมน์ที่มีทั้งคำว่า line และ id)"""
+    for key in record:
+        if "line" in str(key).lower() and "id" in str(key).lower(): return key
+    return "LINE User ID"
+
+def normalize_user_record(record):
+    """แปลงแถวจาก Sheet เป็น dict มาตรฐาน หรือ None ถ้าไม่มี LINE ID"""
+    line_id = _clean(record.get(_pick_line_id_key(record)))
+    if not line_id: return None
+    card_key = next((k for k in record if "card" in str(k).lower() or "บัตร" in str(k)), None)
+    return {
+        "line_id": line_id,
+        "first_name": _clean(record.get("ชื่อ") or record.get("fname")),
+        "last_name": _clean(record.get("นามสกุล") or record.get("lname")),
+        "card_id": _clean(record.get(card_key)) if card_key else "",
+    }
+
+def _row_hash(user):
+    raw = "\x1f".join((user["first_name"], user["last_name"], user["card_id"]))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+# -----------------------------------------------------------------------------
+# Store
+# -----------------------------------------------------------------------------
+
+class LineUserStore:
+    """
+    ทะเบียนผู้ใช้ LINE บน SQLite (PRIMARY KEY = LINE ID)
+    fetch_fn() -> list ของแถวจาก Sheet (ต้องไม่เรียก st.* เพราะรันใน background thread)
+    แถวที่เขียนจากเครื่องนี้ (pending=1) จะไม่ถูกลบระหว่าง sync จนกว่า Sheet จะมีแถวนั้นแล้ว
+    """
+
+    def __init__(self, fetch_fn, db_path=LINE_USERS_DB, interval=LINE_USERS_SYNC_SECONDS):
+        self._fetch_fn = fetch_fn
+        self._db_path = db_path
+        self._interval = interval
+        self._sync_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._status = {"last_synced_at": None, "last_error": None, "count": 0, "changed": 0}
+        self._synced_since = 0.0 # epoch ที่ sync สำเร็จล่าสุดเริ่มดึง Sheet (ข้อมูลใหม่อย่างน้อยเท่าเวลานี้)
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS line_users (line_id TEXT PRIMARY KEY, first_name TEXT, last_name TEXT, "
+                "card_id TEXT, row_hash TEXT, pending INTEGER DEFAULT 0, updated_at TEXT)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS sync_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _connect(self):
+        return sqlite3.connect(self._db_path, timeout=10)
+
+    # --- Read ---
+    def lookup(self, line_id):
+        """ข้อมูลผู้ใช้ของ LINE ID นี้ {first_name, last_name, line_id, card_id} หรือ None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT line_id, first_name, last_name, card_id FROM line_users WHERE line_id = ?",
+                               (_clean(line_id),)).fetchone()
+        if row is None: return None
+        return {"line_id": row[0], "first_name": row[1], "last_name": row[2], "card_id": row[3]}
+
+    def has_synced(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM sync_meta WHERE key = 'last_synced_at'").fetchone() is not None
+
+    def status(self):
+        return dict(self._status)
+
+    def synced_since(self):
+        """epoch ที่ข้อมูลจาก Sheet ในไฟล์นี้ใหม่อย่างน้อยเท่านั้น (0 = ยังไม่เคย sync ใน process นี้)"""
+        return self._synced_since
+
+    def has_remote_registration(self, line_id, fname, lname, card_id=""):
+        """True ถ้า Sheet (ณ sync ล่าสุด) มีการลงทะเบียนของ LINE ID นี้ด้วยข้อมูลชุดนี้แล้ว (ไม่นับแถวที่เขียนจากเครื่องนี้)"""
+        user = {"line_id": _clean(line_id), "first_name": _clean(fname), "last_name": _clean(lname), "card_id": _clean(card_id)}
+        with self._connect() as conn:
+            row = conn.execute("SELECT row_hash, pending FROM line_users WHERE line_id = ?", (user["line_id"],)).fetchone()
+        return row is not None and not row[1] and row[0] == _row_hash(user)
+
+    # --- Write ---
+    def upsert_local(self, fname, lname, line_id, card_id=""):
+        """Write-through หลังบันทึกลง Sheet สำเร็จ (ไม่ต้องรอ sync รอบถัดไป)"""
+        user = {"line_id": _clean(line_id), "first_name": _clean(fname), "last_name": _clean(lname), "card_id": _clean(card_id)}
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO line_users VALUES (?, ?, ?, ?, ?, 1, ?)",
+                (user["line_id"], user["first_name"], user["last_name"], user["card_id"], _row_hash(user), datetime.now().isoformat()),
+            )
+
+    # --- Sync ---
+    def sync_once(self):
+        """ดึงทั้ง Sheet แล้วเขียนเฉพาะแถวที่เพิ่ม/เปลี่ยน/ถูกลบ คืนจำนวนแถวที่เปลี่ยน"""
+        with self._sync_lock:
+            started = time.time()
+            remote = {}
+            for record in self._fetch_fn() or []:
+                if not isinstance(record, dict): continue
+                user = normalize_user_record(record)
+                if user: remote[user["line_id"]] = user # แถวหลังสุดของ LINE ID เดียวกันคือการลงทะเบียนล่าสุด
+
+            now = datetime.now().isoformat()
+            with self._connect() as conn:
+                local = {r[0]: (r[1], r[2]) for r in conn.execute("SELECT line_id, row_hash, pending FROM line_users")}
+                upserts = []
+                for line_id, u in remote.items():
+                    row_hash = _row_hash(u)
+                    old_hash, pending = local.get(line_id, (None, 0))
+                    # แถวที่ไม่เปลี่ยนข้ามไป (ยกเว้นแถว pending ที่ต้องล้างสถานะเมื่อ Sheet มีแล้ว)
+                    if old_hash == row_hash and not pending: continue
+                    upserts.append((line_id, u["first_name"], u["last_name"], u["card_id"], row_hash, now))
+                deletes = [(lid,) for lid, (_, pending) in local.items() if lid not in remote and not pending]
+                conn.executemany("INSERT OR REPLACE INTO line_users VALUES (?, ?, ?, ?, ?, 0, ?)", upserts)
+                conn.executemany("DELETE FROM line_users WHERE line_id = ?", deletes)
+                conn.execute("INSERT OR REPLACE INTO sync_meta VALUES ('last_synced_at', ?)", (now,))
+                count = conn.execute("SELECT COUNT(*) FROM line_users").fetchone()[0]
+
+            changed = len(upserts) + len(deletes)
+            self._status.update({"last_synced_at": now, "last_error": None, "count": count, "changed": changed})
+            self._synced_since = started
+            return changed
+
+    def ensure_started(self):
+        """sync แบบรอผลครั้งแรก (ถ้ายังไม่เคยมีข้อมูล) แล้วเริ่ม background thread"""
+        if self._thread is not None: return
+        with self._start_lock:
+            if self._thread is not None: return
+            if not self.has_synced():
+                try: self.sync_once()
+                except Exception as e: self._status["last_error"] = str(e)
+            self._thread = threading.Thread(target=self._run, name="line-user-sync", daemon=True)
+            self._thread.start()
+
+    def request_sync(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            try:
+                self.sync_once()
+            except Exception as e:
+                self._status["last_error"] = str(e)
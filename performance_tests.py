@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 from collections import OrderedDict
+from utils import get_typed_float, NOT_TYPED
 
 # ==============================================================================
 # หมายเหตุ: ไฟล์นี้ถูกปรับปรุงใหม่ทั้งหมด
@@ -17,7 +18,9 @@ def is_empty(val):
     return pd.isna(val) or str(val).strip().lower() in ["", "-", "none", "nan", "null"]
 
 def get_float(person_data, key):
-    """ดึงค่า float จาก dictionary อย่างปลอดภัย"""
+    """ดึงค่า float จาก dictionary อย่างปลอดภัย (ใช้ค่าที่แปลงไว้ตอนโหลดถ้ามี)"""
+    typed = get_typed_float(person_data, key)
+    if typed is not NOT_TYPED: return typed
     val = person_data.get(key, "")
     if is_empty(val):
         return None
@@ -477,10 +480,9 @@ def interpret_audiogram(current_year_data, all_person_history_df=None):
     Returns:
         dict: ผลการแปลข้อมูลอย่างละเอียด
     """
-    def to_int(val):
-        if is_empty(val): return None
-        try: return int(float(val))
-        except (ValueError, TypeError): return None
+    def to_int(data, col):
+        val = get_float(data, col)
+        return int(val) if val is not None else None
 
     freq_columns = {
         '500 Hz': ('R500', 'L500'),
@@ -508,8 +510,8 @@ def interpret_audiogram(current_year_data, all_person_history_df=None):
     # 1. ดึงข้อมูลปัจจุบัน (Current Year Data)
     has_current_data = False
     for freq, (r_col, l_col) in freq_columns.items():
-        r_val = to_int(current_year_data.get(r_col))
-        l_val = to_int(current_year_data.get(l_col))
+        r_val = to_int(current_year_data, r_col)
+        l_val = to_int(current_year_data, l_col)
         results['raw_values'][freq] = {'right': r_val, 'left': l_val}
         if r_val is not None or l_val is not None:
             has_current_data = True
@@ -522,8 +524,8 @@ def interpret_audiogram(current_year_data, all_person_history_df=None):
     # 2.1 ตรวจสอบหา Baseline ที่ระบุ (Explicit) ในข้อมูลปีปัจจุบัน
     has_explicit_baseline = False
     for freq, (r_col, l_col) in freq_columns.items():
-        r_base_val = to_int(current_year_data.get(r_col + 'B'))
-        l_base_val = to_int(current_year_data.get(l_col + 'B'))
+        r_base_val = to_int(current_year_data, r_col + 'B')
+        l_base_val = to_int(current_year_data, l_col + 'B')
         if r_base_val is not None or l_base_val is not None:
             has_explicit_baseline = True
         # เก็บค่า baseline ที่อาจจะมีไว้ก่อน
@@ -555,15 +557,15 @@ def interpret_audiogram(current_year_data, all_person_history_df=None):
                 
                 for freq, (r_col, l_col) in freq_columns.items():
                     results['baseline_values'][freq] = {
-                        'right': to_int(first_test_row.get(r_col)),
-                        'left': to_int(first_test_row.get(l_col))
+                        'right': to_int(first_test_row, r_col),
+                        'left': to_int(first_test_row, l_col)
                     }
 
     # 3. คำนวณค่าเฉลี่ยและสรุปผลของปีปัจจุบัน
-    results['averages']['right_500_2000'] = to_int(current_year_data.get('AVRต่ำ'))
-    results['averages']['left_500_2000'] = to_int(current_year_data.get('AVLต่ำ'))
-    results['averages']['right_3000_6000'] = to_int(current_year_data.get('AVRสูง'))
-    results['averages']['left_3000_6000'] = to_int(current_year_data.get('AVLสูง'))
+    results['averages']['right_500_2000'] = to_int(current_year_data, 'AVRต่ำ')
+    results['averages']['left_500_2000'] = to_int(current_year_data, 'AVLต่ำ')
+    results['averages']['right_3000_6000'] = to_int(current_year_data, 'AVRสูง')
+    results['averages']['left_3000_6000'] = to_int(current_year_data, 'AVLสูง')
     
     summary_r = current_year_data.get('ระดับการได้ยินหูขวา', '')
     summary_l = current_year_data.get('ระดับการได้ยินหูซ้าย', '')
@@ -621,24 +623,19 @@ def interpret_lung_capacity(person_data):
     Returns:
         tuple: (สรุปผล, คำแนะนำ, dictionary ข้อมูลดิบที่เกี่ยวข้อง)
     """
-    def to_float(val):
-        if is_empty(val): return None
-        try: return float(val)
-        except (ValueError, TypeError): return None
-
     # ดึงข้อมูลจาก person_data ด้วย key ที่ถูกต้อง
     raw_values = {
-        'FVC': to_float(person_data.get('FVC')),
-        'FVC predic': to_float(person_data.get('FVC predic')),
-        'FVC %': to_float(person_data.get('FVC เปอร์เซ็นต์')),
-        'FEV1': to_float(person_data.get('FEV1')),
-        'FEV1 predic': to_float(person_data.get('FEV1 predic')),
-        'FEV1 %': to_float(person_data.get('FEV1เปอร์เซ็นต์')),
-        'FEV1/FVC %': to_float(person_data.get('FEV1/FVC%')),
-        'FEV1/FVC % pre': to_float(person_data.get('FEV1/FVC % pre')),
-        'PEF': to_float(person_data.get('PEF')),
-        'FEF25-75': to_float(person_data.get('FEF25-75')),
-        'FEF25-75 %': to_float(person_data.get('FEF25-75 %')),
+        'FVC': get_float(person_data, 'FVC'),
+        'FVC predic': get_float(person_data, 'FVC predic'),
+        'FVC %': get_float(person_data, 'FVC เปอร์เซ็นต์'),
+        'FEV1': get_float(person_data, 'FEV1'),
+        'FEV1 predic': get_float(person_data, 'FEV1 predic'),
+        'FEV1 %': get_float(person_data, 'FEV1เปอร์เซ็นต์'),
+        'FEV1/FVC %': get_float(person_data, 'FEV1/FVC%'),
+        'FEV1/FVC % pre': get_float(person_data, 'FEV1/FVC % pre'),
+        'PEF': get_float(person_data, 'PEF'),
+        'FEF25-75': get_float(person_data, 'FEF25-75'),
+        'FEF25-75 %': get_float(person_data, 'FEF25-75 %'),
     }
 
     fvc_p = raw_values['FVC %']
@@ -694,18 +691,13 @@ def generate_holistic_advice(person_data):
     """
     สร้างสรุปความเห็นของแพทย์แบบองค์รวมโดยอัตโนมัติจากข้อมูลสุขภาพทั้งหมด
     """
-    def get_float(val):
-        if is_empty(val): return None
-        try: return float(str(val).replace(",", "").strip())
-        except: return None
-
     issues = {'high': [], 'medium': [], 'low': []}
 
     # 1. BMI and Blood Pressure
-    weight = get_float(person_data.get("น้ำหนัก"))
-    height = get_float(person_data.get("ส่วนสูง"))
-    sbp = get_float(person_data.get("SBP"))
-    dbp = get_float(person_data.get("DBP"))
+    weight = get_float(person_data, "น้ำหนัก")
+    height = get_float(person_data, "ส่วนสูง")
+    sbp = get_float(person_data, "SBP")
+    dbp = get_float(person_data, "DBP")
 
     if weight and height and height > 0:
         bmi = weight / ((height / 100) ** 2)
@@ -723,7 +715,7 @@ def generate_holistic_advice(person_data):
             issues['low'].append(f"ความดันโลหิตเริ่มสูง ({int(sbp)}/{int(dbp)} mmHg)")
 
     # 2. Blood Sugar (FBS)
-    fbs = get_float(person_data.get("FBS"))
+    fbs = get_float(person_data, "FBS")
     if fbs:
         if fbs >= 126:
             issues['high'].append(f"ระดับน้ำตาลในเลือดสูง เข้าเกณฑ์เบาหวาน ({int(fbs)} mg/dL)")
@@ -731,10 +723,10 @@ def generate_holistic_advice(person_data):
             issues['medium'].append(f"ภาวะเสี่ยงเบาหวาน ({int(fbs)} mg/dL)")
 
     # 3. Lipids (ไขมัน)
-    chol = get_float(person_data.get("CHOL"))
-    tgl = get_float(person_data.get("TGL"))
-    ldl = get_float(person_data.get("LDL"))
-    hdl = get_float(person_data.get("HDL"))
+    chol = get_float(person_data, "CHOL")
+    tgl = get_float(person_data, "TGL")
+    ldl = get_float(person_data, "LDL")
+    hdl = get_float(person_data, "HDL")
     lipid_issues = []
     if chol and chol >= 240: lipid_issues.append("Cholesterol สูง")
     if tgl and tgl >= 200: lipid_issues.append("Triglyceride สูง")
@@ -744,7 +736,7 @@ def generate_holistic_advice(person_data):
         issues['medium'].append(f"ภาวะไขมันในเลือดผิดปกติ ({', '.join(lipid_issues)})")
 
     # 4. Kidney Function (GFR)
-    gfr = get_float(person_data.get("GFR"))
+    gfr = get_float(person_data, "GFR")
     if gfr:
         if gfr < 30:
             issues['high'].append("การทำงานของไตลดลงอย่างมาก")
@@ -752,20 +744,20 @@ def generate_holistic_advice(person_data):
             issues['medium'].append("การทำงานของไตเริ่มเสื่อม")
 
     # 5. Liver Function (SGOT/SGPT)
-    sgot = get_float(person_data.get("SGOT"))
-    sgpt = get_float(person_data.get("SGPT"))
+    sgot = get_float(person_data, "SGOT")
+    sgpt = get_float(person_data, "SGPT")
     if (sgot and sgot > 37) or (sgpt and sgpt > 41):
         issues['medium'].append("ค่าเอนไซม์ตับสูงกว่าปกติ")
 
     # 6. Uric Acid
-    uric = get_float(person_data.get("Uric Acid"))
+    uric = get_float(person_data, "Uric Acid")
     if uric and uric > 7.2:
         issues['low'].append("ระดับกรดยูริกสูง")
 
     # 7. CBC (Anemia)
     sex = person_data.get("เพศ", "ชาย")
-    hb = get_float(person_data.get("Hb(%)"))
-    hct = get_float(person_data.get("HCT"))
+    hb = get_float(person_data, "Hb(%)")
+    hct = get_float(person_data, "HCT")
     hb_limit = 12 if sex == "หญิง" else 13
     hct_limit = 36 if sex == "หญิง" else 39
     if (hb and hb < hb_limit) or (hct and hct < hct_limit):
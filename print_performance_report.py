@@ -2,6 +2,7 @@ import pandas as pd
 import html
 from collections import OrderedDict
 from datetime import datetime
+from utils import get_typed_float, NOT_TYPED
 
 # แก้ไข: ตัด interpret_cxr ออกจาก import เพราะเราจะสร้างฟังก์ชันนี้ในไฟล์นี้เองเพื่อป้องกัน Error
 from performance_tests import interpret_audiogram, interpret_lung_capacity
@@ -13,6 +14,10 @@ from performance_tests import interpret_audiogram, interpret_lung_capacity
 # Refactored for Batch Printing capability.
 # ==============================================================================
 
+# เพิ่มเลขนี้ทุกครั้งที่แก้ HTML ของรายงานนี้หรือการแปลผลใน performance_tests.py
+# เพื่อให้ fragment ที่ cache ไว้ (report_cache.py) ถูกสร้างใหม่
+PERFORMANCE_TEMPLATE_VERSION = 1
+
 
 # --- Helper & Data Availability Functions ---
 
@@ -22,6 +27,8 @@ def is_empty(val):
 
 def get_float(col, person_data):
     """Safely gets a float value from person_data dictionary."""
+    typed = get_typed_float(person_data, col)
+    if typed is not NOT_TYPED: return typed
     try:
         val = person_data.get(col, "")
         if is_empty(val): return None
@@ -676,12 +683,14 @@ def render_performance_report_body(person_data, all_person_history_df):
     </div>
     """
 
-def generate_performance_report_html(person_data, all_person_history_df):
+def generate_performance_report_html(person_data, all_person_history_df, body_html=None):
     """
     Checks for available performance tests and generates the combined HTML for the standalone performance report.
+    body_html: body ที่สร้างไว้แล้ว (เช่นจาก fragment cache) ถ้าไม่ระบุจะสร้างใหม่
     """
     css_html = get_performance_report_css()
-    body_html = render_performance_report_body(person_data, all_person_history_df)
+    if body_html is None:
+        body_html = render_performance_report_body(person_data, all_person_history_df)
     
     # เพิ่ม window.print() เพื่อให้หน้าต่างพิมพ์เด้งขึ้นมาอัตโนมัติเมื่อโหลดหน้าเสร็จ
     final_html = f"""
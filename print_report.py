@@ -2,6 +2,10 @@ import pandas as pd
 from datetime import datetime
 import html
 import json
+from utils import get_typed_float, NOT_TYPED
+
+# เพิ่มเลขนี้ทุกครั้งที่แก้ HTML/การแปลผลของรายงาน เพื่อให้ fragment ที่ cache ไว้ (report_cache.py) ถูกสร้างใหม่
+REPORT_TEMPLATE_VERSION = 1
 
 # --- Helper Functions for Data Interpretation ---
 
@@ -11,6 +15,8 @@ def is_empty(val):
 
 def get_float(col, person_data):
     """Safely gets a float value from person_data dictionary."""
+    typed = get_typed_float(person_data, col)
+    if typed is not NOT_TYPED: return typed
     try:
         val = person_data.get(col, "")
         if is_empty(val): return None
@@ -598,12 +604,14 @@ def render_printable_report_body(person_data, all_person_history_df=None):
         </div>
     """
 
-def generate_printable_report(person_data, all_person_history_df=None):
+def generate_printable_report(person_data, all_person_history_df=None, body_content=None):
     """
     Generates the complete HTML file for the report (Single Person Print).
+    body_content: body ที่สร้างไว้แล้ว (เช่นจาก fragment cache) ถ้าไม่ระบุจะสร้างใหม่
     """
     css_content = get_main_report_css()
-    body_content = render_printable_report_body(person_data, all_person_history_df)
+    if body_content is None:
+        body_content = render_printable_report_body(person_data, all_person_history_df)
     
     return f"""
     <!DOCTYPE html>
@@ -0,0 +1,72 @@
+"""
+วัดเวลา import ของแต่ละโมดูล (cold start) ด้วย `python -X importtime` ใน process ใหม่ทุกครั้ง
+
+รัน:
+    python profile_imports.py                 # สรุปเวลา import ของโมดูลหลักทุกตัว
+    python profile_imports.py --top 15        # แสดง dependency ที่ช้าที่สุด 15 อันดับของแต่ละโมดูล
+    python profile_imports.py shared_ui       # วัดเฉพาะโมดูลที่ระบุ
+
+กลุ่ม "login path" คือโมดูลที่ app.py import ตอนเริ่ม (ก่อนผู้ใช้ผ่านหน้า Login / PDPA)
+ส่วนที่เหลือถูกโหลดแบบ lazy เมื่อถูกเรียกครั้งแรก
+"""
+import re
+import sys
+import argparse
+import subprocess
+
+LOGIN_PATH_MODULES = ["streamlit", "pandas", "data_loader", "gas_client", "health_dataset", "auth", "line_register", "utils"]
+DEFERRED_MODULES = ["shared_ui", "visualization", "print_report", "print_performance_report", "performance_tests", "report_cache", "batch_renderer", "batch_print", "admin_panel"]
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def measure(statement):
+    """รัน statement ใน process ใหม่ คืน list ของ (self_us, cumulative_us, depth, module)"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cum_us, indent, name = match.groups()
+            rows.append((int(self_us), int(cum_us), (len(indent) - 1) // 2, name))
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}")
+    return rows
+
+def total_ms(rows):
+    """เวลารวมของโมดูลระดับบนสุด (depth 0) หน่วย ms"""
+    return sum(cum for _, cum, depth, _ in rows if depth == 0) / 1000.0
+
+def report(modules, top):
+    for name in modules:
+        try:
+            rows = measure(f"import {name}")
+        except RuntimeError as e:
+            print(f"{name:<28} import ไม่ได้: {e}")
+            continue
+        print(f"{name:<28} {total_ms(rows):9.1f} ms  ({len(rows)} modules)")
+        for self_us, cum_us, depth, mod in sorted(rows, key=lambda r: r[1], reverse=True)[:top]:
+            print(f"    {cum_us / 1000.0:9.1f} ms  {mod}")
+
+def main():
+    parser = argparse.ArgumentParser(description="วัดเวลา import (cold start) ของโมดูลในแอป")
+    parser.add_argument("modules", nargs="*", help="ชื่อโมดูลที่จะวัด (ค่าเริ่มต้น: ทุกโมดูลหลัก)")
+    parser.add_argument("--top", type=int, default=0, help="แสดง dependency ที่ช้าที่สุด N อันดับ")
+    args = parser.parse_args()
+
+    if args.modules:
+        report(args.modules, args.top)
+        return
+
+    print("== Login path (import ตอนเริ่มแอป) ==")
+    report(LOGIN_PATH_MODULES, args.top)
+    print("\n== Deferred (lazy import เมื่อใช้ครั้งแรก) ==")
+    report(DEFERRED_MODULES, args.top)
+
+    print("\n== รวม (process ใหม่ import ทั้งกลุ่ม) ==")
+    login = total_ms(measure("; ".join(f"import {m}" for m in LOGIN_PATH_MODULES)))
+    full = total_ms(measure("; ".join(f"import {m}" for m in LOGIN_PATH_MODULES + DEFERRED_MODULES)))
+    print(f"login path: {login:9.1f} ms")
+    print(f"ทั้งหมด:     {full:9.1f} ms  (lazy import ประหยัด {full - login:.1f} ms ตอนเริ่ม)")
+
+if __name__ == "__main__":
+    main()
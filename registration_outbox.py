@@ -0,0 +1,180 @@
+import os
+import time
+import random
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime
+
+from data_loader import CACHE_DIR
+
+# ==============================================================================
+# Module: registration_outbox.py
+# Purpose: คิวบันทึกการลงทะเบียน LINE แบบ write-behind (SQLite outbox)
+# - หน้าลงทะเบียนบันทึกลงคิวบนดิสก์แล้วไปต่อได้ทันที ไม่ต้องรอ Apps Script
+# - background worker ส่งไป Google Sheet พร้อม retry (backoff) จนสำเร็จ
+# - คิวอยู่บนดิสก์ จึงไม่หายเมื่อ Apps Script ล่มหรือ process restart
+# - idempotency key: ลงทะเบียนข้อมูลชุดเดิมซ้ำ (เช่นกดปุ่มซ้ำ) จะไม่เพิ่มงานในคิว และส่งไปกับ request เป็น request_id
+#   แต่ถ้าผู้ใช้ลงทะเบียนข้อมูลอื่นไปแล้วในระหว่างนั้น (A -> B -> A) ชุดเดิมถูกส่งใหม่ เพื่อให้ Sheet มีข้อมูลล่าสุด
+# - ส่งแล้วไม่ทราบผล (timeout หลังส่งถึง Apps Script): ไม่ส่งซ้ำทันที รอจนสคริปต์ทำงานเสร็จแน่แล้ว
+#   ตรวจกับทะเบียนที่ sync จาก Sheet ก่อน (confirm_fn) ส่งใหม่เฉพาะเมื่อ Sheet ยังไม่มีแถวนั้น
+#   (ไม่พึ่งให้สคริปต์ฝั่ง Sheet กันแถวซ้ำจาก request_id)
+# ==============================================================================
+
+OUTBOX_DB = os.environ.get("REGISTRATION_OUTBOX_DB", os.path.join(CACHE_DIR, "registration_outbox.db"))
+OUTBOX_FLUSH_SECONDS = float(os.environ.get("REGISTRATION_OUTBOX_FLUSH_SECONDS", 30))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("REGISTRATION_OUTBOX_MAX_ATTEMPTS", 20))
+OUTBOX_BACKOFF_BASE_SECONDS = 5.0
+OUTBOX_BACKOFF_MAX_SECONDS = 30 * 60
+OUTBOX_BATCH_SIZE = 20
+# รอก่อนตรวจงานที่ไม่ทราบผล: เวลาทำงานสูงสุดของ Apps Script 1 ครั้ง (6 นาที) ถ้ายังไม่มีแถวหลังจากนี้ถือว่าไม่ได้บันทึก
+OUTBOX_CONFIRM_DELAY_SECONDS = float(os.environ.get("REGISTRATION_OUTBOX_CONFIRM_DELAY_SECONDS", 6 * 60))
+
+def registration_key(line_id, fname, lname, card_id):
+    """Idempotency key ของการลงทะเบียน (ข้อมูลชุดเดียวกัน = key เดียวกัน)"""
+    raw = "\x1f".join(str(v or "").strip() for v in (line_id, fname, lname, card_id))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+def _retry_delay(attempts):
+    return random.uniform(0.5, 1.0) * min(OUTBOX_BACKOFF_MAX_SECONDS, OUTBOX_BACKOFF_BASE_SECONDS * (2 ** attempts))
+
+
+class RegistrationOutbox:
+    """
+    send_fn(job) -> (True / False / None, ข้อความ) โดย None = ส่งถึงปลายทางแล้วแต่ไม่ทราบผล
+    job เป็น dict: {idempotency_key, line_id, fname, lname, card_id, check_after}
+    confirm_fn(job) -> True (Sheet มีแถวนี้แล้ว) / False (ยังไม่มี ส่งใหม่ได้) / None (ตรวจไม่ได้ ลองใหม่ภายหลัง)
+    ต้องตัดสินจากข้อมูล Sheet ที่อ่านหลัง job["check_after"] (epoch) เท่านั้น
+    ไม่มี confirm_fn: งานที่ไม่ทราบผลค้างสถานะ 'unconfirmed' ให้ผู้ดูแลตรวจเอง ไม่ส่งซ้ำ
+    (send_fn / confirm_fn ต้องไม่เรียก st.* เพราะรันใน background thread)
+    """
+
+    def __init__(self, send_fn, confirm_fn=None, db_path=OUTBOX_DB, interval=OUTBOX_FLUSH_SECONDS):
+        self._send_fn = send_fn
+        self._confirm_fn = confirm_fn
+        self._db_path = db_path
+        self._interval = interval
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox (idempotency_key TEXT PRIMARY KEY, line_id TEXT, fname TEXT, lname TEXT, "
+                "card_id TEXT, status TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0, next_attempt_at REAL DEFAULT 0, "
+                "last_error TEXT, created_at TEXT, sent_at TEXT, check_after REAL)"
+            )
+            # คิวที่สร้างจากเวอร์ชันก่อนยังไม่มีคอลัมน์ check_after
+            if "check_after" not in {c[1] for c in conn.execute("PRAGMA table_info(outbox)")}:
+                conn.execute("ALTER TABLE outbox ADD COLUMN check_after REAL")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self._db_path, timeout=10)
+
+    def enqueue(self, fname, lname, line_id, card_id=""):
+        """บันทึกงานลงคิว (commit ลงดิสก์ก่อนคืนค่า) แล้วปลุก worker คืน idempotency key"""
+        key = registration_key(line_id, fname, lname, card_id)
+        line_id = str(line_id).strip()
+        with self._connect() as conn:
+            latest = conn.execute("SELECT idempotency_key FROM outbox WHERE line_id = ? ORDER BY created_at DESC LIMIT 1",
+                                  (line_id,)).fetchone()
+            resubmitted = latest is not None and latest[0] != key
+            # ข้อมูลชุดเดิมที่เป็นการลงทะเบียนล่าสุดของผู้ใช้อยู่แล้ว (ส่งสำเร็จ / รออยู่ในคิว): ไม่เพิ่มงานซ้ำ
+            # ชุดที่ส่งไม่สำเร็จ หรือผู้ใช้กลับมาใช้ชุดเดิมหลังลงทะเบียนชุดอื่น: เริ่มงานใหม่ (created_at ใหม่ ส่งหลังชุดก่อนหน้า)
+            conn.execute(
+                "INSERT INTO outbox (idempotency_key, line_id, fname, lname, card_id, created_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(idempotency_key) DO UPDATE SET status = 'pending', attempts = 0, next_attempt_at = 0, "
+                "check_after = NULL, created_at = excluded.created_at WHERE status = 'failed' OR ?",
+                (key, line_id, str(fname).strip(), str(lname).strip(), str(card_id or "").strip(), datetime.now().isoformat(),
+                 resubmitted),
+            )
+        self._wake.set()
+        return key
+
+    def flush_once(self, now=None):
+        """ส่ง (หรือตรวจผล) งานที่ถึงเวลาแล้ว 1 รอบ คืนจำนวนงานที่สำเร็จ"""
+        with self._flush_lock:
+            now = time.time() if now is None else now
+            statuses = ("pending", "unconfirmed") if self._confirm_fn is not None else ("pending",)
+            with self._connect() as conn:
+                jobs = conn.execute(
+                    f"SELECT idempotency_key, line_id, fname, lname, card_id, attempts, status, check_after FROM outbox "
+                    f"WHERE status IN ({', '.join('?' * len(statuses))}) AND next_attempt_at <= ? ORDER BY created_at LIMIT ?",
+                    (*statuses, now, OUTBOX_BATCH_SIZE),
+                ).fetchall()
+
+            sent = 0
+            for key, line_id, fname, lname, card_id, attempts, status, check_after in jobs:
+                job = {"idempotency_key": key, "line_id": line_id, "fname": fname, "lname": lname, "card_id": card_id,
+                       "check_after": check_after}
+                if status == "unconfirmed":
+                    try:
+                        confirmed = self._confirm_fn(job)
+                    except Exception:
+                        confirmed = None
+                    if confirmed is None:
+                        # ตรวจไม่ได้ (เช่นดึง Sheet ไม่สำเร็จ): ตรวจใหม่ภายหลัง ไม่ส่งซ้ำ และไม่ยอมแพ้ (การอ่านไม่มีผลข้างเคียง)
+                        self._update(key, status="unconfirmed", attempts=attempts,
+                                     next_attempt_at=now + _retry_delay(attempts), last_error="ยังตรวจผลการบันทึกไม่ได้")
+                        continue
+                    if confirmed:
+                        self._mark_done(key)
+                        sent += 1
+                        continue
+                    # Sheet ไม่มีแถวนี้: ครั้งก่อนไม่ได้บันทึก ส่งใหม่ได้
+
+                try:
+                    ok, message = self._send_fn(job)
+                except Exception as e:
+                    ok, message = False, str(e)
+                attempts += 1
+                if ok:
+                    self._mark_done(key)
+                    sent += 1
+                elif ok is None:
+                    check_after = now + OUTBOX_CONFIRM_DELAY_SECONDS
+                    self._update(key, status="unconfirmed", attempts=attempts, next_attempt_at=check_after,
+                                 last_error=message, check_after=check_after)
+                else:
+                    status = "failed" if attempts >= OUTBOX_MAX_ATTEMPTS else "pending"
+                    self._update(key, status=status, attempts=attempts, next_attempt_at=now + _retry_delay(attempts),
+                                 last_error=message)
+            return sent
+
+    def _mark_done(self, key):
+        with self._connect() as conn:
+            conn.execute("UPDATE outbox SET status = 'done', sent_at = ?, last_error = NULL WHERE idempotency_key = ?",
+                         (datetime.now().isoformat(), key))
+
+    def _update(self, key, **fields):
+        with self._connect() as conn:
+            conn.execute(f"UPDATE outbox SET {', '.join(f'{name} = ?' for name in fields)} WHERE idempotency_key = ?",
+                         (*fields.values(), key))
+
+    def stats(self):
+        """จำนวนงานตามสถานะ {pending, unconfirmed, done, failed} และ error ล่าสุด"""
+        with self._connect() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+            last = conn.execute("SELECT last_error FROM outbox WHERE status != 'done' AND last_error IS NOT NULL "
+                                "ORDER BY next_attempt_at DESC LIMIT 1").fetchone()
+        return {"pending": counts.get("pending", 0), "unconfirmed": counts.get("unconfirmed", 0), "done": counts.get("done", 0),
+                "failed": counts.get("failed", 0), "last_error": last[0] if last else None}
+
+    def ensure_started(self):
+        if self._thread is not None: return
+        with self._start_lock:
+            if self._thread is not None: return
+            self._thread = threading.Thread(target=self._run, name="registration-outbox", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.flush_once()
+            except Exception:
+                pass # ไฟล์คิวอ่าน/เขียนไม่ได้ชั่วคราว: ลองใหม่รอบถัดไป
+            self._wake.wait(self._interval)
+            self._wake.clear()
@@ -0,0 +1,226 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from cache_utils import make_private_dir, private_opener
+
+from print_report import render_printable_report_body, generate_printable_report, REPORT_TEMPLATE_VERSION
+from print_performance_report import (
+    render_performance_report_body,
+    generate_performance_report_html,
+    PERFORMANCE_TEMPLATE_VERSION
+)
+
+# ==============================================================================
+# Module: report_cache.py
+# Purpose: cache HTML ของรายงานรายบุคคล (fragment) ใช้ร่วมกันทั้งหน้าผู้ใช้, Admin และ Print Center
+# - key = (ชนิดรายงาน, HN, Year, hash ของข้อมูล, เวอร์ชัน template) จึงไม่มีทางได้ HTML ของข้อมูลเก่า
+#   แก้ข้อมูลคนเดียวแล้วพิมพ์ทั้งแผนกใหม่ จะสร้างใหม่เฉพาะคนที่ข้อมูลเปลี่ยน
+# - LRU ในหน่วยความจำ ส่วนที่ถูกดันออกเขียนลงดิสก์ (spill) ได้ถ้าตั้ง REPORT_FRAGMENT_SPILL_DIR
+#   (ปิดไว้เป็นค่าเริ่มต้น เพราะเป็นผลตรวจสุขภาพรายบุคคล เปิดแล้วโฟลเดอร์/ไฟล์อ่านได้เฉพาะผู้ใช้ของ process นี้)
+# - เมื่อ snapshot ของข้อมูลเปลี่ยน fragment ที่ไม่ถูกใช้ตั้งแต่ snapshot ก่อนหน้าจะถูกลบทิ้ง
+# ==============================================================================
+
+FRAGMENT_CACHE_SIZE = int(os.environ.get("REPORT_FRAGMENT_CACHE_SIZE", 2000))
+# โฟลเดอร์สำหรับ spill ลงดิสก์ (ว่าง = ไม่ spill)
+FRAGMENT_SPILL_DIR = os.environ.get("REPORT_FRAGMENT_SPILL_DIR", "")
+FRAGMENT_SPILL_MAX_FILES = int(os.environ.get("REPORT_FRAGMENT_SPILL_MAX_FILES", 20000))
+
+# ชนิดรายงาน -> (ฟังก์ชันสร้าง body, เวอร์ชัน template)
+RENDERERS = {
+    "main": (render_printable_report_body, REPORT_TEMPLATE_VERSION),
+    "performance": (render_performance_report_body, PERFORMANCE_TEMPLATE_VERSION),
+}
+
+# -----------------------------------------------------------------------------
+# Keys
+# -----------------------------------------------------------------------------
+
+def content_digest(person_data, history, dataset=None):
+    """
+    hash ของข้อมูลที่ template อ่าน: แถวของปีที่พิมพ์ + ประวัติทุกปี (ผลการได้ยิน/ตารางย้อนหลังใช้ข้อมูลปีอื่นด้วย)
+    ถ้า history มาจาก dataset ที่มี row hash (HealthDataset) ใช้ค่านั้น ไม่ต้องแปลงทั้ง DataFrame ทุกครั้ง
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    # ลำดับ key ของ person_data คือลำดับคอลัมน์ของตาราง จึงไม่ต้อง sort
+    hasher.update("\x1f".join(f"{k}\x1e{v}" for k, v in person_data.items()).encode("utf-8"))
+    if history is not None and not history.empty:
+        row_hashes = dataset.history_hash_bytes(history) if hasattr(dataset, "history_hash_bytes") else None
+        if row_hashes is not None:
+            hasher.update(b"rows:" + row_hashes)
+        else:
+            hasher.update(repr(list(history.columns)).encode("utf-8"))
+            hasher.update(repr(history.to_numpy(dtype=object).tolist()).encode("utf-8"))
+    return hasher.hexdigest()
+
+def fragment_key(kind, person_data, digest):
+    # ปีปัจจุบันมีผลต่อ template (เช่นคอลัมน์ CXR/EKG ของปีนี้) จึงอยู่ใน key ด้วย
+    return (kind, str(person_data.get("HN", "")).strip(), str(person_data.get("Year", "")), digest,
+            RENDERERS[kind][1], datetime.now().year)
+
+# -----------------------------------------------------------------------------
+# Fragment Cache
+# -----------------------------------------------------------------------------
+
+class FragmentCache:
+    """
+    LRU ของ HTML fragment (thread-safe) พร้อม spill ลงดิสก์
+    - ไฟล์ชื่อตาม hash ของ key (content-addressed) จึงใช้ต่อข้าม process restart ได้อย่างปลอดภัย
+    - bind_snapshot(): นับรุ่นของ snapshot ทุก entry จำรุ่นล่าสุดที่ถูกใช้
+      entry ที่ไม่ถูกใช้ทั้งใน snapshot ปัจจุบันและก่อนหน้าจะถูกลบ (ส่วนใหญ่คือข้อมูลที่ถูกแก้ไปแล้ว)
+    """
+
+    def __init__(self, maxsize=FRAGMENT_CACHE_SIZE, spill_dir=FRAGMENT_SPILL_DIR, spill_max_files=FRAGMENT_SPILL_MAX_FILES):
+        self.maxsize = maxsize
+        self.spill_dir = spill_dir or None
+        self.spill_max_files = spill_max_files
+        self._data = OrderedDict() # key -> (html, generation)
+        self._spilled = {} # ชื่อไฟล์ -> generation (ไฟล์ที่ process นี้เขียน/อ่าน)
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._generation = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.spill_dir:
+            make_private_dir(self.spill_dir)
+            self._prune_spill()
+
+    def _file_name(self, key):
+        return hashlib.blake2b(repr(key).encode("utf-8"), digest_size=20).hexdigest() + ".html"
+
+    def bind_snapshot(self, snapshot):
+        """เรียกพร้อมเวอร์ชันของ dataset ทุกครั้งที่ใช้ (None = ไม่ทราบเวอร์ชัน ไม่ทำอะไร)"""
+        if snapshot is None: return
+        with self._lock:
+            if snapshot == self._snapshot: return
+            self._snapshot = snapshot
+            self._generation += 1
+            keep = self._generation - 1
+            for key in [k for k, (_, gen) in self._data.items() if gen < keep]:
+                del self._data[key]
+            stale_files = [name for name, gen in self._spilled.items() if gen < keep]
+            for name in stale_files:
+                del self._spilled[name]
+        for name in stale_files:
+            self._remove_file(name)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data[key] = (entry[0], self._generation)
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        body = self._read_spill(key)
+        with self._lock:
+            if body is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self.set(key, body)
+        return body
+
+    def set(self, key, body):
+        evicted = []
+        with self._lock:
+            self._data[key] = (body, self._generation)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False))
+        for old_key, (old_body, gen) in evicted:
+            self._write_spill(old_key, old_body, gen)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            names = list(self._spilled)
+            self._spilled.clear()
+        for name in names:
+            self._remove_file(name)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {"size": len(self._data), "maxsize": self.maxsize, "spilled": len(self._spilled),
+                    "hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "hit_rate": ((self.hits + self.disk_hits) / total) if total else 0.0}
+
+    # --- Disk spill ---
+
+    def _read_spill(self, key):
+        if not self.spill_dir: return None
+        name = self._file_name(key)
+        try:
+            with open(os.path.join(self.spill_dir, name), encoding="utf-8") as f:
+                body = f.read()
+        except OSError:
+            return None
+        with self._lock:
+            self._spilled[name] = self._generation
+        return body
+
+    def _write_spill(self, key, body, generation):
+        if not self.spill_dir: return
+        name = self._file_name(key)
+        path = os.path.join(self.spill_dir, name)
+        try:
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+            with open(tmp_path, "w", encoding="utf-8", opener=private_opener) as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        except OSError:
+            return # ดิสก์เต็ม/เขียนไม่ได้: ทิ้ง fragment นี้ไป (สร้างใหม่ได้เสมอ)
+        with self._lock:
+            self._spilled[name] = generation
+            over = len(self._spilled) > self.spill_max_files
+        if over: self._prune_spill()
+
+    def _remove_file(self, name):
+        try:
+            os.remove(os.path.join(self.spill_dir, name))
+        except OSError:
+            pass
+
+    def _prune_spill(self):
+        """ลบไฟล์เก่าสุดจนเหลือไม่เกิน 90% ของ spill_max_files (รวมไฟล์จาก process ก่อนหน้า)"""
+        try:
+            entries = [e for e in os.scandir(self.spill_dir) if e.name.endswith(".html")]
+        except OSError:
+            return
+        excess = len(entries) - int(self.spill_max_files * 0.9)
+        if excess <= 0: return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:excess]:
+            with self._lock:
+                self._spilled.pop(entry.name, None)
+            self._remove_file(entry.name)
+
+fragment_cache = FragmentCache()
+
+# -----------------------------------------------------------------------------
+# Cached Rendering
+# -----------------------------------------------------------------------------
+
+def cached_report_body(kind, person_data, history, dataset=None, cache=None):
+    """body ของรายงาน kind ('main' / 'performance') จาก cache หรือสร้างใหม่แล้วเก็บไว้ (dataset ใช้ผูก snapshot และทำ key)"""
+    cache = cache or fragment_cache
+    cache.bind_snapshot(getattr(dataset, "version", None))
+    key = fragment_key(kind, person_data, content_digest(person_data, history, dataset))
+    body = cache.get(key)
+    if body is None:
+        body = RENDERERS[kind][0](person_data, history)
+        cache.set(key, body)
+    return body
+
+def printable_report_html(person_data, history=None, dataset=None):
+    """เหมือน print_report.generate_printable_report แต่ใช้ body จาก fragment cache"""
+    return generate_printable_report(person_data, history, body_content=cached_report_body("main", person_data, history, dataset))
+
+def performance_report_html(person_data, history, dataset=None):
+    """เหมือน print_performance_report.generate_performance_report_html แต่ใช้ body จาก fragment cache"""
+    return generate_performance_report_html(person_data, history,
+                                            body_html=cached_report_body("performance", person_data, history, dataset))
@@ -8,6 +8,7 @@ from collections import OrderedDict
 from datetime import datetime
 import json
 import streamlit.components.v1 as components
+from utils import get_typed_float, NOT_TYPED
 
 # --- Helper Functions ---
 def is_empty(val):
@@ -19,6 +20,8 @@ def normalize_name(name):
     return re.sub(r'\s+', '', str(name).strip())
 
 def get_float(col, person_data):
+    typed = get_typed_float(person_data, col)
+    if typed is not NOT_TYPED: return typed
     try:
         val = person_data.get(col, "")
         if is_empty(val): return None
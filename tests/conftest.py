@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# โมดูลของแอปอยู่ที่ root ของ repo (ไม่ได้ติดตั้งเป็น package)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeClock:
+    """นาฬิกาที่เดินเองไม่ได้ (ใช้แทน time.monotonic / time.time) เลื่อนเวลาด้วย clock.now += วินาที"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
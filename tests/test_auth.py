@@ -0,0 +1,90 @@
+import pandas as pd
+import pytest
+
+import auth
+from auth import LoginThrottle, check_user_credentials
+
+OWNER_CID = "1234567890123"
+
+
+class FakeDataset:
+    version = "v1"
+
+    def rows_for_cid(self, cid):
+        return pd.DataFrame({"HN": ["001"]}) if cid == OWNER_CID else pd.DataFrame()
+
+    def find_patient(self, cid, fname, lname):
+        if cid == OWNER_CID and (fname, lname) == ("สมชาย", "ใจดี"):
+            return {"HN": "001", "name": "สมชาย ใจดี"}
+        return None
+
+
+@pytest.fixture
+def throttle(monkeypatch, clock):
+    throttle = LoginThrottle(free_attempts={"session": 3, "ip": 20}, alert_attempts=5, clock=clock)
+    monkeypatch.setattr(auth, "login_throttle", throttle)
+    auth.verified_identity_cache.clear()
+    return throttle
+
+
+def test_session_is_backed_off_after_free_attempts(throttle, clock):
+    for _ in range(4):
+        ok, _, _ = check_user_credentials(FakeDataset(), "ผิด", "ผิด", OWNER_CID, session_key="attacker")
+        assert not ok
+    ok, message, _ = check_user_credentials(FakeDataset(), "สมชาย", "ใจดี", OWNER_CID, session_key="attacker")
+    assert not ok and "กรุณารอ" in message
+    clock.now += auth.LOGIN_BACKOFF_MAX_SECONDS
+    ok, _, _ = check_user_credentials(FakeDataset(), "สมชาย", "ใจดี", OWNER_CID, session_key="attacker")
+    assert ok
+
+
+def test_failures_on_a_cid_never_lock_out_its_owner(throttle):
+    for i in range(50):
+        check_user_credentials(FakeDataset(), "ผิด", "ผิด", OWNER_CID, session_key=f"attacker-{i}", client_ip=f"10.0.0.{i}")
+    ok, _, user = check_user_credentials(FakeDataset(), "สมชาย", "ใจดี", OWNER_CID, session_key="owner", client_ip="10.1.1.1")
+    assert ok and user["HN"] == "001"
+
+
+def test_repeated_cid_failures_raise_an_alert(throttle):
+    for i in range(4):
+        check_user_credentials(FakeDataset(), "ผิด", "ผิด", OWNER_CID, session_key=f"s{i}")
+    assert throttle.alerts() == 0
+    check_user_credentials(FakeDataset(), "ผิด", "ผิด", OWNER_CID, session_key="s4")
+    assert throttle.alerts() == 1
+
+
+def test_ip_budget_is_larger_than_session_budget(throttle):
+    for i in range(20):
+        check_user_credentials(FakeDataset(), "ผิด", "ผิด", "9999999999999", session_key=f"s{i}", client_ip="10.0.0.1")
+    assert throttle.retry_after([("ip", "10.0.0.1")]) == 0
+    check_user_credentials(FakeDataset(), "ผิด", "ผิด", "9999999999999", session_key="s20", client_ip="10.0.0.1")
+    assert throttle.retry_after([("ip", "10.0.0.1")]) > 0
+
+
+def test_throttled_session_is_rejected_even_when_the_owner_is_cached(throttle):
+    ok, _, _ = check_user_credentials(FakeDataset(), "สมชาย", "ใจดี", OWNER_CID, session_key="owner", client_ip="10.0.0.1")
+    assert ok
+    for _ in range(4):
+        check_user_credentials(FakeDataset(), "ผิด", "ผิด", OWNER_CID, session_key="attacker", client_ip="10.0.0.9")
+    ok, message, _ = check_user_credentials(FakeDataset(), "สมชาย", "ใจดี", OWNER_CID, session_key="attacker", client_ip="10.0.0.9")
+    assert not ok and "กรุณารอ" in message
+    # ผลที่ cache ไว้เป็นของ session เจ้าของเท่านั้น
+    ok, _, _ = check_user_credentials(FakeDataset(), "สมชาย", "ใจดี", OWNER_CID, session_key="owner", client_ip="10.0.0.1")
+    assert ok
+
+
+def test_verified_identity_cache_is_scoped_to_the_session(throttle):
+    check_user_credentials(FakeDataset(), "สมชาย", "ใจดี", OWNER_CID, session_key="owner")
+    assert len(auth.verified_identity_cache) == 1
+    check_user_credentials(FakeDataset(), "สมชาย", "ใจดี", OWNER_CID, session_key="other")
+    assert len(auth.verified_identity_cache) == 2
+    check_user_credentials(FakeDataset(), "สมชาย", "ใจดี", OWNER_CID)
+    assert len(auth.verified_identity_cache) == 2
+
+
+def test_alert_count_drops_after_the_failure_window(throttle, clock):
+    for i in range(5):
+        check_user_credentials(FakeDataset(), "ผิด", "ผิด", OWNER_CID, session_key=f"s{i}")
+    assert throttle.alerts() == 1
+    clock.now += auth.LOGIN_FAILURE_WINDOW_SECONDS
+    assert throttle.alerts() == 0
@@ -0,0 +1,120 @@
+import os
+import stat
+from concurrent.futures import Future
+
+import pytest
+import pyarrow.feather as feather
+
+import batch_renderer
+import health_dataset
+from batch_renderer import (
+    iter_rendered_chunks, render_batch_parallel, shutdown_render_pool, BatchSpoolWriter, remove_spool_job,
+    BATCH_PARALLEL_MIN_PATIENTS
+)
+from benchmark_batch_print import make_health_frame, REPORT_TYPE
+from health_dataset import HealthDataset
+
+
+def snapshot_dataset(df, path, version):
+    """dataset ที่อ่านจาก columnar snapshot เหมือนใน app (worker อ่านไฟล์เดียวกัน)"""
+    health_dataset._write_columnar_snapshot(df, [], str(path))
+    loaded = feather.read_table(str(path), memory_map=True).to_pandas(split_blocks=True)
+    return HealthDataset(loaded, version=version, snapshot_path=str(path))
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    yield snapshot_dataset(make_health_frame(BATCH_PARALLEL_MIN_PATIENTS, 2), tmp_path / "v1.arrow", "v1")
+    shutdown_render_pool()
+
+
+def _hns(dataset):
+    return list(dict.fromkeys(dataset.df["HN"]))
+
+
+def test_replacing_the_pool_does_not_cancel_a_running_job(dataset, tmp_path):
+    hns = _hns(dataset)
+    expected = render_batch_parallel(dataset, hns, REPORT_TYPE, workers=1, cache=None)
+
+    chunks = iter_rendered_chunks(dataset, hns, REPORT_TYPE, workers=2, chunk_size=10, cache=None)
+    bodies, skipped, errors = next(chunks)
+    running_pool = batch_renderer._pool
+
+    # งานพิมพ์ของข้อมูลชุดใหม่เริ่มระหว่างที่งานแรกยังไม่เสร็จ: pool ถูกแทน แต่ pool เดิมต้องไม่ถูกปิด
+    other = snapshot_dataset(make_health_frame(5, 1), tmp_path / "v2.arrow", "v2")
+    new_pool = batch_renderer._acquire_pool(other, 2)
+    assert new_pool is not running_pool
+    batch_renderer._release_pool(new_pool)
+    assert batch_renderer._pool_users[running_pool] == 1
+    assert not running_pool._shutdown_thread
+
+    for chunk_bodies, chunk_skipped, chunk_errors in chunks:
+        bodies += chunk_bodies
+        skipped += chunk_skipped
+        errors += chunk_errors
+    assert (bodies, skipped, errors) == expected
+    # งานแรกคืน pool แล้ว: pool เดิมถูกปิด เหลือเฉพาะ pool ปัจจุบัน
+    assert running_pool not in batch_renderer._pool_users
+    assert batch_renderer._pool is new_pool
+
+
+class CancellingPool:
+    """pool ที่งานทุกชิ้นถูกยกเลิกก่อนเริ่ม (เหมือน pool ที่ถูกปิดด้วย cancel_futures)"""
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.cancel()
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def test_cancelled_jobs_fall_back_to_in_process_rendering(dataset, monkeypatch):
+    hns = _hns(dataset)
+    expected = render_batch_parallel(dataset, hns, REPORT_TYPE, workers=1, cache=None)
+    monkeypatch.setattr(batch_renderer, "_acquire_pool", lambda dataset, workers: CancellingPool())
+    monkeypatch.setattr(batch_renderer, "_release_pool", lambda pool: None)
+    assert render_batch_parallel(dataset, hns, REPORT_TYPE, workers=2, cache=None) == expected
+
+
+class FailingPool(CancellingPool):
+    """pool ที่งานทุกชิ้นล้มเหลวด้วย exception ทั่วไป (เช่น pickle ผลลัพธ์ไม่ได้)"""
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_exception(TypeError("cannot pickle"))
+        return future
+
+
+def test_failed_worker_chunks_are_rendered_in_process(dataset, monkeypatch):
+    hns = _hns(dataset)
+    expected = render_batch_parallel(dataset, hns, REPORT_TYPE, workers=1, cache=None)
+    monkeypatch.setattr(batch_renderer, "_acquire_pool", lambda dataset, workers: FailingPool())
+    monkeypatch.setattr(batch_renderer, "_release_pool", lambda pool: None)
+    assert render_batch_parallel(dataset, hns, REPORT_TYPE, workers=2, cache=None) == expected
+
+
+def test_spool_files_are_private_and_removed_with_the_job(tmp_path):
+    job_dir = tmp_path / "spool" / "job1"
+    with BatchSpoolWriter(str(job_dir), "", volume_size=1) as writer:
+        writer.add("<div>a</div>")
+        writer.add("<div>b</div>")
+    assert len(writer.volumes) == 2
+    for path in (job_dir.parent, job_dir):
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o700
+    for volume in writer.volumes:
+        assert stat.S_IMODE(os.stat(volume["path"]).st_mode) == 0o600
+
+    remove_spool_job("job1", str(tmp_path / "spool"))
+    assert not job_dir.exists()
+
+
+def test_idle_pool_is_shut_down(dataset, monkeypatch):
+    monkeypatch.setattr(batch_renderer, "BATCH_POOL_IDLE_SECONDS", 0.05)
+    pool = batch_renderer._acquire_pool(dataset, 2)
+    batch_renderer._release_pool(pool)
+    assert batch_renderer._pool is pool
+    batch_renderer._idle_timer.join(5)
+    assert batch_renderer._pool is None
+    assert pool not in batch_renderer._pool_users
@@ -0,0 +1,74 @@
+from cache_utils import TTLLRUCache
+
+
+def test_get_returns_value_until_ttl_expires(clock):
+    cache = TTLLRUCache(maxsize=4, default_ttl=10, clock=clock)
+    cache.set("a", 1)
+    clock.now += 9.9
+    assert cache.get("a") == 1
+    clock.now += 0.1
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_per_entry_ttl_overrides_default(clock):
+    cache = TTLLRUCache(maxsize=4, default_ttl=10, clock=clock)
+    cache.set("short", 1, ttl=1)
+    cache.set("long", 2)
+    clock.now += 5
+    assert cache.get("short", "missing") == "missing"
+    assert cache.get("long") == 2
+
+
+def test_lru_eviction_keeps_recently_used_entries(clock):
+    cache = TTLLRUCache(maxsize=2, default_ttl=60, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1 # a ถูกใช้ล่าสุด -> b เก่าสุด
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_and_stats(clock):
+    cache = TTLLRUCache(maxsize=4, default_ttl=60, clock=clock)
+    cache.set("a", 1)
+    cache.invalidate("a")
+    cache.invalidate("missing")
+    assert cache.get("a") is None
+    cache.set("b", 2)
+    cache.get("b")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_on_evict_is_called_for_every_removal(clock):
+    removed = []
+    cache = TTLLRUCache(maxsize=2, default_ttl=10, clock=clock, on_evict=lambda k, v: removed.append((k, v)))
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("c", 3)
+    assert removed == [("a", 1)]
+    cache.invalidate("b")
+    cache.invalidate("missing")
+    assert removed == [("a", 1), ("b", 2)]
+    clock.now += 10
+    assert cache.get("c") is None
+    assert removed[-1] == ("c", 3)
+    cache.set("d", 4)
+    cache.clear()
+    assert removed[-1] == ("d", 4)
+
+
+def test_purge_expired_removes_only_expired_entries(clock):
+    removed = []
+    cache = TTLLRUCache(maxsize=4, default_ttl=10, clock=clock, on_evict=lambda k, v: removed.append(k))
+    cache.set("old", 1, ttl=1)
+    cache.set("new", 2)
+    clock.now += 5
+    assert cache.purge_expired() == 1
+    assert removed == ["old"]
+    assert cache.get("new") == 2
@@ -0,0 +1,94 @@
+import pytest
+import requests
+
+import gas_client
+from gas_client import CircuitBreaker, GasClient, GasError, GasOutcomeUnknownError
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30, clock=clock)
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.state == "closed"
+        assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.retry_after() == 30
+
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_allows_a_single_probe_then_closes_on_success(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    clock.now += 29
+    assert breaker.state == "open"
+    clock.now += 1
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow() # probe ค้างอยู่: request อื่นยังไม่ผ่าน
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_for_a_full_reset_timeout(clock):
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30, clock=clock)
+    for _ in range(5): breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.retry_after() == 30
+    clock.now += 30
+    assert breaker.allow()
+
+
+class FakeSession:
+    """session.get ปลอม: raise error ที่กำหนดทุกครั้ง และนับจำนวนครั้งที่ถูกเรียก"""
+
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    def get(self, *args, **kwargs):
+        self.calls += 1
+        raise self.error
+
+
+def test_write_timeout_reports_unknown_outcome_without_retrying(clock):
+    session = FakeSession(requests.ReadTimeout("read timed out"))
+    client = GasClient("http://script.invalid/exec", session=session, breaker=CircuitBreaker(clock=clock))
+    with pytest.raises(GasOutcomeUnknownError):
+        client.call("write", {"line_id": "U1"}, idempotent=False)
+    assert session.calls == 1
+
+
+def test_write_that_never_connected_is_retried_and_reported_as_plain_failure(monkeypatch, clock):
+    monkeypatch.setattr(gas_client.time, "sleep", lambda seconds: None)
+    session = FakeSession(requests.ConnectTimeout("connect timed out"))
+    client = GasClient("http://script.invalid/exec", session=session, breaker=CircuitBreaker(clock=clock))
+    with pytest.raises(GasError) as excinfo:
+        client.call("write", {"line_id": "U1"}, idempotent=False)
+    assert not isinstance(excinfo.value, GasOutcomeUnknownError)
+    assert session.calls == gas_client.MAX_RETRIES + 1
+
+
+def test_unexpected_error_during_probe_releases_the_probe_slot(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    clock.now += 30
+    session = FakeSession(ValueError("bad params"))
+    client = GasClient("http://script.invalid/exec", session=session, breaker=breaker)
+    with pytest.raises(ValueError):
+        client.call("read")
+    assert breaker.state == "open"
+    clock.now += 30
+    assert breaker.allow() # probe ถัดไปได้ ไม่ค้างตลอดไป
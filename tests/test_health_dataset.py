@@ -0,0 +1,33 @@
+import pandas as pd
+
+from health_dataset import HealthDataset, clean_health_frame, compact_health_frame
+from utils import NUMERIC_SUFFIX
+
+
+def make_frame(rows=40):
+    return clean_health_frame(pd.DataFrame({
+        "HN": [str(1000 + i % 10) for i in range(rows)],
+        "Year": [2560 + i // 10 for i in range(rows)],
+        "ชื่อ-สกุล": [f"ทดสอบ{i % 10} นามสกุล" for i in range(rows)],
+        "เลขบัตรประชาชน": [str(1100000000000 + i % 10) for i in range(rows)],
+        "เพศ": ["ชาย" if i % 2 else "หญิง" for i in range(rows)],
+        "SBP": ["120" if i % 2 else "130" for i in range(rows)], # ข้อความที่ค่าซ้ำกันมาก
+        "DBP": [None if i % 8 else "80" for i in range(rows)],
+    }))
+
+
+def test_compaction_leaves_key_and_raw_lab_columns_dense():
+    df, report = compact_health_frame(make_frame())
+    assert isinstance(df["เพศ"].dtype, pd.CategoricalDtype)
+    for col in ("HN", "ชื่อ-สกุล", "เลขบัตรประชาชน", "SBP", "DBP"):
+        assert not isinstance(df[col].dtype, (pd.CategoricalDtype, pd.SparseDtype)), col
+    assert isinstance(df["DBP" + NUMERIC_SUFFIX].dtype, pd.SparseDtype)
+    assert df["SBP" + NUMERIC_SUFFIX].dtype == "float64"
+    assert report["category"] == 1 and report["sparse"] == 1
+
+
+def test_compaction_keeps_values():
+    raw = make_frame()
+    dataset = HealthDataset(raw)
+    expected = raw.sort_values(["HN", "Year"], kind="stable").reset_index(drop=True)
+    pd.testing.assert_frame_equal(dataset.df.astype(object), expected.astype(object), check_dtype=False)
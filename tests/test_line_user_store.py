@@ -0,0 +1,15 @@
+from line_user_store import LineUserStore
+
+
+def test_remote_registration_ignores_rows_written_only_locally(tmp_path):
+    sheet = []
+    store = LineUserStore(lambda: list(sheet), db_path=str(tmp_path / "users.db"))
+    store.upsert_local("สมชาย", "ใจดี", "U1", "1100000000001")
+    assert store.lookup("U1") is not None
+    assert not store.has_remote_registration("U1", "สมชาย", "ใจดี", "1100000000001")
+
+    sheet.append({"LINE User ID": "U1", "ชื่อ": "สมชาย", "นามสกุล": "ใจดี", "เลขบัตรประชาชน": "1100000000001"})
+    store.sync_once()
+    assert store.synced_since() > 0
+    assert store.has_remote_registration("U1", "สมชาย", "ใจดี", "1100000000001")
+    assert not store.has_remote_registration("U1", "สมหญิง", "ใจดี", "1100000000001")
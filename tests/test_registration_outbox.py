@@ -0,0 +1,134 @@
+import pytest
+
+import registration_outbox
+from registration_outbox import RegistrationOutbox
+
+
+class FakeSheet:
+    """send_fn / confirm_fn ปลอม: results คือผลของการส่งแต่ละครั้งตามลำดับ"""
+
+    def __init__(self, results=()):
+        self.results = list(results)
+        self.sent = []
+        self.rows = set()
+
+    def send(self, job):
+        self.sent.append(job["idempotency_key"])
+        ok = self.results.pop(0) if self.results else True
+        if ok is not False: self.rows.add(job["line_id"]) # ไม่ทราบผล = บันทึกไปแล้วจริง
+        return ok, "result"
+
+    def confirm(self, job):
+        return job["line_id"] in self.rows
+
+
+@pytest.fixture(autouse=True)
+def no_jitter(monkeypatch):
+    monkeypatch.setattr(registration_outbox.random, "uniform", lambda a, b: b)
+
+
+def make_outbox(tmp_path, sheet, confirm=True):
+    return RegistrationOutbox(sheet.send, sheet.confirm if confirm else None, db_path=str(tmp_path / "outbox.db"))
+
+
+def test_enqueue_is_idempotent(tmp_path):
+    sheet = FakeSheet()
+    outbox = make_outbox(tmp_path, sheet)
+    key = outbox.enqueue("สมชาย", "ใจดี", "U1", "1100000000001")
+    assert outbox.enqueue(" สมชาย ", "ใจดี", "U1", "1100000000001") == key
+    assert outbox.flush_once(now=0) == 1
+    assert sheet.sent == [key]
+    assert outbox.stats()["done"] == 1
+
+
+def test_returning_to_an_earlier_registration_is_sent_again(tmp_path):
+    sheet = FakeSheet()
+    outbox = make_outbox(tmp_path, sheet)
+    key_a = outbox.enqueue("สมชาย", "ใจดี", "U1", "1100000000001")
+    assert outbox.flush_once(now=0) == 1
+    key_b = outbox.enqueue("สมชาย", "ใจดีมาก", "U1", "1100000000001")
+    assert outbox.flush_once(now=1) == 1
+    assert outbox.enqueue("สมชาย", "ใจดี", "U1", "1100000000001") == key_a # A -> B -> A
+    assert outbox.enqueue("สมชาย", "ใจดี", "U1", "1100000000001") == key_a # กดซ้ำ: ไม่เพิ่มงาน
+    assert outbox.flush_once(now=2) == 1
+    assert sheet.sent == [key_a, key_b, key_a]
+    assert outbox.flush_once(now=10 ** 9) == 0
+
+
+def test_latest_registration_is_sent_last_when_both_are_queued(tmp_path):
+    sheet = FakeSheet()
+    outbox = make_outbox(tmp_path, sheet)
+    key_a = outbox.enqueue("สมชาย", "ใจดี", "U1")
+    key_b = outbox.enqueue("สมชาย", "ใจดีมาก", "U1")
+    outbox.enqueue("สมชาย", "ใจดี", "U1")
+    assert outbox.flush_once(now=0) == 2
+    assert sheet.sent == [key_b, key_a]
+
+
+def test_failed_send_is_retried_after_backoff(tmp_path):
+    sheet = FakeSheet(results=[False, True])
+    outbox = make_outbox(tmp_path, sheet)
+    outbox.enqueue("สมชาย", "ใจดี", "U1")
+    assert outbox.flush_once(now=0) == 0
+    assert outbox.stats()["pending"] == 1
+    delay = registration_outbox._retry_delay(1)
+    assert outbox.flush_once(now=delay - 1) == 0 # ยังไม่ถึงเวลา
+    assert outbox.flush_once(now=delay) == 1
+    assert len(sheet.sent) == 2
+
+
+def test_gives_up_after_max_attempts_and_requeues_on_new_enqueue(tmp_path, monkeypatch):
+    monkeypatch.setattr(registration_outbox, "OUTBOX_MAX_ATTEMPTS", 3)
+    sheet = FakeSheet(results=[False] * 3)
+    outbox = make_outbox(tmp_path, sheet)
+    outbox.enqueue("สมชาย", "ใจดี", "U1")
+    for day in range(1, 6): outbox.flush_once(now=day * 86400)
+    assert len(sheet.sent) == 3
+    assert outbox.stats()["failed"] == 1
+    outbox.enqueue("สมชาย", "ใจดี", "U1") # ผู้ใช้ลงทะเบียนซ้ำ: เริ่มคิวใหม่
+    assert outbox.flush_once(now=6 * 86400) == 1
+
+
+def test_unknown_outcome_is_confirmed_without_resending(tmp_path):
+    sheet = FakeSheet(results=[None])
+    outbox = make_outbox(tmp_path, sheet)
+    outbox.enqueue("สมชาย", "ใจดี", "U1")
+    assert outbox.flush_once(now=0) == 0
+    assert outbox.stats()["unconfirmed"] == 1
+    assert outbox.flush_once(now=registration_outbox.OUTBOX_CONFIRM_DELAY_SECONDS - 1) == 0
+    assert outbox.flush_once(now=registration_outbox.OUTBOX_CONFIRM_DELAY_SECONDS) == 1
+    assert len(sheet.sent) == 1
+    assert outbox.stats()["done"] == 1
+
+
+def test_unknown_outcome_is_resent_only_when_sheet_lacks_the_row(tmp_path):
+    sheet = FakeSheet(results=[None, True])
+    outbox = make_outbox(tmp_path, sheet)
+    outbox.enqueue("สมชาย", "ใจดี", "U1")
+    outbox.flush_once(now=0)
+    sheet.rows.clear() # สคริปต์ไม่ได้บันทึกจริง
+    assert outbox.flush_once(now=10 ** 9) == 1
+    assert len(sheet.sent) == 2
+
+
+def test_unknown_outcome_waits_while_sheet_cannot_be_checked(tmp_path):
+    sheet = FakeSheet(results=[None])
+    outbox = make_outbox(tmp_path, sheet)
+    outbox.enqueue("สมชาย", "ใจดี", "U1")
+    outbox.flush_once(now=0)
+    def sheet_down(job):
+        raise RuntimeError("sheet down")
+    outbox._confirm_fn = sheet_down
+    for now in (10 ** 6, 10 ** 7, 10 ** 8): outbox.flush_once(now=now)
+    assert len(sheet.sent) == 1
+    assert outbox.stats()["unconfirmed"] == 1
+
+
+def test_unknown_outcome_without_confirm_fn_is_never_resent(tmp_path):
+    sheet = FakeSheet(results=[None])
+    outbox = make_outbox(tmp_path, sheet, confirm=False)
+    outbox.enqueue("สมชาย", "ใจดี", "U1")
+    outbox.flush_once(now=0)
+    outbox.flush_once(now=10 ** 9)
+    assert len(sheet.sent) == 1
+    assert outbox.stats()["unconfirmed"] == 1
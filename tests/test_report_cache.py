@@ -0,0 +1,96 @@
+import os
+import stat
+
+import pytest
+
+from benchmark_batch_print import make_health_frame
+from health_dataset import HealthDataset
+from utils import NUMERIC_LAB_COLUMNS
+from report_cache import FragmentCache, content_digest, fragment_key
+
+
+LAB_COL = NUMERIC_LAB_COLUMNS[0]
+
+
+@pytest.fixture
+def dataset():
+    return HealthDataset(make_health_frame(3, 2), version="v1")
+
+
+def _record(dataset, hn):
+    history = dataset.patient_history(hn)
+    return history.iloc[-1].to_dict(), history
+
+
+def test_fragment_cache_evicts_least_recently_used():
+    cache = FragmentCache(maxsize=2, spill_dir="")
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert cache.get("a") == "A"
+    cache.set("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+
+
+def test_evicted_fragments_are_read_back_from_spill(tmp_path):
+    cache = FragmentCache(maxsize=1, spill_dir=str(tmp_path))
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert len(list(tmp_path.glob("*.html"))) == 1
+    assert cache.get("a") == "A"
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_spill_dir_and_files_are_private(tmp_path):
+    spill_dir = tmp_path / "fragments"
+    cache = FragmentCache(maxsize=1, spill_dir=str(spill_dir))
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert stat.S_IMODE(os.stat(spill_dir).st_mode) == 0o700
+    for path in spill_dir.glob("*.html"):
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_snapshot_change_drops_fragments_unused_since_the_previous_snapshot():
+    cache = FragmentCache(maxsize=10, spill_dir="")
+    cache.bind_snapshot("v1")
+    cache.set("old", "OLD")
+    cache.set("kept", "KEPT")
+    cache.bind_snapshot("v2")
+    assert cache.get("kept") == "KEPT"
+    cache.bind_snapshot("v3")
+    assert cache.get("old") is None
+    assert cache.get("kept") == "KEPT"
+
+
+def test_digest_uses_row_hashes_only_for_histories_the_dataset_issued(dataset):
+    person, history = _record(dataset, "100000")
+    assert dataset.history_hash_bytes(history) is not None
+    assert dataset.history_hash_bytes(history.copy()) is None
+    # ค่าเหมือนเดิม: digest ทั้งสองแบบต้องคงที่ข้ามการเรียก
+    assert content_digest(person, history, dataset) == content_digest(person, dataset.patient_history("100000"), dataset)
+    assert content_digest(person, history.copy(), dataset) == content_digest(person, history.copy(), dataset)
+
+
+def test_modified_copy_of_a_history_gets_a_different_key(dataset):
+    person, history = _record(dataset, "100000")
+    edited = history.copy()
+    edited.iloc[0, edited.columns.get_loc(LAB_COL)] = 999.0
+    assert edited.index.equals(history.index)
+    assert content_digest(person, edited, dataset) != content_digest(person, history, dataset)
+
+
+def test_fragment_key_changes_when_the_snapshot_data_changes(dataset):
+    person, history = _record(dataset, "100000")
+    key = fragment_key("main", person, content_digest(person, history, dataset))
+
+    df = dataset.df.copy()
+    df.loc[(df["HN"] == "100000") & (df["Year"] == df["Year"].min()), LAB_COL] = 999.0
+    updated = HealthDataset(df, version="v2", compact=False)
+    new_person, new_history = _record(updated, "100000")
+    assert new_person == person # แก้เฉพาะปีก่อน: แถวปีที่พิมพ์เหมือนเดิม แต่ประวัติเปลี่ยน
+    assert fragment_key("main", new_person, content_digest(new_person, new_history, updated)) != key
+
+    unchanged = HealthDataset(dataset.df.copy(), version="v3", compact=False)
+    same_person, same_history = _record(unchanged, "100000")
+    assert fragment_key("main", same_person, content_digest(same_person, same_history, unchanged)) == key
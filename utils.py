@@ -1,6 +1,30 @@
 import pandas as pd
 import numpy as np
 
+# --- Typed Numeric Columns ---
+# คอลัมน์ผลแล็บ/สัญญาณชีพที่ถูกแปลงเป็น float ไว้ครั้งเดียวตอนโหลดข้อมูล
+# เก็บไว้ในคอลัมน์ใหม่ "<ชื่อเดิม>__num" (คอลัมน์เดิมยังเป็นข้อความไว้ใช้แสดงผล)
+NUMERIC_SUFFIX = "__num"
+_HEARING_FREQS = ['500', '1k', '2k', '3k', '4k', '6k', '8k']
+NUMERIC_LAB_COLUMNS = (
+    ['น้ำหนัก', 'ส่วนสูง', 'รอบเอว', 'SBP', 'DBP', 'pulse', 'BMI',
+     'FBS', 'CHOL', 'TGL', 'HDL', 'LDL', 'BUN', 'Cr', 'GFR', 'Uric Acid', 'SGOT', 'SGPT', 'ALP',
+     'Hb(%)', 'HCT', 'WBC (cumm)', 'Ne (%)', 'Ly (%)', 'M', 'Eo', 'BA', 'Plt (/mm)',
+     'FVC', 'FVC predic', 'FVC เปอร์เซ็นต์', 'FEV1', 'FEV1 predic', 'FEV1เปอร์เซ็นต์',
+     'FEV1/FVC%', 'FEV1/FVC % pre', 'PEF', 'FEF25-75', 'FEF25-75 %',
+     'AVRต่ำ', 'AVLต่ำ', 'AVRสูง', 'AVLสูง']
+    + [f"{side}{freq}{base}" for side in ('R', 'L') for freq in _HEARING_FREQS for base in ('', 'B')]
+)
+NOT_TYPED = object()
+
+def get_typed_float(person_data, col):
+    """ค่า float ที่แปลงไว้ตอนโหลด (None = ว่าง/ไม่ใช่ตัวเลข) หรือ NOT_TYPED ถ้าคอลัมน์นี้ไม่ได้ถูกแปลงไว้"""
+    key = col + NUMERIC_SUFFIX
+    if key not in person_data: return NOT_TYPED
+    val = person_data[key]
+    if val is None or pd.isna(val): return None
+    return float(val)
+
 def is_empty(val):
     if val is None: return True
     if isinstance(val, str) and val.strip() == "": return True
@@ -1,12 +1,10 @@
 import streamlit as st
 import plotly.graph_objects as go
-import plotly.express as px
 import pandas as pd
 import numpy as np
 import textwrap
-import requests
-from streamlit_lottie import st_lottie
 from datetime import datetime
+from utils import get_typed_float, NOT_TYPED
 
 # --- DESIGN SYSTEM & CONSTANTS ---
 # ใช้ None เพื่อให้ Plotly ปรับสีตาม Theme ของ Streamlit อัตโนมัติ
@@ -27,6 +25,8 @@ THEME = {
 FONT_FAMILY = "Sarabun, sans-serif"
 
 def get_float(person_data, key):
+    typed = get_typed_float(person_data, key)
+    if typed is not NOT_TYPED: return typed
     val = person_data.get(key, "")
     if pd.isna(val) or str(val).strip().lower() in ["", "-", "none", "nan", "null"]: return None
     try: return float(str(val).replace(",", "").strip())